@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""This file measures how fast qick.parser assembles a large tProc v1 program.
+It doesn't need a board: the program is generated, written to a temporary file and assembled with parse_to_bin()."""
+import os
+import random
+import tempfile
+import time
+from qick.parser import parse_to_bin
+
+############
+# parameters
+############
+
+# number of instructions in the program (jump addresses are 16 bits, so at most 65536)
+n_inst = 60000
+# number of times to assemble it
+repeats = 5
+
+############
+
+rng = random.Random(0)
+
+def reg():
+    return "$%d" % rng.randrange(32)
+
+def imm():
+    if rng.random() < 0.2:
+        return hex(rng.randrange(2**31))
+    return str(rng.randrange(-2**30, 2**30))
+
+# one generator per instruction form: (page, channel, label) -> arguments
+FORMS = [
+    ('pushi', lambda p, ch, l: "%d, %s, %s, %d" % (p, reg(), reg(), rng.randrange(-2**30, 2**30))),
+    ('popi', lambda p, ch, l: "%d, %s" % (p, reg())),
+    ('mathi', lambda p, ch, l: "%d, %s, %s %s %s" % (p, reg(), reg(), rng.choice("+-*"), imm())),
+    ('seti', lambda p, ch, l: "%d, %d, %s, %d" % (ch, p, reg(), rng.randrange(2**30))),
+    ('synci', lambda p, ch, l: "%d" % rng.randrange(2**30)),
+    ('waiti', lambda p, ch, l: "%d, %d" % (ch, rng.randrange(2**30))),
+    ('bitwi', lambda p, ch, l: "%d, %s, %s %s %s" % (p, reg(), reg(), rng.choice(["&", "|", "^", "<<", ">>"]), imm())),
+    ('memri', lambda p, ch, l: "%d, %s, %d" % (p, reg(), rng.randrange(2**16))),
+    ('memwi', lambda p, ch, l: "%d, %s, %d" % (p, reg(), rng.randrange(2**16))),
+    ('regwi', lambda p, ch, l: "%d, %s, %s" % (p, reg(), imm())),
+    ('setbi', lambda p, ch, l: "%d, %d, %s, %d" % (ch, p, reg(), rng.randrange(2**30))),
+    ('loopnz', lambda p, ch, l: "%d, %s, @%s" % (p, reg(), l)),
+    ('condj', lambda p, ch, l: "%d, %s %s %s, @%s" % (p, reg(), rng.choice([">", ">=", "<", "<=", "==", "!="]), reg(), l)),
+    ('math', lambda p, ch, l: "%d, %s, %s %s %s" % (p, reg(), reg(), rng.choice("+-*"), reg())),
+    ('set', lambda p, ch, l: "%d, %d, %s" % (ch, p, ", ".join(reg() for i in range(6)))),
+    ('sync', lambda p, ch, l: "%d, %s" % (p, reg())),
+    ('read', lambda p, ch, l: "%d, %d, %s %s" % (ch, p, rng.choice(["upper", "lower"]), reg())),
+    ('wait', lambda p, ch, l: "%d, %d, %s" % (ch, p, reg())),
+    ('bitw', lambda p, ch, l: "%d, %s, %s %s %s" % (p, reg(), reg(), rng.choice(["&", "|", "^", "<<", ">>"]), reg())),
+    ('memr', lambda p, ch, l: "%d, %s, %s" % (p, reg(), reg())),
+    ('memw', lambda p, ch, l: "%d, %s, %s" % (p, reg(), reg())),
+    ('setb', lambda p, ch, l: "%d, %d, %s" % (ch, p, ", ".join(reg() for i in range(6)))),
+]
+
+def generate(n):
+    # a label every 20 instructions, and jumps to random labels (forward and backward)
+    n_labels = n//20
+    lines = ["// generated program"]
+    for i in range(n):
+        name, args = rng.choice(FORMS)
+        line = "%s %s; // comment" % (name, args(rng.randrange(8), rng.randrange(8), "L%d" % rng.randrange(n_labels)))
+        if i % 20 == 0:
+            line = "L%d: %s" % (i//20, line)
+        lines.append(line)
+    lines.append("end;")
+    return "\n".join(lines) + "\n"
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, "prog.asm")
+    with open(path, "w") as f:
+        f.write(generate(n_inst))
+    times = []
+    for i in range(repeats):
+        t_start = time.perf_counter()
+        binprog = parse_to_bin(path)
+        times.append(time.perf_counter() - t_start)
+print("%d instructions: best %.3f s, %.0f instructions/s" % (len(binprog), min(times), len(binprog)/min(times)))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""This file compares the throughput (shots/s) of the thread and process streamers while the main process is busy.
+Run it on the board. The load is Python threads spinning in the main process, which compete with a thread streamer for the GIL;
+the process streamer runs its readout loop in a separate process, so it should be unaffected."""
+import threading
+from qick import QickSoc, AveragerProgram
+from qick.streamer import DataStreamer, ProcessDataStreamer
+
+############
+# parameters
+############
+
+# shots per measurement
+reps = 500000
+# readout channels
+ro_chs = [0, 1]
+# readout window (decimated samples)
+ro_length = 10
+# time between shots; if the streamer can't keep up it will overflow the averages buffer, so increase this if that happens
+relax_us = 1.0
+# numbers of busy threads to test
+loads = [0, 1, 2, 4]
+
+############
+
+class ReadoutProgram(AveragerProgram):
+    def initialize(self):
+        cfg = self.cfg
+        for ch in cfg['ro_chs']:
+            if 'tproc_ctrl' in self.soccfg['readouts'][ch]:
+                self.declare_readout(ch=ch, length=cfg['ro_length'])
+            else:
+                self.declare_readout(ch=ch, length=cfg['ro_length'], freq=100)
+        self.synci(200)
+
+    def body(self):
+        self.trigger(adcs=self.ro_chs, adc_trig_offset=0)
+        self.wait_all()
+        self.sync_all(self.us2cycles(self.cfg['relax_us']))
+
+def spin(stop):
+    # pure-Python work, which holds the GIL
+    while not stop.is_set():
+        sum(range(1000))
+
+def measure(soc, prog, n_load):
+    """Run the program with n_load busy threads, and return the shot rate from the last streamer stats tuple
+    (time since the start, shots counted by the tProc, buffer address, shots in this transfer, stride).
+    """
+    stop = threading.Event()
+    threads = [threading.Thread(target=spin, args=(stop,), daemon=True) for i in range(n_load)]
+    for t in threads: t.start()
+    try:
+        prog.config_bufs(soc, enable_avg=True, enable_buf=False)
+        soc.start_readout(reps, counter_addr=prog.counter_addr, ch_list=list(prog.ro_chs),
+                          reads_per_shot=prog.reads_per_shot, zero_copy=True)
+        count = 0
+        while count < reps:
+            for newshots, (d, s) in soc.poll_data():
+                count += newshots
+                stats = s
+    finally:
+        stop.set()
+        for t in threads: t.join()
+    t, shots, addr, newshots, stride = stats
+    return shots/t
+
+soc = QickSoc()
+prog = ReadoutProgram(soc, {'reps': reps, 'ro_chs': ro_chs, 'ro_length': ro_length, 'relax_us': relax_us})
+prog.config_all(soc)
+print("programmed shot rate: %.0f shots/s" % (1e6/relax_us))
+print("%12s %14s %14s" % ("busy threads", "thread (sh/s)", "process (sh/s)"))
+results = {}
+for streamer_type in [DataStreamer, ProcessDataStreamer]:
+    # swap in the streamer type to test
+    soc.close()
+    soc._streamer = streamer_type(soc)
+    results[streamer_type] = [measure(soc, prog, n) for n in loads]
+soc.close()
+for i, n in enumerate(loads):
+    print("%12d %14.0f %14.0f" % (n, results[DataStreamer][i], results[ProcessDataStreamer][i]))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""This file measures the throughput (shots/s) of the streaming readout against the number of readout channels.
+Run it on the board. Each measurement runs a program that triggers a set of readouts as fast as the relax time allows,
+and reads the throughput from the stats that the streamer passes along with each transfer."""
+import numpy as np
+from qick import QickSoc, AveragerProgram
+
+############
+# parameters
+############
+
+# shots per measurement
+reps = 200000
+# readout window (decimated samples)
+ro_length = 10
+# time between shots; if the streamer can't keep up it will overflow the averages buffer, so increase this if that happens
+relax_us = 2.0
+# streamer stride (None for the default, or "adaptive")
+stride = None
+
+############
+
+class ReadoutProgram(AveragerProgram):
+    def initialize(self):
+        cfg = self.cfg
+        for ch in cfg['ro_chs']:
+            if 'tproc_ctrl' in self.soccfg['readouts'][ch]:
+                self.declare_readout(ch=ch, length=cfg['ro_length'])
+            else:
+                self.declare_readout(ch=ch, length=cfg['ro_length'], freq=100)
+        self.synci(200)
+
+    def body(self):
+        self.trigger(adcs=self.ro_chs, adc_trig_offset=0)
+        self.wait_all()
+        self.sync_all(self.us2cycles(self.cfg['relax_us']))
+
+def measure(soc, ro_chs):
+    """Run the program on the given readout channels, and collect the streamer stats.
+
+    Each stats tuple is (time since the start, shots counted by the tProc, buffer address of the last channel, shots in this transfer, stride).
+    """
+    cfg = {'reps': reps, 'ro_chs': ro_chs, 'ro_length': ro_length, 'relax_us': relax_us}
+    prog = ReadoutProgram(soc, cfg)
+    prog.config_all(soc)
+    prog.config_bufs(soc, enable_avg=True, enable_buf=False)
+    soc.start_readout(reps, counter_addr=prog.counter_addr, ch_list=list(prog.ro_chs),
+                      reads_per_shot=prog.reads_per_shot, stride=stride)
+    stats = []
+    count = 0
+    while count < reps:
+        for newshots, (d, s) in soc.poll_data():
+            count += newshots
+            stats.append(s)
+    return stats
+
+soc = QickSoc()
+n_ro = len(soc['readouts'])
+print("programmed shot rate: %.0f shots/s" % (1e6/relax_us))
+print("%10s %12s %12s %14s" % ("channels", "shots/s", "transfers", "shots/transfer"))
+for n in range(1, n_ro+1):
+    stats = measure(soc, list(range(n)))
+    t, shots, addr, newshots, last_stride = stats[-1]
+    print("%10d %12.0f %12d %14.1f" % (n, shots/t, len(stats), np.mean([s[3] for s in stats])))
@@ -4,13 +4,15 @@ Assembly language wrapper class and auxiliary functions for the v1 tProcessor.
 import logging
 import numpy as np
 import json
+from array import array
 from collections import namedtuple, OrderedDict, defaultdict
 from typing import Union, List
 from abc import ABC, abstractmethod
 
 from .qick_asm import AbsQickProgram, AcquireMixin
-from .helpers import ch2list, check_keys
+from .helpers import ch2list, check_keys, RegisterAllocator
 from .parser import parse_prog
+from .compile_cache import compile_cache
 
 RegisterType = ["freq", "time", "phase", "adc_freq"]
 DefaultUnits = {"freq": "MHz", "time": "us", "phase": "deg", "adc_freq": "MHz"}
@@ -504,6 +506,168 @@ class MultiplexedGenManager(AbsGenManager):
             self.next_pulse['regs'].append([self.regmap[(self.ch,x)][1] for x in ['freq', 'phase', '0', '0', '0']])
             self.next_pulse['length'] = params['length']
 
+# Marks an instruction without a comment (an instruction can have a comment of None, which prints as an empty comment).
+NO_COMMENT = object()
+
+class FrozenDict(dict):
+    """A dict that can't be modified, used for the instructions in QickProgram.prog_list.
+    It serializes (to JSON or by pickling) like a plain dict.
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("prog_list is read-only; assign a new list to QickProgram.prog_list to change the program")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+class InstructionBuffer():
+    """Compact storage for the instructions of a v1 program.
+
+    Instead of a dict per instruction, the buffer keeps an array of instruction IDs and a fixed-width array of arguments.
+    String arguments (labels and operators) are stored as indices into a table of strings, with a bitmask per instruction marking which arguments are strings.
+    Labels and comments, which most instructions don't have, are kept in dicts keyed by instruction index.
+
+    Parameters
+    ----------
+    instructions : dict
+        The instruction set (see QickProgram.instructions)
+    string_args : dict
+        For each instruction name, the positions of the arguments that may be strings; all other arguments must be ints
+    """
+    def __init__(self, instructions, string_args):
+        self.names = list(instructions.keys())
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.nargs = [max([f[0] for f in idef['fmt']]+[-1])+1 for idef in instructions.values()]
+        self.string_args = [string_args.get(name, []) for name in self.names]
+        self.width = max(self.nargs)
+        # zeros to fill the unused arguments of each instruction
+        self._padding = [(0,)*(self.width-n) for n in range(self.width+1)]
+        # positions of the set bits in each possible string bitmask
+        self._string_positions = [[i for i in range(self.width) if (mask >> i) & 1] for mask in range(2**self.width)]
+        self.clear()
+
+    def clear(self):
+        """Remove all instructions.
+        """
+        self.opcodes = array('B')
+        self.args = array('q')
+        self.strmasks = array('B')
+        self.strings = []
+        self._string_ids = {}
+        self.labels = {}
+        self.comments = {}
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def append(self, name, args, label=None, comment=NO_COMMENT):
+        """Add an instruction.
+
+        Parameters
+        ----------
+        name : str
+            Instruction name
+        args : tuple
+            Instruction arguments (ints, or strings for labels and operators)
+        label : str
+            Label for this instruction
+        comment : str
+            Comment for this instruction
+        """
+        index = len(self.opcodes)
+        opcode = self.ids[name]
+        strmask = 0
+        if self.string_args[opcode]:
+            # replace strings by their indices in the string table
+            args = list(args)
+            for i in self.string_args[opcode]:
+                arg = args[i]
+                if isinstance(arg, str):
+                    strmask |= 1 << i
+                    if arg not in self._string_ids:
+                        self._string_ids[arg] = len(self.strings)
+                        self.strings.append(arg)
+                    args[i] = self._string_ids[arg]
+            args = tuple(args)
+        # convert the arguments first, so a bad argument doesn't leave a partial instruction
+        self.args.extend(array('q', args + self._padding[len(args)]))
+        self.opcodes.append(opcode)
+        self.strmasks.append(strmask)
+        if comment is not NO_COMMENT:
+            self.comments[index] = comment
+        if label is not None:
+            self.labels[index] = label
+
+    def get_args(self, index):
+        """Get the arguments of an instruction.
+
+        Parameters
+        ----------
+        index : int
+            Instruction index
+
+        Returns
+        -------
+        tuple
+            Instruction arguments
+        """
+        start = index*self.width
+        return self._decode_args(self.args[start:start+self.nargs[self.opcodes[index]]].tolist(), self.strmasks[index])
+
+    def _decode_args(self, row, strmask):
+        # replace string indices by strings, in place
+        if strmask:
+            for i in self._string_positions[strmask]:
+                row[i] = self.strings[row[i]]
+        return tuple(row)
+
+    def rows(self):
+        """Iterate over the instructions.
+
+        Yields
+        ------
+        tuple
+            name, args, comment (NO_COMMENT if the instruction has no comment), label (None if the instruction has no label)
+        """
+        width = self.width
+        allargs = self.args.tolist()
+        for index, (opcode, strmask) in enumerate(zip(self.opcodes, self.strmasks)):
+            start = index*width
+            args = self._decode_args(allargs[start:start+self.nargs[opcode]], strmask)
+            yield self.names[opcode], args, self.comments.get(index, NO_COMMENT), self.labels.get(index)
+
+    def to_list(self):
+        """Convert to the list-of-dicts representation of a program.
+        The list and dicts are read-only, since changing them would not change the buffer.
+
+        Returns
+        -------
+        tuple of FrozenDict
+            One dict per instruction, with keys 'name', 'args', and 'comment' and 'label' if present
+        """
+        prog_list = []
+        for name, args, comment, label in self.rows():
+            inst = {'name': name, 'args': args}
+            if comment is not NO_COMMENT:
+                inst['comment'] = comment
+            if label is not None:
+                inst['label'] = label
+            prog_list.append(FrozenDict(inst))
+        return tuple(prog_list)
+
+    def digest_parts(self):
+        """Get the contents of the buffer, in a form suitable for computing a cache key (see CompileCache.key()).
+
+        Returns
+        -------
+        list
+            bytes and JSON-serializable objects
+        """
+        return [self.names, self.opcodes.tobytes(), self.args.tobytes(), self.strmasks.tobytes(),
+                self.strings, sorted(self.labels.items()), sorted(self.comments.items())]
+
 class QickProgram(AbsQickProgram):
     """QickProgram is a Python representation of the QickSoc processor assembly program. It can be used to compile simple assembly programs and also contains macros to help make it easy to configure and schedule pulses."""
     # Instruction set for the tproc describing how to automatically generate methods for these instructions
@@ -570,7 +734,11 @@ class QickProgram(AbsQickProgram):
             raise RuntimeError("tProc v1 programs can only be run on a tProc v1 firmware")
 
         # List of commands. This may include comments.
-        self.prog_list = []
+        string_args = {name: [iarg for iarg, conversion in conversions.items() if conversion in ['label', 'op']]
+                       for name, (base, fmt, conversions) in self._get_layouts().items()}
+        self._insts = InstructionBuffer(self.instructions, string_args)
+        # The same, as a list of dicts: generated when needed.
+        self._prog_list = None
 
         # Label to apply to the next instruction.
         self._label_next = None
@@ -1162,6 +1330,91 @@ class QickProgram(AbsQickProgram):
         else:
             return val
 
+    @classmethod
+    def _get_layouts(cls):
+        """Get the encoding of each instruction in the instruction set.
+        This is computed once per class, and cached.
+
+        Returns
+        -------
+        dict
+            For each instruction name: the fixed bits of the machine code, the argument fields (from the instruction set),
+            and the conversions to apply to arguments before encoding them ('imm', 'label' or 'op', keyed by argument index).
+        """
+        if '_layouts' not in cls.__dict__:
+            layouts = {}
+            for name, idef in cls.instructions.items():
+                if name == 'comment':
+                    continue
+                fmt = idef['fmt']
+                base = idef['bin'] << 56
+                conversions = {}
+                if idef['type'] == "I":
+                    conversions[len(fmt)-1] = 'imm'
+                if name == 'loopnz':
+                    conversions[2] = 'label'
+                    base |= 0b1000 << 46
+                if name == 'condj':
+                    conversions[4] = 'label'
+                    conversions[2] = 'op' # conditional op code
+                if name[:4] in ['math', 'bitw']:
+                    conversions[3] = 'op' # math or bitwise op code
+                if name[:4] == 'read':
+                    conversions[2] = 'op' # read op code
+                layouts[name] = (base, fmt, conversions)
+            cls._layouts = layouts
+        return cls._layouts
+
+    @classmethod
+    def _get_encoders(cls):
+        """Get the encoder function for each instruction in the instruction set.
+        The functions are built from the instruction layouts once per class, and cached.
+        Each function ORs the argument fields into the fixed bits of the machine code, converting the arguments that need it,
+        and raises RuntimeError if a field is negative or doesn't fit in the 64-bit word.
+
+        Returns
+        -------
+        dict
+            For each instruction name: a function of (args, labels, op_codes, imm), where imm is the function that converts immediate values.
+        """
+        if '_encoders' not in cls.__dict__:
+            converters = {'imm': lambda arg, labels, op_codes, imm: imm(arg),
+                          'label': lambda arg, labels, op_codes, imm: labels[arg],
+                          'op': lambda arg, labels, op_codes, imm: op_codes[arg]}
+
+            def make_encoder(name, base, fmt, conversions):
+                # (argument index, bit position, converter or None) for each field
+                fields = [(iarg, pos, converters.get(conversions.get(iarg))) for iarg, pos in fmt]
+                def encoder(args, labels, op_codes, imm):
+                    mcode = base
+                    for iarg, pos, convert in fields:
+                        arg = args[iarg]
+                        if convert is not None:
+                            arg = convert(arg, labels, op_codes, imm)
+                        # negative values, or values that would overflow 64 bits
+                        if arg < 0 or arg >> (64-pos):
+                            raise RuntimeError("argument %d of %s instruction is out of range: %d" % (iarg, name, arg))
+                        mcode |= arg << pos
+                    return mcode
+                return encoder
+
+            cls._encoders = {name: make_encoder(name, *layout) for name, layout in cls._get_layouts().items()}
+        return cls._encoders
+
+    @classmethod
+    def _get_isa_digest(cls):
+        """Get a digest of the instruction set, for use in the keys of the compile cache (see CompileCache.key()).
+        Like the encoders, this is computed once per class, and cached.
+
+        Returns
+        -------
+        str
+            hex digest of the instruction table and the operator codes
+        """
+        if '_isa_digest' not in cls.__dict__:
+            cls._isa_digest = compile_cache.key(cls.instructions, cls.op_codes)
+        return cls._isa_digest
+
     def compile_instruction(self, inst, labels, debug=False):
         """Converts an assembly instruction into a machine bytecode.
 
@@ -1180,69 +1433,123 @@ class QickProgram(AbsQickProgram):
             Compiled instruction in binary
 
         """
-        args = list(inst['args'])
-        idef = self.__class__.instructions[inst['name']]
-        fmt = idef['fmt']
-
         if debug:
             print(inst)
+        encoder = self._get_encoders()[inst['name']]
+        return encoder(inst['args'], labels, self.__class__.op_codes, self.convert_immediate)
 
-        if idef['type'] == "I":
-            args[len(fmt)-1] = self.convert_immediate(args[len(fmt)-1])
-
-        if inst['name'] == 'loopnz':
-            args[2] = labels[args[2]]  # resolve label
-
-        if inst['name'] == 'condj':
-            args[4] = labels[args[4]]  # resolve label
-            # get binary condtional op code
-            args[2] = self.__class__.op_codes[inst['args'][2]]
-
-        if inst['name'][:4] == 'math':
-            args[3] = self.__class__.op_codes[inst['args'][3]]  # get math op code
+    def _compile_group(self, name, args, strmasks, tables):
+        """Converts all the instances of one instruction into machine bytecode, using array operations.
 
-        if inst['name'][:4] == 'bitw':
-            # get bitwise op code
-            args[3] = self.__class__.op_codes[inst['args'][3]]
-
-        if inst['name'][:4] == 'read':
-            args[2] = self.__class__.op_codes[inst['args'][2]]  # get read op code
-
-        mcode = (idef['bin'] << 56)
-        # print(inst)
-        for field in fmt:
-            mcode |= (args[field[0]] << field[1])
-
-        if inst['name'] == 'loopnz':
-            mcode |= (0b1000 << 46)
+        Parameters
+        ----------
+        name : str
+            Instruction name
+        args : numpy.ndarray
+            Instruction arguments, one row per instruction (strings are replaced by their indices in the buffer's string table)
+        strmasks : numpy.ndarray
+            Bitmask of the string arguments of each instruction
+        tables : dict
+            For 'label' and 'op': the value of each string in the buffer's string table, or -1 if not defined
 
-        return mcode
+        Returns
+        -------
+        numpy.ndarray
+            Compiled instructions as uint64, or None if the arguments can't be encoded this way
+            (bad arguments are then caught by compile_instruction())
+        """
+        base, fmt, conversions = self._get_layouts()[name]
+        strmask = sum([1 << iarg for iarg, conversion in conversions.items() if conversion in ['label', 'op']])
+        if np.any(strmasks != strmask):
+            return None
+        mcodes = np.full(len(args), base, dtype=np.uint64)
+        for iarg, pos in fmt:
+            col = args[:, iarg]
+            conversion = conversions.get(iarg)
+            if conversion in tables:
+                col = tables[conversion][col]
+            elif conversion == 'imm':
+                # same as convert_immediate()
+                if np.any(col > 2**31):
+                    return None
+                col = np.where(col < 0, col + 2**31, col)
+            # negative values, or values that would overflow 64 bits
+            if np.any(col < 0) or np.any(col >> (63-pos) > 1):
+                return None
+            mcodes |= col.astype(np.uint64) << np.uint64(pos)
+        return mcodes
 
     def compile(self, debug=False):
-        """Compiles program to machine code.
+        """Compiles program to machine code, and stores it in self.binprog as an array of uint64.
+        The result is cached (see compile_cache), so compiling an identical program again is fast.
 
         Parameters
         ----------
         debug : bool
             If True, debug mode is on
-
-        Returns
-        -------
-        list of int
-            List of binary instructions
         """
+        insts = self._insts
+        opcodes = np.frombuffer(insts.opcodes, dtype=np.uint8)
+        # skip comment lines
+        keep = opcodes != insts.ids['comment']
+        prog_counters = np.cumsum(keep) - 1
+        # Scan the ASM instructions for labels.
         labels = {}
-        # Scan the ASM instructions for labels. Skip comment lines.
-        prog_counter = 0
-        for inst in self.prog_list:
-            if inst['name']=='comment':
+        for index, label in sorted(insts.labels.items()):
+            if not keep[index]:
                 continue
-            if 'label' in inst:
-                if inst['label'] in labels:
-                    raise RuntimeError("label used twice:", inst['label'])
-                labels[inst['label']] = prog_counter
-            prog_counter += 1
-        self.binprog = [self.compile_instruction(inst, labels, debug=debug) for inst in self.prog_list if inst['name']!='comment']
+            if label in labels:
+                raise RuntimeError("label used twice:", label)
+            labels[label] = int(prog_counters[index])
+
+        key = None
+        if compile_cache.enabled and not debug:
+            key = compile_cache.key('v1', self._get_isa_digest(), self.tproccfg, *insts.digest_parts())
+            cached = compile_cache.get(key)
+            if cached is not None:
+                self.binprog = cached['binprog']
+                return
+        if debug:
+            self.binprog = np.array([self.compile_instruction(inst, labels, debug=debug) for inst in self.prog_list if inst['name']!='comment'], dtype=np.uint64)
+        else:
+            rows = np.flatnonzero(keep)
+            opcodes = opcodes[rows]
+            args = np.frombuffer(insts.args, dtype=np.int64).reshape(-1, insts.width)[rows]
+            strmasks = np.frombuffer(insts.strmasks, dtype=np.uint8)[rows]
+            tables = {'label': np.array([labels.get(x, -1) for x in insts.strings] + [-1], dtype=np.int64),
+                      'op': np.array([self.__class__.op_codes.get(x, -1) for x in insts.strings] + [-1], dtype=np.int64)}
+            self.binprog = np.zeros(len(rows), dtype=np.uint64)
+            for opcode in np.unique(opcodes):
+                name = insts.names[opcode]
+                indices = np.flatnonzero(opcodes == opcode)
+                mcodes = self._compile_group(name, args[indices], strmasks[indices], tables)
+                if mcodes is None:
+                    # encode one by one, which raises the appropriate error
+                    encoder = self._get_encoders()[name]
+                    mcodes = [encoder(insts.get_args(i), labels, self.__class__.op_codes, self.convert_immediate) for i in rows[indices]]
+                self.binprog[indices] = mcodes
+        if key is not None:
+            compile_cache.put(key, {'binprog': self.binprog})
+
+    @property
+    def prog_list(self):
+        """The program, as a list of dicts, one per instruction or comment.
+        Each dict has keys 'name' and 'args', and 'comment' and 'label' if present.
+
+        This is a read-only view generated from the instruction buffer (a tuple of read-only dicts),
+        so code that tries to edit it in place fails instead of silently having no effect;
+        assign a new list to replace the program.
+        """
+        if self._prog_list is None:
+            self._prog_list = self._insts.to_list()
+        return self._prog_list
+
+    @prog_list.setter
+    def prog_list(self, prog_list):
+        self._insts.clear()
+        for inst in prog_list:
+            self._insts.append(inst['name'], tuple(inst['args']), inst.get('label'), inst.get('comment', NO_COMMENT))
+        self._prog_list = None
 
     def append_instruction(self, name, *args):
         """Append instruction to the program list
@@ -1254,18 +1561,16 @@ class QickProgram(AbsQickProgram):
         *args : dict
             Instruction arguments
         """
-        n_args = max([f[0] for f in self.instructions[name]['fmt']]+[-1])+1
+        n_args = self._insts.nargs[self._insts.ids[name]]
         if len(args)==n_args:
-            inst = {'name': name, 'args': args}
+            self._insts.append(name, args, self._label_next)
         elif len(args)==n_args+1:
-            inst = {'name': name, 'args': args[:n_args], 'comment': args[n_args]}
+            self._insts.append(name, args[:n_args], self._label_next, args[n_args])
         else:
             raise RuntimeError("wrong number of args:", name, args)
-        if self._label_next is not None:
-            # store the label with the instruction, for printing
-            inst['label'] = self._label_next
-            self._label_next = None
-        self.prog_list.append(inst)
+        # the label is stored with the instruction, for printing
+        self._label_next = None
+        self._prog_list = None
 
     def label(self, name):
         """Add line number label to the labels dictionary. This labels the instruction by its position in the program list. The loopz and condj commands use this label information.
@@ -1328,27 +1633,27 @@ class QickProgram(AbsQickProgram):
         str
             asm file
         """
-        label_list = [inst['label'] for inst in self.prog_list if 'label' in inst]
-        if label_list:
-            max_label_len = max([len(label) for label in label_list])
+        insts = self._insts
+        if insts.labels:
+            max_label_len = max([len(label) for label in insts.labels.values()])
         else:
             max_label_len = 0
         s = "\n// Program\n\n"
-        lines = [self._inst2asm(inst, max_label_len) for inst in self.prog_list]
+        templates = {name: name + " " + idef['repr'] + ";" for name, idef in self.__class__.instructions.items() if name!='comment'}
+        indent = " "*(max_label_len+2)
+        lines = []
+        for name, args, comment, label in insts.rows():
+            if name=='comment':
+                lines.append("// "+comment)
+                continue
+            line = indent + templates[name].format(*args)
+            if comment is not NO_COMMENT:
+                line += " "*(48-len(line)) + "//" + (comment if comment is not None else "")
+            if label is not None:
+                line = label + ": " + line[len(label)+2:]
+            lines.append(line)
         return s+"\n".join(lines)
 
-    def _inst2asm(self, inst, max_label_len):
-        if inst['name']=='comment':
-            return "// "+inst['comment']
-        template = inst['name'] + " " + self.__class__.instructions[inst['name']]['repr'] + ";"
-        line = " "*(max_label_len+2) + template.format(*inst['args'])
-        if 'comment' in inst:
-            line += " "*(48-len(line)) + "//" + (inst['comment'] if inst['comment'] is not None else "")
-        if 'label' in inst:
-            label = inst['label']
-            line = label + ": " + line[len(label)+2:]
-        return line
-
     def compare_program(self, fname):
         """For debugging purposes to compare binary compilation of parse_prog with the compile.
 
@@ -1380,7 +1685,7 @@ class QickProgram(AbsQickProgram):
         :return: number of instructions in the program
         :rtype: int
         """
-        return len(self.prog_list)
+        return len(self._insts)
 
     def __str__(self):
         """
@@ -1555,9 +1860,15 @@ class QickRegisterManagerMixin:
 
     def __init__(self, *args, **kwargs):
         self.user_reg_dict = {}  # look up dict for registers defined in each generator channel
-        self._user_regs = []  # (page, addr) of all user defined registers
+        self._user_regs = {}  # for each page, the addresses of user defined registers (RegisterAllocator)
         super().__init__(*args, **kwargs)
 
+    def _page_regs(self, page):
+        # user registers are addresses 1-12 of each page
+        if page not in self._user_regs:
+            self._user_regs[page] = RegisterAllocator(13, start=1)
+        return self._user_regs[page]
+
     def new_reg(self, page: int, addr: int = None, name: str = None, init_val=None, reg_type: str = None,
                 gen_ch: int = None, ro_ch: int = None):
         """ Declare a new register in a specific page.
@@ -1573,18 +1884,16 @@ class QickRegisterManagerMixin:
         :param ro_ch: readout channel numer to which the register is associated with, for unit convert.
         :return: QickRegister
         """
+        page_regs = self._page_regs(page)
         if addr is None:
-            addr = 1
-            while (page, addr) in self._user_regs:
-                addr += 1
-            if addr > 12:
+            addr = page_regs.first_free()
+            if addr is None:
                 raise RuntimeError(f"registers in page {page} is full.")
         else:
             if addr < 1 or addr > 12:
                 raise ValueError(f"register address must be greater than 0 and smaller than 13")
-            if (page, addr) in self._user_regs:
+            if addr in page_regs:
                 raise ValueError(f"register at address {addr} in page {page} is already occupied.")
-        self._user_regs.append((page, addr))
 
         if name is None:
             name = f"reg_page{page}_{addr}"
@@ -1593,6 +1902,7 @@ class QickRegisterManagerMixin:
 
         reg = QickRegister(self, page, addr, reg_type, gen_ch, ro_ch, init_val, name=name)
         self.user_reg_dict[name] = reg
+        page_regs.add(addr)
 
         return reg
 
@@ -1632,9 +1942,9 @@ class QickRegisterManagerMixin:
         gen_cgf = self.gen_chs[gen_ch]
         page = self.ch_page(gen_ch)
 
-        addr = 1
-        while (page, addr) in self._user_regs:
-            addr += 1
+        addr = self._page_regs(page).first_free()
+        if addr is None:
+            raise RuntimeError(f"registers in page {page} is full.")
         if name is None:
             name = f"gen{gen_ch}_reg{addr}"
 
@@ -1642,3 +1952,11 @@ class QickRegisterManagerMixin:
             return self.new_reg(page, addr, name, init_val, reg_type, None, None)
         else:
             return self.new_reg(page, addr, name, init_val, reg_type, gen_ch, gen_cgf.get("ro_ch"))
+
+    def get_reg_stats(self):
+        """
+        Get usage statistics for the user registers (addresses 1-12) of each page where registers have been declared.
+
+        :return: dict of page number to dict with the number of registers available, in use, and free
+        """
+        return {page: regs.get_stats() for page, regs in sorted(self._user_regs.items())}
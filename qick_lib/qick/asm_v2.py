@@ -1,6 +1,8 @@
 from __future__ import annotations
 import logging
+import functools
 import numpy as np
+import json
 import textwrap
 from collections import namedtuple, OrderedDict, defaultdict
 from collections.abc import Mapping
@@ -11,7 +13,8 @@ from fractions import Fraction
 
 from .tprocv2_assembler import Assembler
 from .qick_asm import AbsQickProgram, AcquireMixin
-from .helpers import to_int, check_bytes, check_keys
+from .helpers import to_int, check_bytes, check_keys, NpEncoder, RegisterAllocator
+from .compile_cache import compile_cache
 
 logger = logging.getLogger(__name__)
 
@@ -174,6 +177,19 @@ class QickSweepRaw(SimpleClass):
         spanmax = max([max(r, 0) for r in self.spans.values()])
         return self.start + spanmax
 
+@functools.lru_cache(maxsize=4096)
+def _pack_waveform(startvals):
+    # convert to bytes to get a 168-bit word (this is what actually ends up in the wave memory)
+    # we truncate each parameter to its correct length using mod
+    # some generator parameter lengths are smaller than the waveform parameter length:
+    # e.g. int4 uses 16 bits for all params, full-speed uses 16 bits for length
+    # in these cases the sg_translator will apply the additional truncation
+    # truncation causes parameters to wrap, which is good for some params (freq, phase) not for others (gain, length)
+    # the result only depends on the parameter values, so it's cached: programs that share waveforms (e.g. points of a sweep) only pack each one once
+    rawbytes = b''.join([int(i%2**(8*w)).to_bytes(length=w, byteorder='little', signed=False) for i, w in zip(startvals, Waveform.widths)])
+    # pad with zero bytes to get the 256-bit word (this is the format for DMA transfers)
+    return rawbytes[:11]+bytes(1)+rawbytes[11:]+bytes(10)
+
 class Waveform(Mapping, SimpleClass):
     widths = [4, 4, 3, 4, 4, 2]
     _fields = ['name', 'freq', 'phase', 'env', 'gain', 'length', 'conf']
@@ -187,22 +203,15 @@ class Waveform(Mapping, SimpleClass):
         # name is assigned when the parent pulse is processed to fill the wave list
         self.name = name
 
-    def compile(self):
+    def startvals(self):
         # use the field ordering, skipping the name
         params = [getattr(self, f) for f in self._fields[1:]]
         # if a parameter is swept, the start value is what we write to the wave memory
-        startvals = [x.start if isinstance(x, QickSweepRaw) else x for x in params]
-        # convert to bytes to get a 168-bit word (this is what actually ends up in the wave memory)
-        # we truncate each parameter to its correct length using mod
-        # some generator parameter lengths are smaller than the waveform parameter length:
-        # e.g. int4 uses 16 bits for all params, full-speed uses 16 bits for length
-        # in these cases the sg_translator will apply the additional truncation
-        # truncation causes parameters to wrap, which is good for some params (freq, phase) not for others (gain, length)
-        rawbytes = b''.join([int(i%2**(8*w)).to_bytes(length=w, byteorder='little', signed=False) for i, w in zip(startvals, self.widths)])
-        # pad with zero bytes to get the 256-bit word (this is the format for DMA transfers)
-        paddedbytes = rawbytes[:11]+bytes(1)+rawbytes[11:]+bytes(10)
+        return tuple([x.start if isinstance(x, QickSweepRaw) else x for x in params])
+
+    def compile(self):
         # pack into a numpy array
-        return np.frombuffer(paddedbytes, dtype=np.int32)
+        return np.frombuffer(_pack_waveform(self.startvals()), dtype=np.int32)
     def sweeps(self):
         return [r for r in [self.freq, self.phase, self.gain, self.length] if isinstance(r, QickSweepRaw)]
     def fill_steps(self, loops):
@@ -265,7 +274,7 @@ class QickRegister(SimpleClass):
 
 class Macro(SimpleNamespace):
     def translate(self, prog):
-        logger.debug("translating %s" % (self))
+        logger.debug("translating %s", self)
         # translate to ASM and push to prog_list
         insts = self.expand(prog)
         for inst in insts:
@@ -286,7 +295,7 @@ class Macro(SimpleNamespace):
         # return actual (rounded, stepped) time value
         t_reg = prog.us2cycles(t)
         if isinstance(t_reg, QickSweepRaw):
-            t_reg = prog.new_reg(sweep=t_reg)
+            t_reg = prog._get_sweep_reg(t_reg)
             t_reg.sweep.to_steps(prog.loop_dict)
             t_rounded = prog.cycles2us(t_reg.sweep)
         else:
@@ -306,12 +315,12 @@ class Macro(SimpleNamespace):
 
 class AsmInst(Macro):
     def translate(self, prog):
-        logger.debug("adding ASM %s, addr_inc=%d" % (self.inst, self.addr_inc))
+        logger.debug("adding ASM %s, addr_inc=%d", self.inst, self.addr_inc)
         prog._add_asm(self.inst.copy(), self.addr_inc)
 
 class Label(Macro):
     def translate(self, prog):
-        logger.debug("adding label %s" % (self.label))
+        logger.debug("adding label %s", self.label)
         prog._add_label(self.label)
 
 class End(Macro):
@@ -1019,6 +1028,10 @@ class QickProgramV2(AbsQickProgram):
         # high-level program structure
 
         self.reg_dict = {}  # lookup dict for registers defined
+        # addresses in use (a tProc v1 has no dreg_qty, but __init__ will reject it anyway)
+        self._reg_alloc = RegisterAllocator(self.tproccfg.get('dreg_qty', 0))
+        self._sweep_regs = {}  # registers holding sweeps, keyed by sweep values
+        self._shared_sweeps = 0  # sweeps that reused the register of an identical sweep
 
         self.loop_dict = OrderedDict()
         self.loop_stack = []
@@ -1047,14 +1060,12 @@ class QickProgramV2(AbsQickProgram):
         self._make_binprog()
 
     def _compile_prog(self):
-        _, p_mem = Assembler.list2bin(self.prog_list, self.labels)
-        return p_mem
+        return Assembler.list2array(self.prog_list, self.labels)
 
     def _compile_waves(self):
-        if self.waves:
-            return np.stack([w.compile() for w in self.waves])
-        else:
-            return np.zeros((0,8), dtype=np.int32)
+        # unchanged waveforms are not re-packed (see _pack_waveform)
+        words = bytearray(b''.join([_pack_waveform(w.startvals()) for w in self.waves]))
+        return np.frombuffer(words, dtype=np.int32).reshape((-1, 8))
 
     def compile(self):
         self._make_asm()
@@ -1062,9 +1073,25 @@ class QickProgramV2(AbsQickProgram):
 
     def _make_binprog(self):
         # convert the low-level program definition (ASM and waveform list) to binary
+        # the program memory is cached (see compile_cache), keyed by the ASM alone:
+        # a change that only affects waveforms (e.g. a pulse gain) doesn't require reassembling the program
+        # the waveforms are packed separately, which is cheap (and their parameters aren't always JSON-serializable, e.g. Fraction gains)
+        # the assembler also fills in some fields of the ASM, so we cache the filled ASM too
+        key = None
+        if compile_cache.enabled:
+            key = compile_cache.key('v2', self.prog_list, self.labels)
+            cached = compile_cache.get(key)
+            if cached is not None:
+                self.prog_list = json.loads(cached['prog_list'].item())
+                self.binprog = {'pmem': cached['pmem'], 'wmem': self._compile_waves()}
+                return
         self.binprog = {}
         self.binprog['pmem'] = self._compile_prog()
         self.binprog['wmem'] = self._compile_waves()
+        # don't cache a failed assembly
+        if key is not None and len(self.binprog['pmem']):
+            compile_cache.put(key, {'prog_list': json.dumps(self.prog_list, cls=NpEncoder),
+                                    'pmem': self.binprog['pmem']})
 
     def _make_asm(self):
         # convert the high-level program definition (macros and pulses) to low-level (ASM and waveform list)
@@ -1298,17 +1325,14 @@ class QickProgramV2(AbsQickProgram):
         :param name: name of the new register. Optional.
         :return: QickRegister
         """
-        assigned_addrs = set([v.addr for v in self.reg_dict.values()])
         if addr is None:
-            addr = 0
-            while addr in assigned_addrs:
-                addr += 1
-            if addr >= self.soccfg['tprocs'][0]['dreg_qty']:
+            addr = self._reg_alloc.first_free()
+            if addr is None:
                 raise RuntimeError(f"data registers are full.")
         else:
             if addr < 0 or addr >= self.soccfg['tprocs'][0]['dreg_qty']:
                 raise ValueError(f"register address must be smaller than {self.soccfg['tprocs'][0]['dreg_qty']}")
-            if addr in assigned_addrs:
+            if addr in self._reg_alloc:
                 raise ValueError(f"register at address {addr} is already occupied.")
 
         if name is None:
@@ -1318,6 +1342,7 @@ class QickProgramV2(AbsQickProgram):
 
         reg = QickRegister(addr=addr, name=name, sweep=sweep)
         self.reg_dict[name] = reg
+        self._reg_alloc.add(addr)
 
         return reg
     
@@ -1329,6 +1354,31 @@ class QickProgramV2(AbsQickProgram):
             self.new_reg(name=name)
         return self.reg_dict[name]
 
+    def _get_sweep_reg(self, sweep: QickSweepRaw):
+        # get a register initialized to a sweep's start value and stepped by its loops
+        # registers with identical sweeps always hold the same value, so they can share an address
+        key = (sweep.start, sweep.quantize, tuple(sorted(sweep.spans.items())))
+        reg = self._sweep_regs.get(key)
+        if reg is None:
+            reg = self.new_reg(sweep=sweep)
+            self._sweep_regs[key] = reg
+        else:
+            self._shared_sweeps += 1
+        return reg
+
+    def get_reg_stats(self):
+        """Get data register usage statistics.
+        The registers are only allocated when the program is compiled.
+
+        Returns
+        -------
+        dict
+            number of registers available, in use, free, and the number of sweeps that shared a register with an identical sweep
+        """
+        stats = self._reg_alloc.get_stats()
+        stats['shared'] = self._shared_sweeps
+        return stats
+
     # start of ASM code
     def add_macro(self, macro):
         """Add a macro to the program's macro list.
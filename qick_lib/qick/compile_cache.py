@@ -0,0 +1,174 @@
+"""
+A cache of compiled tProc programs, keyed by the content of the program.
+
+Sweep scripts often rebuild the same program many times.
+The compile methods of QickProgram and QickProgramV2 look up the program here before assembling it.
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from . import __version__
+from .helpers import NpEncoder
+
+# version of the cache entry format; change this if the contents of an entry change
+CACHE_FORMAT = 1
+
+class CompileCache():
+    """
+    LRU cache of compiled programs, with optional persistence to disk.
+
+    Each entry is a dict of numpy arrays, stored under a key computed from everything that determines the compiled program.
+    If a cache directory is set, entries are also saved there as .npz files, and entries that are not in memory are looked up there.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries kept in memory; 0 disables the cache.
+    path : str
+        Directory for persistent storage, or None to only keep entries in memory.
+    """
+    def __init__(self, maxsize=256, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.reset_stats()
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def set_path(self, path):
+        """
+        Set the directory for persistent storage.
+
+        Parameters
+        ----------
+        path : str
+            Directory, which is created if it doesn't exist; None to disable persistence.
+        """
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        self.path = path
+
+    def key(self, *parts):
+        """
+        Compute the cache key for a program.
+        The key also depends on the library version and the cache entry format,
+        so entries persisted by a different version of the assembler are not used.
+
+        Parameters
+        ----------
+        *parts
+            JSON-serializable objects (see helpers.NpEncoder) or bytes that together determine the compiled program.
+
+        Returns
+        -------
+        str
+            hex digest
+        """
+        h = hashlib.sha256()
+        for part in (__version__, CACHE_FORMAT) + parts:
+            if isinstance(part, (bytes, bytearray, memoryview)):
+                h.update(part)
+            else:
+                h.update(json.dumps(part, cls=NpEncoder, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Look up a compiled program.
+
+        Parameters
+        ----------
+        key : str
+            key from key()
+
+        Returns
+        -------
+        dict
+            copies of the cached arrays, or None if the program is not in the cache
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is None and self.path is not None:
+            try:
+                with np.load(os.path.join(self.path, key + '.npz'), allow_pickle=False) as f:
+                    entry = {k: f[k] for k in f.files}
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._insert(key, entry)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        return {k: v.copy() for k, v in entry.items()}
+
+    def put(self, key, entry):
+        """
+        Add a compiled program to the cache.
+
+        Parameters
+        ----------
+        key : str
+            key from key()
+        entry : dict
+            the compiled program, as a dict of numpy arrays
+        """
+        entry = {k: np.array(v) for k, v in entry.items()}
+        with self._lock:
+            self._insert(key, entry)
+        if self.path is not None:
+            # write to a temporary file and rename, so a reader never sees a partial file
+            filename = os.path.join(self.path, key + '.npz')
+            tmpname = "%s.%d.tmp.npz" % (filename, os.getpid())
+            np.savez(tmpname, **entry)
+            os.replace(tmpname, filename)
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Empty the in-memory cache. Files on disk are not deleted.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def reset_stats(self):
+        """
+        Reset the counters reported by get_stats().
+        """
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        """
+        Get usage statistics.
+
+        Returns
+        -------
+        dict
+            number of hits in memory and on disk, misses, and entries in memory
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'entries': len(self._entries)}
+
+# The cache used by the program classes.
+compile_cache = CompileCache()
@@ -0,0 +1,162 @@
+"""
+A pool of DMA buffers shared by the drivers.
+
+Allocating physically contiguous memory is slow, and repeated allocations fragment the CMA region of a long-running server.
+Drivers get their DMA buffers from the pool, and buffers that are only needed for one transfer are given back and reused.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import threading
+import numpy as np
+try:
+    from pynq.buffer import allocate
+except ModuleNotFoundError:
+    # pynq is only available on the board; a pool can still be used with another allocator
+    allocate = None
+
+class DmaBufferPool():
+    """
+    Hands out DMA buffers and keeps released buffers for reuse.
+
+    Requests are rounded up to a size class, and a released buffer can be reused by any request in the same size class.
+    Each factor of 2 in size is split into CLASSES_PER_OCTAVE classes, so at most 1/CLASSES_PER_OCTAVE of a buffer is wasted.
+    Every class is SLACK bytes larger than its nominal size, so a power-of-2 buffer with a few elements of padding stays in the power-of-2 class.
+    The buffer returned by get() is a view into the pooled buffer, with exactly the requested shape and dtype.
+
+    :param allocator: function that allocates a 1-D buffer, with the signature of pynq.allocate(shape, dtype)
+    :type allocator: function
+    """
+    # Smallest size class, in bytes.
+    MIN_SIZE = 4096
+    # Number of size classes between each power of 2.
+    CLASSES_PER_OCTAVE = 8
+    # Extra bytes in every size class (covers e.g. the 2-sample padding of the averager buffers).
+    SLACK = 64
+
+    def __init__(self, allocator=allocate):
+        self.allocator = allocator
+        self._lock = threading.Lock()
+        # released buffers for each size class
+        self._free = defaultdict(list)
+        # buffers currently handed out, by id of the view: (size class, view, pooled buffer)
+        self._in_use = {}
+        # bytes handed out
+        self.in_use_bytes = 0
+        # bytes held by the pool (handed out or free)
+        self.pooled_bytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the counters and the high-water mark reported by get_stats().
+        """
+        # number of calls to the allocator
+        self.n_alloc = 0
+        # number of requests served from the pool
+        self.n_reuse = 0
+        # largest value of in_use_bytes
+        self.high_water_bytes = self.in_use_bytes
+
+    def _size_class(self, nbytes):
+        nbytes -= self.SLACK
+        # find the power of 2 just below the request
+        size = self.MIN_SIZE
+        while size*2 < nbytes:
+            size *= 2
+        if nbytes > size:
+            step = size//self.CLASSES_PER_OCTAVE
+            size = -(-nbytes//step)*step
+        return size + self.SLACK
+
+    def get(self, shape, dtype):
+        """
+        Get a DMA buffer.
+        Call put() when the buffer is no longer needed, or never, if the buffer is kept for the lifetime of the driver.
+
+        :param shape: buffer shape
+        :type shape: int or tuple
+        :param dtype: buffer dtype
+        :type dtype: numpy.dtype
+        :return: the buffer (uninitialized)
+        :rtype: ndarray
+        """
+        dtype = np.dtype(dtype)
+        shape = (shape,) if np.isscalar(shape) else tuple(shape)
+        nbytes = int(np.prod(shape))*dtype.itemsize
+        size = self._size_class(nbytes)
+        with self._lock:
+            if self._free[size]:
+                raw = self._free[size].pop()
+                self.n_reuse += 1
+            else:
+                raw = None
+        if raw is None:
+            raw = self.allocator(shape=size, dtype=np.uint8)
+            with self._lock:
+                self.n_alloc += 1
+                self.pooled_bytes += size
+        buff = raw[:nbytes].view(dtype).reshape(shape)
+        with self._lock:
+            self._in_use[id(buff)] = (size, buff, raw)
+            self.in_use_bytes += size
+            self.high_water_bytes = max(self.high_water_bytes, self.in_use_bytes)
+        return buff
+
+    def put(self, buff):
+        """
+        Give a buffer back to the pool.
+        The buffer must not be used afterwards.
+
+        :param buff: a buffer returned by get()
+        :type buff: ndarray
+        """
+        with self._lock:
+            size, _, raw = self._in_use.pop(id(buff))
+            self.in_use_bytes -= size
+            self._free[size].append(raw)
+
+    @contextmanager
+    def borrow(self, shape, dtype):
+        """
+        Context manager that gets a buffer and gives it back on exit.
+
+        :param shape: buffer shape
+        :type shape: int or tuple
+        :param dtype: buffer dtype
+        :type dtype: numpy.dtype
+        """
+        buff = self.get(shape, dtype)
+        try:
+            yield buff
+        finally:
+            self.put(buff)
+
+    def clear(self):
+        """
+        Free all the buffers that are not in use.
+        """
+        with self._lock:
+            for size, bufs in self._free.items():
+                for raw in bufs:
+                    if hasattr(raw, 'freebuffer'):
+                        raw.freebuffer()
+                    self.pooled_bytes -= size
+            self._free.clear()
+
+    def get_stats(self):
+        """
+        Get usage statistics.
+
+        :return: number of allocations and reuses, bytes in use and high-water mark, bytes held by the pool, and number of free buffers in each size class
+        :rtype: dict
+        """
+        with self._lock:
+            return {'n_alloc': self.n_alloc,
+                    'n_reuse': self.n_reuse,
+                    'in_use_bytes': self.in_use_bytes,
+                    'high_water_bytes': self.high_water_bytes,
+                    'pooled_bytes': self.pooled_bytes,
+                    'free': {size: len(bufs) for size, bufs in self._free.items() if bufs}}
+
+# The pool used by all the drivers.
+dma_pool = DmaBufferPool()
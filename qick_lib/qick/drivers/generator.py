@@ -1,9 +1,10 @@
 """
 Drivers for signal generators: FPGA blocks that send data to DACs.
 """
-from pynq.buffer import allocate
+import hashlib
 import numpy as np
 from qick import SocIp
+from .dma_pool import dma_pool
 
 class AbsSignalGen(SocIp):
     """
@@ -17,6 +18,8 @@ class AbsSignalGen(SocIp):
     MAXV = 2**15-2
     # Scale factor between MAXV and the default maximum amplitude (necessary to avoid overshoot).
     MAXV_SCALE = 1.0
+    # Write-enable strobe (only present in some generators).
+    VOLATILE_REGISTERS = ['we_reg']
 
     # Configure this driver with links to the other drivers, and the signal gen channel number.
     def configure(self, ch, rf):
@@ -98,7 +101,13 @@ class AbsArbSignalGen(AbsSignalGen):
 
     def configure(self, ch, rf):
         # Define buffer.
-        self.buff = allocate(shape=self.MAX_LENGTH, dtype=np.int32)
+        self.buff = dma_pool.get(self.MAX_LENGTH, np.int32)
+
+        # Envelopes currently in the waveform memory: {address: (length, digest)}
+        self.env_cache = {}
+        # Number of envelopes loaded, and skipped because they were already loaded.
+        self.env_loads = 0
+        self.env_skips = 0
 
         super().configure(ch, rf)
 
@@ -114,51 +123,101 @@ class AbsArbSignalGen(AbsSignalGen):
         self.dma = getattr(soc, block)
 
     # Load waveforms.
-    def load(self, xin, addr=0):
+    def load(self, xin, addr=0, force=False):
         """
-        Load waveform into I,Q envelope
+        Load waveform into I,Q envelope.
+        If the same envelope was already loaded at the same address, the load is skipped.
 
         :param xin: array of (I, Q) values for pulse envelope
         :type xin: int16 array
         :param addr: starting address
         :type addr: int
+        :param force: load even if the envelope is already in memory
+        :type force: bool
         """
-        length = xin.shape[0]
-        assert xin.dtype==np.int16
+        self.load_batch([(xin, addr)], force=force)
 
-        # Check for max length.
-        if length+addr > self.MAX_LENGTH:
-            raise RuntimeError("%s: buffer length must be %d samples or less." %
-                  (self.__class__.__name__, self.MAX_LENGTH))
+    def load_batch(self, envs, force=False):
+        """
+        Load several waveforms, with one DMA for each block of waveforms that are contiguous in memory.
+        Envelopes that are already loaded at the same address are skipped.
+
+        :param envs: list of (xin, addr) pairs, as for load()
+        :type envs: list
+        :param force: load even if the envelopes are already in memory
+        :type force: bool
+        """
+        todo = []
+        for xin, addr in envs:
+            length = xin.shape[0]
+            assert xin.dtype==np.int16
+
+            # Check for max length.
+            if length+addr > self.MAX_LENGTH:
+                raise RuntimeError("%s: buffer length must be %d samples or less." %
+                      (self.__class__.__name__, self.MAX_LENGTH))
+
+            digest = hashlib.blake2b(np.ascontiguousarray(xin), digest_size=16).digest()
+            if not force and self.env_cache.get(addr) == (length, digest):
+                self.env_skips += 1
+                continue
+            todo.append((addr, length, xin, digest))
 
         # Check for even transfer size.
         #if length % 2 != 0:
         #    raise RuntimeError("Buffer transfer length must be even number.")
 
-        # Route switch to channel.
-        self.switch.sel(mst=self.switch_ch)
+        # group the envelopes into contiguous blocks
+        blocks = []
+        for env in sorted(todo, key=lambda x: x[0]):
+            if blocks and blocks[-1][-1][0] + blocks[-1][-1][1] == env[0]:
+                blocks[-1].append(env)
+            else:
+                blocks.append([env])
+
+        for block in blocks:
+            start = block[0][0]
+            total = block[-1][0] + block[-1][1] - start
+
+            # forget any envelopes that will be overwritten
+            self.env_cache = {a: v for a, v in self.env_cache.items() if a+v[0] <= start or a >= start+total}
+
+            # Route switch to channel.
+            self.switch.sel(mst=self.switch_ch)
+
+            #print(self.fullpath, start, total, self.switch_ch)
 
-        #print(self.fullpath, xin.shape, addr, self.switch_ch)
+            # Pack the data into a single array; columns will be concatenated
+            # -> lower 16 bits: I value.
+            # -> higher 16 bits: Q value.
+            # Format and copy data.
+            for addr, length, xin, digest in block:
+                np.copyto(self.buff[addr-start:addr-start+length],
+                        np.frombuffer(xin, dtype=np.int32))
 
-        # Pack the data into a single array; columns will be concatenated
-        # -> lower 16 bits: I value.
-        # -> higher 16 bits: Q value.
-        # Format and copy data.
-        np.copyto(self.buff[:length],
-                np.frombuffer(xin, dtype=np.int32))
+            ################
+            ### Load I/Q ###
+            ################
+            # Enable writes.
+            self._wr_enable(start)
 
-        ################
-        ### Load I/Q ###
-        ################
-        # Enable writes.
-        self._wr_enable(addr)
+            # DMA data.
+            self.dma.sendchannel.transfer(self.buff, nbytes=int(total*4))
+            self.dma.sendchannel.wait()
 
-        # DMA data.
-        self.dma.sendchannel.transfer(self.buff, nbytes=int(length*4))
-        self.dma.sendchannel.wait()
+            # Disable writes.
+            self._wr_disable()
 
-        # Disable writes.
-        self._wr_disable()
+            for addr, length, xin, digest in block:
+                self.env_cache[addr] = (length, digest)
+                self.env_loads += 1
+
+    def invalidate_envelopes(self):
+        """
+        Forget what is in the waveform memory, so the next load of every envelope is done.
+        Use this if the memory may have been written some other way.
+        """
+        self.env_cache = {}
 
     def _wr_enable(self, addr=0):
         """
@@ -382,6 +441,19 @@ class AbsMuxSignalGen(AbsPulsedSignalGen):
         """
         if len(tones) > self.N_TONES:
             raise RuntimeError("Too many tones defined for this mux generator.")
+        if self._shadow is None:
+            self._write_tones(tones)
+        else:
+            writes = self._shadow.writes
+            with self.batch():
+                self._write_tones(tones)
+            # If the shadow shows that no register changed, the generator already has this configuration.
+            if self._shadow.writes == writes:
+                return
+        # Register update.
+        self.update()
+
+    def _write_tones(self, tones):
         for i in range(self.N_TONES):
             if i < len(tones):
                 tone = tones[i]
@@ -394,8 +466,6 @@ class AbsMuxSignalGen(AbsPulsedSignalGen):
                 # zero the gain of unused tones
                 if self.HAS_GAIN:
                     setattr(self,'gain%d_reg'%(i), 0)
-        # Register update.
-        self.update()
 
     def set_tones(self, freqs, gains=None, phases=None, ro_ch=None):
         """Set up a list of tones.
@@ -2,9 +2,9 @@
 Drivers for qick_processor Peripherals.
 2024-5-22
 """
-from pynq.buffer import allocate
 import numpy as np
 from qick import SocIp
+from .dma_pool import dma_pool
 
 class QICK_Time_Tagger(SocIp):
     """
@@ -59,7 +59,7 @@ class QICK_Time_Tagger(SocIp):
         self.dma = axi_dma
         maxlen = max(self['tag_mem_size'], self['arm_mem_size'], self['smp_mem_size'])
         print(maxlen)
-        self.buff_rd = allocate(shape=(maxlen, 1), dtype=np.int32)
+        self.buff_rd = dma_pool.get((maxlen, 1), np.int32)
     def __str__(self):
         lines = []
         lines.append('---------------------------------------------')
@@ -1,9 +1,10 @@
 """
 Drivers for readouts (FPGA blocks that receive data from ADCs) and buffers (blocks that receive data from readouts).
 """
-from pynq.buffer import allocate
 import numpy as np
 from qick import DummyIp, SocIp
+from .dma_pool import dma_pool
+from ..helpers import split_ring_transfer
 
 class AbsReadout(DummyIp):
     # Downsampling ratio (RFDC samples per decimated readout sample)
@@ -63,6 +64,8 @@ class AxisReadoutV2(SocIp, AbsReadout):
     :type fs: float
     """
     bindto = ['user.org:user:axis_readout_v2:1.0']
+    # Write-enable strobe.
+    VOLATILE_REGISTERS = ['we_reg']
 
     # Bits of DDS.
     B_DDS = 32
@@ -122,15 +125,26 @@ class AxisReadoutV2(SocIp, AbsReadout):
     def set_all_int(self, regs):
         """Set all readout parameters using a dictionary computed by QickConfig.calc_ro_regs().
         """
+        if self._shadow is None:
+            self._write_regs(regs)
+        else:
+            writes = self._shadow.writes
+            with self.batch():
+                self._write_regs(regs)
+            # If the shadow shows that no register changed, the readout already has this configuration.
+            if self._shadow.writes == writes:
+                return
+        self.update()
+        # sometimes it seems that we need to update the readout an extra time to make it configure everything correctly?
+        # this has only really been seen with setting a downconversion freq of 0.
+        self.update()
+
+    def _write_regs(self, regs):
         self.outsel_reg = {"product": 0, "dds": 1, "input": 2}[regs['sel']]
         self.freq_reg = regs['f_int'] % 2**self.B_DDS
         self.phase_reg = regs['phase_int'] % 2**self.B_PHASE
         self.nsamp_reg = 10
         self.mode_reg = 1
-        self.update()
-        # sometimes it seems that we need to update the readout an extra time to make it configure everything correctly?
-        # this has only really been seen with setting a downconversion freq of 0.
-        self.update()
 
     def set_all(self, f, sel='product', gen_ch=None, phase=0):
         """Set up the readout directly.
@@ -494,6 +508,8 @@ class AxisAvgBuffer(SocIp):
     :type channel: int
     """
     bindto = ['user.org:user:axis_avg_buffer:1.0']
+    # Start registers, which trigger captures and transfers.
+    VOLATILE_REGISTERS = ['avg_start_reg', 'avg_dr_start_reg', 'buf_start_reg', 'buf_dr_start_reg']
 
     def __init__(self, description):
         """
@@ -530,8 +546,15 @@ class AxisAvgBuffer(SocIp):
         self.cfg['buf_maxlen'] = 2**self.N_BUF
 
         # Preallocate memory buffers for DMA transfers.
-        self.avg_buff = allocate(shape=self['avg_maxlen'], dtype=np.int64)
-        self.buf_buff = allocate(shape=self['buf_maxlen'], dtype=np.int32)
+        # The average buffer DMA gets 2 extra samples, to allow for padding when a transfer wraps around the end of the buffer (see helpers.split_ring_transfer()).
+        self.avg_buff = dma_pool.get(self['avg_maxlen']+2, np.int64)
+        self.buf_buff = dma_pool.get(self['buf_maxlen'], np.int32)
+        # Extra accumulated-buffer DMA buffers for zero-copy transfers, allocated on demand by alloc_avg_buffs().
+        self.avg_buffs = []
+        # Accumulated-buffer transfer in flight, if any (see start_transfer_avg()).
+        self._avg_transfer = None
+        # Decimated-buffer transfer in flight, if any (see start_transfer_buf()).
+        self._buf_transfer = None
 
     def configure_connections(self, soc):
         super().configure_connections(soc)
@@ -651,28 +674,90 @@ class AxisAvgBuffer(SocIp):
         self.avg_addr_reg = address
         self.avg_len_reg = length
 
-    def transfer_avg(self, address=0, length=100):
+    def alloc_avg_buffs(self, n):
+        """
+        Make sure at least n DMA buffers are available for zero-copy transfers of the average buffer.
+
+        :param n: number of buffers
+        :type n: int
+        """
+        while len(self.avg_buffs) < n:
+            self.avg_buffs.append(dma_pool.get(self['avg_maxlen']+2, np.int64))
+
+    def transfer_avg(self, address=0, length=100, buff_idx=None):
         """
         Transfer average buffer data from average and buffering readout block.
 
+        By default, the data is DMAed into a single buffer and a copy is returned.
+        If buff_idx is specified, the data is DMAed into that zero-copy buffer (see alloc_avg_buffs()) and a view into the buffer is returned.
+        The view is only valid until the next transfer into the same buffer; the caller is responsible for copying the data out in time.
+
         :param addr: starting reading address
         :type addr: int
         :param length: number of samples
         :type length: int
+        :param buff_idx: index of the zero-copy buffer to use, or None to use the default buffer and return a copy
+        :type buff_idx: int
         :return: I,Q pairs
         :rtype: list
         """
+        self.start_transfer_avg(address, length, buff_idx)
+        return self.finish_transfer_avg()
+
+    def start_transfer_avg(self, address=0, length=100, buff_idx=None):
+        """
+        Start a transfer of average buffer data, without waiting for the DMA to complete.
+        Call finish_transfer_avg() to wait for the data.
+        Only one transfer can be in flight on a given DMA engine; buffers that share a DMA engine must not have overlapping transfers.
+
+        The average buffer is used as a ring buffer: a transfer that runs past the end of the buffer wraps around to address 0.
+        This is done with two DMA transfers, which land contiguously in the DMA buffer (see helpers.split_ring_transfer()).
+        The first transfer is completed before this method returns.
+
+        :param addr: starting reading address
+        :type addr: int
+        :param length: number of samples
+        :type length: int
+        :param buff_idx: index of the zero-copy buffer to use, or None to use the default buffer
+        :type buff_idx: int
+        """
 
         if length >= self['avg_maxlen']:
             raise RuntimeError("length=%d longer than %d" %
                                (length, self['avg_maxlen']))
 
-        # pad the transfer size to an even number (odd lengths seem to break the DMA)
-        transferlen = length + (length % 2)
+        if buff_idx is None:
+            buff = self.avg_buff
+        else:
+            buff = self.avg_buffs[buff_idx]
 
         # Route switch to channel.
         self.switch_avg.sel(slv=self.switch_ch)
 
+        # split the transfer at the end of the buffer
+        segments, start = split_ring_transfer(address, length, self['avg_maxlen'])
+        for i, (seg_addr, transferlen, offset) in enumerate(segments):
+            if i > 0:
+                # the second segment starts at address 0, so it does not need the workaround for the first-sample bug
+                self._wait_dma_avg(segments[i-1][1])
+            self._start_dma_avg(seg_addr, transferlen, buff, offset)
+
+        # remember what we need to complete the transfer
+        self._avg_transfer = (buff, buff_idx, start, length, transferlen)
+
+    def _start_dma_avg(self, address, transferlen, buff, offset):
+        """
+        Start a single DMA transfer from the average buffer, which must not run past the end of the buffer.
+
+        :param address: starting reading address
+        :type address: int
+        :param transferlen: number of samples (must be even; odd lengths seem to break the DMA)
+        :type transferlen: int
+        :param buff: DMA buffer
+        :type buff: PynqBuffer
+        :param offset: position in the DMA buffer (in samples) to write to
+        :type offset: int
+        """
         # Set averager data reader address and length.
         self.avg_dr_addr_reg = address
         self.avg_dr_len_reg = transferlen
@@ -681,9 +766,16 @@ class AxisAvgBuffer(SocIp):
         self.avg_dr_start_reg = 1
 
         # DMA data.
-        buff = self.avg_buff
-        # nbytes has to be a Python int (it gets passed to mmio.write, which requires int or bytes)
-        self.dma_avg.recvchannel.transfer(buff, nbytes=int(transferlen*8))
+        # start and nbytes have to be Python ints (they get passed to mmio.write, which requires int or bytes)
+        self.dma_avg.recvchannel.transfer(buff, start=int(offset*8), nbytes=int(transferlen*8))
+
+    def _wait_dma_avg(self, transferlen):
+        """
+        Wait for a DMA transfer started by _start_dma_avg() to complete.
+
+        :param transferlen: number of samples transferred (including padding)
+        :type transferlen: int
+        """
         self.dma_avg.recvchannel.wait()
 
         # Stop send data mode.
@@ -693,13 +785,30 @@ class AxisAvgBuffer(SocIp):
             raise RuntimeError("Requested %d samples but only got %d from DMA" % (
                 transferlen, self.dma_avg.recvchannel.transferred//8))
 
+    def finish_transfer_avg(self, copy=True):
+        """
+        Wait for the transfer started by start_transfer_avg() to complete, and return the data.
+
+        :param copy: If a zero-copy buffer was not used, return a copy of the data (otherwise, a view that is only valid until the next transfer)
+        :type copy: bool
+        :return: I,Q pairs (a view into the DMA buffer if a zero-copy buffer was used, otherwise a copy)
+        :rtype: list
+        """
+        buff, buff_idx, start, length, transferlen = self._avg_transfer
+        self._avg_transfer = None
+
+        self._wait_dma_avg(transferlen)
+
         # Format:
         # -> lower 32 bits: I value.
         # -> higher 32 bits: Q value.
-        data = np.frombuffer(buff[:length], dtype=np.int32).reshape((-1,2))
+        data = np.frombuffer(buff[start:start+length], dtype=np.int32).reshape((-1,2))
 
-        # data is a view into the data buffer, so copy it before returning
+        # zero-copy: return the view, the caller will copy it out before the buffer gets reused
+        if buff_idx is not None or not copy:
+            return data
 
+        # data is a view into the data buffer, so copy it before returning
         return data.copy()
 
     def enable_avg(self):
@@ -745,6 +854,19 @@ class AxisAvgBuffer(SocIp):
         :return: I,Q pairs
         :rtype: list
         """
+        self.start_transfer_buf(address, length)
+        return self.finish_transfer_buf()
+
+    def start_transfer_buf(self, address, length):
+        """
+        Start a transfer of raw buffer data, without waiting for it to complete.
+        Use finish_transfer_buf() to get the data.
+
+        :param addr: starting reading address
+        :type addr: int
+        :param length: number of samples
+        :type length: int
+        """
 
         if length >= self['buf_maxlen']:
             raise RuntimeError("requested length=%d longer or equal to decimated buffer size=%d" %
@@ -769,6 +891,21 @@ class AxisAvgBuffer(SocIp):
         buff = self.buf_buff
         # nbytes has to be a Python int (it gets passed to mmio.write, which requires int or bytes)
         self.dma_buf.recvchannel.transfer(buff, nbytes=int(transferlen*4))
+        self._buf_transfer = (length, transferlen)
+
+    def finish_transfer_buf(self, acc=None):
+        """
+        Wait for the transfer started by start_transfer_buf() to complete, and get the data.
+
+        :param acc: Array of shape (length, 2) to add the data to, in place. This avoids copying the data out of the DMA buffer.
+        :type acc: ndarray
+        :return: I,Q pairs (acc, if it was given)
+        :rtype: ndarray
+        """
+        length, transferlen = self._buf_transfer
+        self._buf_transfer = None
+        buff = self.buf_buff
+
         self.dma_buf.recvchannel.wait()
 
         if self.dma_buf.recvchannel.transferred != transferlen*4:
@@ -783,6 +920,10 @@ class AxisAvgBuffer(SocIp):
         # -> higher 16 bits: Q value.
         data = np.frombuffer(buff[:length], dtype=np.int16).reshape((-1,2))
 
+        if acc is not None:
+            np.add(acc, data, out=acc)
+            return acc
+
         # data is a view into the data buffer, so copy it before returning
         return data.copy()
 
@@ -813,6 +954,8 @@ class MrBufferEt(SocIp):
     # DR_START_REG needs to be de-assereted and asserted again to allow a new transfer.
     #
     bindto = ['user.org:user:mr_buffer_et:1.0']
+    # Start registers, which trigger captures and transfers.
+    VOLATILE_REGISTERS = ['dw_capture_reg', 'dr_start_reg']
 
     def __init__(self, description):
         # Generics
@@ -835,7 +978,7 @@ class MrBufferEt(SocIp):
         self.cfg['junk_len'] = 8
 
         # Preallocate memory buffers for DMA transfers.
-        self.buff = allocate(shape=2*self['maxlen'], dtype=np.int16)
+        self.buff = dma_pool.get(2*self['maxlen'], np.int16)
 
         # Switch for selecting input.
         self.switch = None
@@ -941,10 +1084,15 @@ class AxisBufferDdrV1(SocIp):
     """
     # AXIS Buffer DDR V1 Registers.
     bindto = ['user.org:user:axis_buffer_ddr_v1:1.0']
+    # Start registers, which trigger captures and transfers.
+    VOLATILE_REGISTERS = ['rstart_reg', 'wstart_reg']
 
     # Stream Input Port.
     STREAM_IN_PORT  = "s_axis"
 
+    # Default number of samples per chunk for chunked reads and clears (4 MB).
+    CHUNK_LEN = 2**20
+
     def __init__(self, description):
         # Generics.
         self.TARGET_SLAVE_BASE_ADDR   = int(description['parameters']['TARGET_SLAVE_BASE_ADDR'],0)
@@ -1074,18 +1222,107 @@ class AxisBufferDdrV1(SocIp):
         else:
             self.switch.sel(slv=self.buf2switch[bufname])
 
-    def clear_mem(self, length=None):
+    def clear_mem(self, length=None, start=0, chunk_len=None):
+        """
+        Fill a range of the memory with 0's, one chunk at a time.
+
+        :param length: number of samples to clear (None = to the end of the memory)
+        :type length: int
+        :param start: first sample to clear
+        :type start: int
+        :param chunk_len: number of samples per chunk (None = CHUNK_LEN)
+        :type chunk_len: int
+        """
         if length is None:
-            np.copyto(self.ddr4_array, 0)
-        else:
-            np.copyto(self.ddr4_array[:length], 0)
+            length = self['maxlen'] - start
+        if chunk_len is None:
+            chunk_len = self.CHUNK_LEN
+        for offset in range(start, start+length, chunk_len):
+            np.copyto(self.ddr4_array[offset:min(offset+chunk_len, start+length)], 0)
 
-    def get_mem(self, nt, start=None):
+    def _mem_window(self, nt, start):
+        """
+        Get the window of samples returned by get_mem().
+
+        :return: start and end sample
+        :rtype: tuple
+        """
         if start is None:
             start = self['junk_len']
             end = nt*self['burst_len']
         else:
             end = start + nt*self['burst_len']
+        return start, end
+
+    def iter_mem(self, nt, start=None, chunk_len=None, copy=False):
+        """
+        Read the same data as get_mem(), in chunks.
+        Each chunk is copied out of the memory (aligned as in get_mem()) into a buffer that is reused for every chunk,
+        so reading a large capture doesn't need memory for the whole capture.
+
+        :param nt: number of transfers, see get_mem()
+        :type nt: int
+        :param start: first sample, see get_mem()
+        :type start: int
+        :param chunk_len: number of samples per chunk (None = CHUNK_LEN); must be even
+        :type chunk_len: int
+        :param copy: yield a new array for each chunk, instead of a view into the reused buffer (which is only valid until the next chunk)
+        :type copy: bool
+        :return: generator of (offset, data) pairs, where offset is the index of the chunk's first sample in the get_mem() data and data is an array of I,Q pairs
+        :rtype: generator
+        """
+        start, end = self._mem_window(nt, start)
+        if chunk_len is None:
+            chunk_len = self.CHUNK_LEN
+        if chunk_len % 2:
+            raise RuntimeError("chunk_len must be even, got %d" % (chunk_len))
+        # chunk boundaries are aligned to 64 bits (see get_mem())
+        aligned_start = start - (start%2)
+        buf = np.empty(min(chunk_len, end + (end%2) - aligned_start), dtype=np.uint32)
+        for chunk_start in range(aligned_start, end, chunk_len):
+            chunk_end = min(chunk_start + chunk_len, end + (end%2))
+            chunk = buf[:chunk_end-chunk_start]
+            np.copyto(chunk, self.ddr4_array[chunk_start:chunk_end])
+            # trim to the requested window
+            lo = max(start, chunk_start) - chunk_start
+            hi = min(end, chunk_end) - chunk_start
+            data = chunk[lo:hi].view(dtype=np.int16).reshape((-1,2))
+            if copy:
+                data = data.copy()
+            yield chunk_start + lo - start, data
+
+    def read_mem_into(self, out, nt, start=None, chunk_len=None):
+        """
+        Read the same data as get_mem() into an existing array, in chunks.
+        This can be a numpy memmap or an HDF5 dataset, so a capture can be written to disk without holding it in memory.
+
+        :param out: array of int16 with shape (n_samples, 2), or anything else that supports slice assignment
+        :type out: array-like
+        :param nt: number of transfers, see get_mem()
+        :type nt: int
+        :param start: first sample, see get_mem()
+        :type start: int
+        :param chunk_len: number of samples per chunk (None = CHUNK_LEN)
+        :type chunk_len: int
+        :return: out
+        :rtype: array-like
+        """
+        for offset, data in self.iter_mem(nt, start, chunk_len):
+            out[offset:offset+data.shape[0]] = data
+        return out
+
+    def mem_len(self, nt, start=None):
+        """
+        Get the number of samples returned by get_mem().
+
+        :return: number of samples
+        :rtype: int
+        """
+        start, end = self._mem_window(nt, start)
+        return end-start
+
+    def get_mem(self, nt, start=None):
+        start, end = self._mem_window(nt, start)
         length = end-start
 
         # when we access memory-mapped data, the start and end need to be aligned to multiples of 64 bits.
@@ -1103,3 +1340,113 @@ class AxisBufferDdrV1(SocIp):
         self.wlen(nt)
         self.wstop()
         self.wstart()
+
+    def segments_nt(self, nt, n_segments):
+        """
+        Get the number of transfers to record for a segmented capture.
+        This includes the transfers holding the junk at the start of the memory.
+
+        :param nt: number of transfers per segment
+        :type nt: int
+        :param n_segments: number of segments
+        :type n_segments: int
+        :return: number of transfers
+        :rtype: int
+        """
+        return n_segments*nt + self['junk_nt']
+
+    def arm_segments(self, nt, n_segments, force_overwrite=False):
+        """
+        Arm the buffer for a segmented capture: one continuous recording, starting at the first trigger, that is split into segments of nt transfers.
+
+        :param nt: number of transfers per segment
+        :type nt: int
+        :param n_segments: number of segments
+        :type n_segments: int
+        :param force_overwrite: see arm()
+        :type force_overwrite: bool
+        """
+        self.arm(self.segments_nt(nt, n_segments), force_overwrite)
+
+    def get_segments(self, nt, n_segments, samples=None, out=None):
+        """
+        Get the data from a segmented capture.
+        Segment i starts i*nt*burst_len samples after the first valid sample (the junk at the start of the memory is skipped).
+
+        :param nt: number of transfers per segment
+        :type nt: int
+        :param n_segments: number of segments
+        :type n_segments: int
+        :param samples: number of samples to keep at the start of each segment (None = the whole segment)
+        :type samples: int
+        :param out: array of int16 with shape (n_segments*nt*burst_len, 2) to copy the data into (see read_mem_into()); None to allocate a new array
+        :type out: array-like
+        :return: I,Q pairs, with shape (n_segments, samples, 2)
+        :rtype: ndarray
+        """
+        seg_len = nt*self['burst_len']
+        if samples is None:
+            samples = seg_len
+        if samples > seg_len:
+            raise RuntimeError("requested %d samples per segment, but segments are only %d samples long" % (samples, seg_len))
+        if out is None:
+            data = self.get_mem(n_segments*nt, start=self['junk_len'])
+        else:
+            data = self.read_mem_into(out, n_segments*nt, start=self['junk_len'])
+        return data.reshape((n_segments, seg_len, 2))[:, :samples]
+
+    def _read_aligned(self, start, end, buf):
+        """
+        Copy a block of samples out of the memory, with the alignment needed to avoid bus errors (see get_mem()).
+
+        :param start: first sample
+        :type start: int
+        :param end: end sample (exclusive)
+        :type end: int
+        :param buf: uint32 buffer to copy into, with room for end-start+2 samples
+        :type buf: ndarray
+        :return: I,Q pairs (a view into buf)
+        :rtype: ndarray
+        """
+        aligned_start = start - (start%2)
+        aligned_end = end + (end%2)
+        np.copyto(buf[:aligned_end-aligned_start], self.ddr4_array[aligned_start:aligned_end])
+        return buf[start-aligned_start:end-aligned_start].view(dtype=np.int16).reshape((-1,2))
+
+    def sum_segments(self, nt, n_segments, samples=None, calc_var=False, block_len=None):
+        """
+        Sum the segments of a segmented capture (see get_segments()), without copying out the whole capture.
+        The memory is read in blocks of whole segments, which are copied into a reused buffer and summed.
+
+        :param nt: number of transfers per segment
+        :type nt: int
+        :param n_segments: number of segments
+        :type n_segments: int
+        :param samples: number of samples to keep at the start of each segment (None = the whole segment)
+        :type samples: int
+        :param calc_var: also compute the sum of squares
+        :type calc_var: bool
+        :param block_len: approximate number of samples per block (None = CHUNK_LEN)
+        :type block_len: int
+        :return: sum and sum of squares (None if calc_var is False) of the I,Q pairs over segments, each with shape (samples, 2)
+        :rtype: tuple
+        """
+        seg_len = nt*self['burst_len']
+        if samples is None:
+            samples = seg_len
+        if block_len is None:
+            block_len = self.CHUNK_LEN
+        segs_per_block = max(1, block_len//seg_len)
+
+        d_sum = np.zeros((samples, 2), dtype=np.int64)
+        d_sumsq = np.zeros((samples, 2), dtype=np.int64) if calc_var else None
+        buf = np.empty(segs_per_block*seg_len + 2, dtype=np.uint32)
+        for first_seg in range(0, n_segments, segs_per_block):
+            nsegs = min(segs_per_block, n_segments-first_seg)
+            start = self['junk_len'] + first_seg*seg_len
+            block = self._read_aligned(start, start + nsegs*seg_len, buf).reshape((nsegs, seg_len, 2))[:, :samples]
+            d_sum += block.sum(axis=0, dtype=np.int64)
+            if calc_var:
+                block = block.astype(np.int64)
+                d_sumsq += np.einsum('ijk,ijk->jk', block, block)
+        return d_sum, d_sumsq
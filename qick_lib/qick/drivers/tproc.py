@@ -2,9 +2,9 @@
 Drivers for the QICK Timed Processor (tProc).
 2024-5-22
 """
-from pynq.buffer import allocate
 import numpy as np
 from qick import SocIp
+from .dma_pool import dma_pool
 
 class AxisTProc64x32_x8(SocIp):
     """
@@ -48,6 +48,8 @@ class AxisTProc64x32_x8(SocIp):
     :type axi_dma: int
     """
     bindto = ['user.org:user:axis_tproc64x32_x8:1.0']
+    # Start registers, which trigger the program and memory transfers.
+    VOLATILE_REGISTERS = ['start_reg', 'mem_start_reg']
 
     # Number of 32-bit words in the lower address map (reserved for register access)
     NREG = 64
@@ -233,17 +235,16 @@ class AxisTProc64x32_x8(SocIp):
         self.mem_len_reg = length
 
         # Define buffer.
-        self.buff = allocate(shape=length, dtype=np.int32)
+        with dma_pool.borrow(length, np.int32) as buff:
+            # Copy buffer.
+            np.copyto(buff, buff_in)
 
-        # Copy buffer.
-        np.copyto(self.buff, buff_in)
+            # Start operation on block.
+            self.mem_start_reg = 1
 
-        # Start operation on block.
-        self.mem_start_reg = 1
-
-        # DMA data.
-        self.dma.sendchannel.transfer(self.buff)
-        self.dma.sendchannel.wait()
+            # DMA data.
+            self.dma.sendchannel.transfer(buff)
+            self.dma.sendchannel.wait()
 
         # Set block back to single mode.
         self.mem_start_reg = 0
@@ -265,19 +266,19 @@ class AxisTProc64x32_x8(SocIp):
         self.mem_len_reg = length
 
         # Define buffer.
-        buff = allocate(shape=length, dtype=np.int32)
+        with dma_pool.borrow(length, np.int32) as buff:
+            # Start operation on block.
+            self.mem_start_reg = 1
 
-        # Start operation on block.
-        self.mem_start_reg = 1
+            # DMA data.
+            self.dma.recvchannel.transfer(buff)
+            self.dma.recvchannel.wait()
 
-        # DMA data.
-        self.dma.recvchannel.transfer(buff)
-        self.dma.recvchannel.wait()
-
-        # Set block back to single mode.
-        self.mem_start_reg = 0
+            # Set block back to single mode.
+            self.mem_start_reg = 0
 
-        return buff
+            # the buffer goes back to the pool, so return a copy
+            return np.array(buff, copy=True)
 
 
 class Axis_QICK_Proc(SocIp):
@@ -335,6 +336,9 @@ class Axis_QICK_Proc(SocIp):
     :type axi_dma: int
     """
     bindto = ['Fermi:user:qick_processor:2.0']
+    # Control registers, whose bits are commands, and read-only registers.
+    VOLATILE_REGISTERS = ['tproc_ctrl', 'tproc_cfg', 'mem_dt_o', 'axi_r_dt1', 'axi_r_dt2',
+                          'time_usr', 'tproc_status', 'tproc_debug']
     
     def __init__(self, description):
         """
@@ -398,8 +402,8 @@ class Axis_QICK_Proc(SocIp):
 
         # allocate DMA buffers, using the size of the largest memory
         maxlen = max(self['dmem_size'], self['pmem_size'], self['wmem_size'])
-        self.buff_wr = allocate(shape=(maxlen, 8), dtype=np.int32)
-        self.buff_rd = allocate(shape=(maxlen, 8), dtype=np.int32)
+        self.buff_wr = dma_pool.get((maxlen, 8), np.int32)
+        self.buff_rd = dma_pool.get((maxlen, 8), np.int32)
 
     
     def configure_connections(self, soc):
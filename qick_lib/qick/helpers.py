@@ -246,3 +246,111 @@ def check_keys(keys, required, optional):
         raise RuntimeError("missing required pulse parameter(s)", required - defined)
     if defined - allowed:
         raise RuntimeError("unsupported pulse parameter(s)", defined - allowed)
+
+def split_ring_transfer(address, length, maxlen):
+    """Split a read from a ring buffer into DMA transfers that don't run past the end of the buffer.
+    A read that runs past the end wraps around to address 0, and is split into two transfers.
+    Each transfer must have an even length, so a transfer is padded by a sample at its end,
+    or, if that would run past the end of the buffer, starts a sample early.
+    The transfers land contiguously in the DMA buffer, which needs room for length+2 samples.
+
+    Parameters
+    ----------
+    address : int
+        address of the first sample
+    length : int
+        number of samples (less than maxlen)
+    maxlen : int
+        ring buffer size
+
+    Returns
+    -------
+    list of tuple
+        (address, transfer length, offset in the DMA buffer) for each transfer
+    int
+        offset of the first requested sample in the DMA buffer
+    """
+    segments = []
+    # the first segment ends at the end of the buffer, or the end of the read
+    len1 = min(length, maxlen - address)
+    pad = len1 % 2
+    if pad and address + len1 == maxlen:
+        segments.append((address - 1, len1 + 1, 0))
+        start = 1
+    else:
+        segments.append((address, len1 + pad, 0))
+        start = 0
+    len2 = length - len1
+    if len2:
+        segments.append((0, len2 + len2 % 2, start + len1))
+    return segments, start
+
+class RegisterAllocator():
+    """Tracks which addresses of a register file are in use.
+    The in-use addresses are stored as the bits of an int, so finding the lowest free address doesn't need a scan.
+
+    Parameters
+    ----------
+    size : int
+        Number of addresses in the register file
+    start : int
+        Lowest address that can be allocated; lower addresses are reserved
+    """
+    def __init__(self, size, start=0):
+        self.size = size
+        self.start = start
+        # bit i is set if address i is in use
+        self._used = (1 << start) - 1
+        self._n_used = 0
+
+    def __contains__(self, addr):
+        return bool((self._used >> addr) & 1)
+
+    def first_free(self):
+        """Find the lowest free address.
+
+        Returns
+        -------
+        int
+            address, or None if the register file is full
+        """
+        # the lowest clear bit
+        addr = (~self._used & (self._used + 1)).bit_length() - 1
+        return addr if addr < self.size else None
+
+    def add(self, addr):
+        """Mark an address as in use.
+
+        Parameters
+        ----------
+        addr : int
+            address
+        """
+        self._used |= 1 << addr
+        self._n_used += 1
+
+    def free(self, addr):
+        """Mark an address as free, so it can be allocated again.
+
+        Parameters
+        ----------
+        addr : int
+            address
+        """
+        if addr < self.start or addr not in self:
+            raise RuntimeError("address %d is not in use" % (addr))
+        self._used &= ~(1 << addr)
+        self._n_used -= 1
+
+    def get_stats(self):
+        """Get usage statistics.
+
+        Returns
+        -------
+        dict
+            number of addresses available, in use, and free
+        """
+        available = self.size - self.start
+        return {'size': available,
+                'used': self._n_used,
+                'free': available - self._n_used}
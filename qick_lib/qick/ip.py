@@ -4,15 +4,101 @@ Support classes for dealing with FPGA IP blocks.
 from pynq.overlay import DefaultIP
 import numpy as np
 import logging
+from contextlib import contextmanager
 from qick import obtain
 from .qick_asm import DummyIp
 
+class ShadowedMMIO():
+    """
+    Stands in for the MMIO object of a SocIp while register shadowing is enabled (see SocIp.enable_shadow()).
+    Register accesses through the array attribute go through a shadow copy of the register values;
+    everything else is passed through to the real MMIO object.
+
+    :param mmio: the real MMIO object
+    :type mmio: pynq.MMIO
+    :param volatile: indices of the registers that are always accessed directly
+    :type volatile: set
+    """
+    def __init__(self, mmio, volatile):
+        self.mmio = mmio
+        self.volatile = volatile
+        # last values written, by register index
+        self.shadow = {}
+        # writes waiting for commit(), by register index (None if not batching)
+        self.pending = None
+        # nesting depth of SocIp.batch()
+        self.batch_depth = 0
+        self.reset_stats()
+
+    def __getattr__(self, a):
+        return getattr(self.mmio, a)
+
+    @property
+    def array(self):
+        return self
+
+    def __getitem__(self, index):
+        if self.pending:
+            self.commit()
+        if index in self.shadow:
+            return self.shadow[index]
+        self.reads += 1
+        return self.mmio.array[index]
+
+    def __setitem__(self, index, v):
+        if index in self.volatile:
+            # volatile registers (strobes and triggers) are written immediately, after any queued writes
+            if self.pending:
+                self.commit()
+            self.mmio.array[index] = v
+            self.writes += 1
+        elif self.pending is not None:
+            # a second write to the same register must not be merged with the first
+            if index in self.pending and self.pending[index] != v:
+                self.commit()
+            self.pending[index] = v
+        elif self.shadow.get(index) == v:
+            self.skips += 1
+        else:
+            self.mmio.array[index] = v
+            self.writes += 1
+            self.shadow[index] = v
+
+    def commit(self):
+        """
+        Write the queued register values, one word at a time in address order.
+        """
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        for index in sorted(pending):
+            v = pending[index]
+            if self.shadow.get(index) == v:
+                self.skips += 1
+            else:
+                self.mmio.array[index] = v
+                self.writes += 1
+                self.shadow[index] = v
+
+    def reset_stats(self):
+        # MMIO access counters
+        self.reads = 0
+        self.writes = 0
+        # writes skipped because the shadow showed the register already had that value
+        self.skips = 0
+
 class SocIp(DefaultIP, DummyIp):
     """
     Base class for firmware IP drivers.
     Registers are accessed as attributes.
     Configuration constants are accessed as dictionary items.
+
+    Register writes can optionally go through a shadow copy of the register values (see enable_shadow()),
+    which skips writes of values that are already in the register and allows writes to be batched.
     """
+    # registers that are never shadowed or queued (strobes, triggers, and registers the firmware changes by itself):
+    # to be defined by subclass
+    VOLATILE_REGISTERS = []
 
     def __init__(self, description):
         """
@@ -20,6 +106,8 @@ class SocIp(DefaultIP, DummyIp):
         """
         # this block's register map: to be defined by subclass
         self.REGISTERS = {}
+        # the ShadowedMMIO that replaces self.mmio while shadowing is enabled, or None
+        self._shadow = None
 
         DefaultIP.__init__(self, description)
 
@@ -59,6 +147,89 @@ class SocIp(DefaultIP, DummyIp):
         else:
             return super().__getattribute__(a)
 
+    def enable_shadow(self, volatile=None):
+        """
+        Start keeping a shadow copy of the register values written by the driver.
+        A write of the value that is already in the register is skipped, and reads of written registers come from the shadow.
+        The registers in VOLATILE_REGISTERS are always accessed directly; other registers that the firmware can change by itself must be listed as volatile.
+
+        :param volatile: names of additional registers that should always be accessed directly
+        :type volatile: list
+        """
+        names = list(self.VOLATILE_REGISTERS) + list(volatile or [])
+        indices = set(self.REGISTERS[a] for a in names if a in self.REGISTERS)
+        if self._shadow is None:
+            self._shadow = ShadowedMMIO(self.mmio, indices)
+            self.mmio = self._shadow
+        else:
+            self._shadow.volatile = indices
+
+    def disable_shadow(self):
+        """
+        Stop shadowing registers; all accesses go directly to the registers.
+        """
+        if self._shadow is not None:
+            self._shadow.commit()
+            self.mmio = self._shadow.mmio
+            self._shadow = None
+
+    def invalidate_shadow(self):
+        """
+        Forget the shadowed register values, e.g. after the firmware has been reset.
+        The next write to each register will not be skipped.
+        """
+        if self._shadow is not None:
+            self._shadow.shadow = {}
+
+    def commit(self):
+        """
+        Write the register values that were queued in a batch().
+        """
+        if self._shadow is not None:
+            self._shadow.commit()
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager that queues register writes and commits them on exit, one word at a time in address order.
+        A read of a register, a write to a volatile register, or a second write of a different value to the same register, commits the writes queued so far.
+        Batches can be nested; the writes are committed when the outermost batch exits.
+        Writes are only queued while shadowing is enabled; otherwise they go straight to the registers.
+        """
+        shadow = self._shadow
+        if shadow is None:
+            yield self
+            return
+        if shadow.batch_depth == 0:
+            shadow.pending = {}
+        shadow.batch_depth += 1
+        try:
+            yield self
+        finally:
+            shadow.batch_depth -= 1
+            if shadow.batch_depth == 0:
+                shadow.commit()
+                shadow.pending = None
+
+    def get_mmio_stats(self):
+        """
+        Get the number of register accesses made by this driver.
+        Accesses are only counted while shadowing is enabled.
+
+        :return: number of MMIO reads and writes, and of writes skipped by the shadow
+        :rtype: dict
+        """
+        if self._shadow is None:
+            return {'reads': 0, 'writes': 0, 'skips': 0}
+        return {'reads': self._shadow.reads, 'writes': self._shadow.writes, 'skips': self._shadow.skips}
+
+    def reset_mmio_stats(self):
+        """
+        Reset the counters reported by get_mmio_stats().
+        """
+        if self._shadow is not None:
+            self._shadow.reset_stats()
+
 class QickMetadata:
     """
     Provides information about the connections between IP blocks, extracted from the HWH file.
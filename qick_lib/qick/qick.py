@@ -8,16 +8,19 @@ import xrfdc
 import numpy as np
 import time
 import queue
-from collections import OrderedDict
+import copy
+import hashlib
+from collections import OrderedDict, Counter
 from . import bitfile_path, obtain, get_version
 from .ip import SocIp, QickMetadata
 from .parser import parse_to_bin
-from .streamer import DataStreamer
+from .streamer import DataStreamer, ProcessDataStreamer
 from .qick_asm import QickConfig
 from .asm_v1 import QickProgram
 from .drivers.generator import *
 from .drivers.readout import *
 from .drivers.tproc import *
+from .drivers.dma_pool import dma_pool
 
 
 class AxisSwitch(SocIp):
@@ -237,6 +240,8 @@ class QickSoc(Overlay, QickConfig):
     :type no_tproc: bool
     :param no_rf: Use if this is a special firmware that doesn't have an RF data converter.
     :type no_rf: bool
+    :param streamer_process: Run the streaming readout in a separate process instead of a thread (see streamer.ProcessDataStreamer).
+    :type streamer_process: bool
     """
 
     # The following constants are no longer used. Some of the values may not match the bitfile.
@@ -258,7 +263,7 @@ class QickSoc(Overlay, QickConfig):
     #gain_resolution_signed_bits = 16
 
     # Constructor.
-    def __init__(self, bitfile=None, force_init_clks=False, ignore_version=True, no_tproc=False, no_rf=False, clk_output=None, external_clk=None, **kwargs):
+    def __init__(self, bitfile=None, force_init_clks=False, ignore_version=True, no_tproc=False, no_rf=False, clk_output=None, external_clk=None, streamer_process=False, **kwargs):
         """
         Constructor method
         """
@@ -274,6 +279,14 @@ class QickSoc(Overlay, QickConfig):
             Overlay.__init__(
                 self, bitfile, ignore_version=ignore_version, download=False, **kwargs)
 
+        # Accumulators for decimated data, see clear_decimated_sum()
+        self._dec_sums = {}
+
+        # Last configuration applied by each configuration method, see get_config_stats()
+        self._applied = {}
+        self._config_loads = Counter()
+        self._config_skips = Counter()
+
         # Initialize the configuration
         self._cfg = {}
         QickConfig.__init__(self)
@@ -315,7 +328,10 @@ class QickSoc(Overlay, QickConfig):
 
             self.map_signal_paths()
 
-            self._streamer = DataStreamer(self)
+            if streamer_process:
+                self._streamer = ProcessDataStreamer(self)
+            else:
+                self._streamer = DataStreamer(self)
 
             # list of objects that need to be registered for autoproxying over Pyro
             self.autoproxy = [self.streamer, self.tproc]
@@ -328,6 +344,12 @@ class QickSoc(Overlay, QickConfig):
     def streamer(self):
         return self._streamer
 
+    def close(self):
+        """Stop the streamer and free its resources (for the process streamer, the worker process and its shared memory).
+        """
+        if hasattr(self, '_streamer'):
+            self._streamer.close()
+
     def map_signal_paths(self):
         """
         Make lists of signal generator, readout, and buffer blocks in the firmware.
@@ -622,18 +644,86 @@ class QickSoc(Overlay, QickConfig):
             # TODO: remove the default, or pick a better fallback value
             length = self.avg_bufs[ch]['buf_maxlen']
 
+        self.start_decimated(ch, address, length)
+        return self.finish_decimated(ch, length)
+
+    def start_decimated(self, ch, address, length):
+        """
+        Start a transfer from the readout decimated buffer, without waiting for it to complete.
+        Use finish_decimated() to get the data.
+
+        :param ch: ADC channel
+        :type ch: int
+        :param address: Address of data
+        :type address: int
+        :param length: Buffer transfer length
+        :type length: int
+        """
         # we must transfer an even number of samples, so we pad the transfer size
         transfer_len = length + length % 2
 
         # there is a bug which causes the first sample of a transfer to always be the sample at address 0
         # we work around this by requesting an extra 2 samples at the beginning
-        data = self.avg_bufs[ch].transfer_buf(
+        self.avg_bufs[ch].start_transfer_buf(
             (address-2) % self.avg_bufs[ch]['buf_maxlen'], transfer_len+2)
 
+    def finish_decimated(self, ch, length):
+        """
+        Wait for a transfer started by start_decimated() to complete, and get the data.
+
+        :param ch: ADC channel
+        :type ch: int
+        :param length: Buffer transfer length (must match the value passed to start_decimated())
+        :type length: int
+        :return: I,Q pairs
+        :rtype: ndarray
+        """
+        data = self.avg_bufs[ch].finish_transfer_buf()
+
         # we remove the padding here
         return data[2:length+2]
 
-    def get_accumulated(self, ch, address=0, length=None):
+    def clear_decimated_sum(self, ch, length, dtype=np.int64):
+        """
+        Allocate (or reset) an accumulator for decimated data, used by add_decimated().
+        The accumulator stays on the QickSoc, so only the final sum needs to leave the board.
+
+        :param ch: ADC channel
+        :type ch: int
+        :param length: Buffer transfer length
+        :type length: int
+        :param dtype: Integer type of the accumulator (int32 is enough for up to 65536 transfers)
+        :type dtype: numpy.dtype
+        """
+        # the accumulator includes the padding samples of each transfer (see get_decimated()), so the data can be added straight from the DMA buffer
+        self._dec_sums[ch] = (length, np.zeros((length + length % 2 + 2, 2), dtype=dtype))
+
+    def add_decimated(self, ch, address=0):
+        """
+        Transfer data from the readout decimated buffer and add it to the accumulator allocated by clear_decimated_sum(), in place.
+
+        :param ch: ADC channel
+        :type ch: int
+        :param address: Address of data
+        :type address: int
+        """
+        length, acc = self._dec_sums[ch]
+        self.start_decimated(ch, address, length)
+        self.avg_bufs[ch].finish_transfer_buf(acc=acc)
+
+    def get_decimated_sum(self, ch):
+        """
+        Get the decimated data accumulated by add_decimated().
+
+        :param ch: ADC channel
+        :type ch: int
+        :return: sum of I,Q pairs
+        :rtype: ndarray
+        """
+        length, acc = self._dec_sums[ch]
+        return acc[2:length+2]
+
+    def get_accumulated(self, ch, address=0, length=None, buff_idx=None):
         """
         Acquires data from the readout accumulated buffer
 
@@ -643,6 +733,8 @@ class QickSoc(Overlay, QickConfig):
         :type address: int
         :param length: Buffer transfer length
         :type length: int
+        :param buff_idx: Zero-copy DMA buffer to use (see AxisAvgBuffer.transfer_avg()), or None to get a copy
+        :type buff_idx: int
         :returns:
             - di[:length] (:py:class:`list`) - list of accumulated I data
             - dq[:length] (:py:class:`list`) - list of accumulated Q data
@@ -652,17 +744,70 @@ class QickSoc(Overlay, QickConfig):
             # TODO: remove the default, or pick a better fallback value
             length = self.avg_bufs[ch]['avg_maxlen']
 
+        self.start_accumulated(ch, address, length, buff_idx)
+        return self.finish_accumulated(ch, length)
+
+    def start_accumulated(self, ch, address, length, buff_idx=None):
+        """
+        Start a transfer from the readout accumulated buffer, without waiting for it to complete.
+        Use finish_accumulated() to get the data.
+        Transfers on channels that share a DMA engine must not overlap (see plan_avg_transfers()).
+
+        :param ch: ADC channel
+        :type ch: int
+        :param address: Address of data
+        :type address: int
+        :param length: Buffer transfer length
+        :type length: int
+        :param buff_idx: Zero-copy DMA buffer to use (see AxisAvgBuffer.transfer_avg()), or None to get a copy
+        :type buff_idx: int
+        """
         # we must transfer an even number of samples, so we pad the transfer size
         transfer_len = length + length % 2
 
         # there is a bug which causes the first sample of a transfer to always be the sample at address 0
         # we work around this by requesting an extra 2 samples at the beginning
-        data = self.avg_bufs[ch].transfer_avg(
-            (address-2) % self.avg_bufs[ch]['avg_maxlen'], transfer_len+2)
+        self.avg_bufs[ch].start_transfer_avg(
+            (address-2) % self.avg_bufs[ch]['avg_maxlen'], transfer_len+2, buff_idx=buff_idx)
+
+    def finish_accumulated(self, ch, length, out=None):
+        """
+        Wait for a transfer started by start_accumulated() to complete, and get the data.
+
+        :param ch: ADC channel
+        :type ch: int
+        :param length: Buffer transfer length (must match the value passed to start_accumulated())
+        :type length: int
+        :param out: Array of shape (length, 2) to copy the data into, instead of returning a new array
+        :type out: ndarray
+        :return: I,Q pairs
+        :rtype: ndarray
+        """
+        data = self.avg_bufs[ch].finish_transfer_avg(copy=out is None)
 
         # we remove the padding here
+        if out is not None:
+            out[:] = data[2:length+2]
+            return out
         return data[2:length+2]
 
+    def plan_avg_transfers(self, ch_list):
+        """
+        Split a list of readout channels into batches that can be transferred concurrently.
+        Buffers that share a DMA engine (through a switch) must be read one after another,
+        so each batch has at most one channel for each DMA engine.
+
+        :param ch_list: List of readout channels
+        :type ch_list: list of int
+        :return: list of batches, each a list of indices into ch_list
+        :rtype: list
+        """
+        dma2chs = OrderedDict()
+        for iCh, ch in enumerate(ch_list):
+            dma2chs.setdefault(id(self.avg_bufs[ch].dma_avg), []).append(iCh)
+        nbatches = max([len(x) for x in dma2chs.values()], default=0)
+        return [[x[i] for x in dma2chs.values() if i < len(x)] for i in range(nbatches)]
+
     def configure_readout(self, ch, ro_regs):
         """Configure readout channel output style and frequency.
         This method is only for use with PYNQ-configured readouts.
@@ -674,8 +819,12 @@ class QickSoc(Overlay, QickConfig):
         ro_regs : dict
             readout registers, from QickConfig.calc_ro_regs()
         """
+        ro_regs = obtain(ro_regs)
+        if not self._config_changed('readout', ch, ro_regs):
+            return
         buf = self.avg_bufs[ch]
         buf.readout.set_all_int(ro_regs)
+        self._config_applied('readout', ch, ro_regs)
 
     def config_avg(self, ch, address=0, length=1, enable=True):
         """Configure and optionally enable accumulation buffer
@@ -718,16 +867,83 @@ class QickSoc(Overlay, QickConfig):
         """
         return self['readouts'][ch]['avg_maxlen']
 
-    def load_pulse_data(self, ch, data, addr):
-        """Load pulse data into signal generators
+    def get_dma_pool_stats(self):
+        """Get the usage statistics of the DMA buffer pool shared by the drivers.
+        :return: see DmaBufferPool.get_stats()
+        :rtype: dict
+        """
+        return dma_pool.get_stats()
+
+    def load_pulse_data(self, ch, data, addr, force=False):
+        """Load pulse data into signal generators.
+        The generator remembers what it has loaded, and skips the load if the same data is already at this address.
         :param ch: Channel
         :type ch: int
         :param data: array of (I, Q) values for pulse envelope
         :type data: int16 array
         :param addr: address to start data at
         :type addr: int
+        :param force: load even if the data is already in memory
+        :type force: bool
+        """
+        return self.gens[ch].load(xin=data, addr=addr, force=force)
+
+    def load_pulse_batch(self, ch, envs, force=False):
+        """Load several pulses into a signal generator, using one DMA for each block of pulses that are contiguous in memory.
+        As with load_pulse_data(), pulses that are already loaded are skipped.
+        :param ch: Channel
+        :type ch: int
+        :param envs: list of (data, addr) pairs, as for load_pulse_data()
+        :type envs: list
+        :param force: load even if the data is already in memory
+        :type force: bool
+        """
+        self.gens[ch].load_batch(obtain(envs), force=force)
+
+    def invalidate_pulse_cache(self, ch=None):
+        """Forget what pulse data is loaded in the signal generators, so the next load_pulse_data() always loads.
+        Use this if the waveform memories may have been written by something other than this QickSoc.
+        :param ch: Channel (None for all channels)
+        :type ch: int
+        """
+        gens = self.gens if ch is None else [self.gens[ch]]
+        for gen in gens:
+            if hasattr(gen, 'invalidate_envelopes'):
+                gen.invalidate_envelopes()
+
+    def get_pulse_cache_stats(self):
+        """Get the number of pulse loads done and skipped by each signal generator.
+        :return: list of dicts with the number of loads, skips, and envelopes resident in memory (None for generators without a waveform memory)
+        :rtype: list
+        """
+        stats = []
+        for gen in self.gens:
+            if hasattr(gen, 'env_cache'):
+                stats.append({'loads': gen.env_loads, 'skips': gen.env_skips, 'resident': len(gen.env_cache)})
+            else:
+                stats.append(None)
+        return stats
+
+    def set_register_shadow(self, enable=True):
+        """Enable or disable register shadowing (see SocIp.enable_shadow()) for the signal generators and readouts.
+        With shadowing enabled, reconfiguring a block only writes the registers whose values change.
+        :param enable: enable shadowing
+        :type enable: bool
+        """
+        for ip in self.gens + self.readouts:
+            if not isinstance(ip, SocIp):
+                continue
+            if enable:
+                ip.enable_shadow()
+            else:
+                ip.disable_shadow()
+
+    def get_mmio_stats(self):
+        """Get the register access counts for the signal generators and readouts.
+        :return: dict of stats (see SocIp.get_mmio_stats()), by block name
+        :rtype: dict
         """
-        return self.gens[ch].load(xin=data, addr=addr)
+        return {ip['fullpath']: ip.get_mmio_stats() for ip in self.gens + self.readouts if isinstance(ip, SocIp)}
 
     def set_nyquist(self, ch, nqz, force=False):
         """
@@ -775,7 +991,11 @@ class QickSoc(Overlay, QickConfig):
             Tones to configure.
             This is generated by QickConfig.calc_muxgen_regs().
         """
+        tones = obtain(tones)
+        if not self._config_changed('mux_gen', ch, tones):
+            return
         self.gens[ch].set_tones_int(tones)
+        self._config_applied('mux_gen', ch, tones)
 
     def config_mux_readout(self, pfbpath, cfgs, sel=None):
         """Set up a list of readout frequencies all at once, using raw (integer) units.
@@ -790,6 +1010,11 @@ class QickSoc(Overlay, QickConfig):
         sel : str
             Output selection (if supported), default to 'product'
         """
+        cfgs = obtain(cfgs)
+        # compare the arguments as given, before sel is defaulted
+        config = (sel, cfgs)
+        if not self._config_changed('mux_readout', pfbpath, config):
+            return
         pfb = getattr(self, pfbpath)
         if pfb.HAS_OUTSEL:
             if sel is None: sel = 'product'
@@ -799,6 +1024,7 @@ class QickSoc(Overlay, QickConfig):
                 raise RuntimeError("this readout doesn't support configuring sel, you have sel=%s" % (sel))
         for cfg in cfgs:
             pfb.set_freq_int(cfg)
+        self._config_applied('mux_readout', pfbpath, config)
 
     def set_iq(self, ch, f, i, q, ro_ch=None, phase_reset=True):
         """
@@ -823,16 +1049,97 @@ class QickSoc(Overlay, QickConfig):
         self.iqs[ch].set_mixer_freq(f)
         self.iqs[ch].set_iq(i, q)
 
-    def load_bin_program(self, binprog):
+    def load_bin_program(self, binprog, force=False):
         """
         Write the program to the tProc program memory.
-        """
+        The program memory is not rewritten if it already holds an identical binary.
+        The tProc v2 wave memory is always written, because programs with sweeps modify it while they run:
+        after an aborted run, it may not hold the compiled values even if the last write was identical.
+
+        Parameters
+        ----------
+        binprog : list or dict
+            the compiled program
+        force : bool
+            write the program even if it is already loaded
+        """
+        binprog = obtain(binprog)
+        if force:
+            self.invalidate_config('prog')
         if self.TPROC_VERSION == 1:
-            self.tproc.load_bin_program(obtain(binprog))
+            digest = hashlib.blake2b(np.array(binprog, dtype=np.uint64)).digest()
+            if self._config_changed('prog', 'pmem', digest):
+                self.tproc.load_bin_program(binprog)
+                self._config_applied('prog', 'pmem', digest)
         elif self.TPROC_VERSION == 2:
-            self.tproc.Load_PMEM(binprog['pmem'])
+            digest = hashlib.blake2b(np.array(binprog['pmem'], dtype=np.int64)).digest()
+            if self._config_changed('prog', 'pmem', digest):
+                self.tproc.Load_PMEM(binprog['pmem'])
+                self._config_applied('prog', 'pmem', digest)
             self.tproc.load_mem(3, binprog['wmem'])
 
+    def _config_changed(self, op, key, value):
+        """Check a configuration against the one last applied.
+        If they are the same, the skip is counted.
+
+        Parameters
+        ----------
+        op : str
+            the type of configuration
+        key
+            the block or channel being configured
+        value
+            the configuration
+
+        Returns
+        -------
+        bool
+            True if the configuration needs to be applied
+        """
+        if (op, key) in self._applied and self._applied[(op, key)] == value:
+            self._config_skips[op] += 1
+            return False
+        return True
+
+    def _config_applied(self, op, key, value):
+        """Record a configuration that has been applied.
+        See _config_changed() for parameters.
+        """
+        self._applied[(op, key)] = copy.deepcopy(value)
+        self._config_loads[op] += 1
+
+    def invalidate_config(self, op=None):
+        """Forget the configurations applied by configure_readout(), config_mux_gen(), config_mux_readout() and load_bin_program(),
+        so they will be applied again next time even if unchanged.
+        Use this if you have configured the blocks or tProc without going through these methods.
+
+        Parameters
+        ----------
+        op : str
+            the type of configuration to forget ('readout', 'mux_gen', 'mux_readout', 'prog'), or None for all
+        """
+        if op is None:
+            self._applied.clear()
+        else:
+            for k in [k for k in self._applied if k[0]==op]:
+                del self._applied[k]
+
+    def get_config_stats(self):
+        """Get the number of configurations that were applied, and skipped because the same configuration was already applied.
+
+        Returns
+        -------
+        dict
+            dicts of counts, keyed by 'applied' and 'skipped' and then by type of configuration
+        """
+        return {'applied': dict(self._config_loads), 'skipped': dict(self._config_skips)}
+
+    def reset_config_stats(self):
+        """Reset the counters reported by get_config_stats().
+        """
+        self._config_loads.clear()
+        self._config_skips.clear()
+
     def start_src(self, src):
         """
         Sets the start source of tProc
@@ -927,10 +1234,13 @@ class QickSoc(Overlay, QickConfig):
         self.start_src("internal")
         self.start_tproc()
 
-    def start_readout(self, total_shots, counter_addr=1, ch_list=None, reads_per_shot=1, stride=None):
+    def start_readout(self, total_shots, counter_addr=1, ch_list=None, reads_per_shot=1, stride=None, zero_copy=False):
         """
         Start a streaming readout of the accumulated buffers.
 
+        In zero-copy mode, the streamer DMAs into a ring of preallocated buffers and poll_data() returns views into those buffers instead of copies.
+        The data returned by poll_data() is then only valid until the next call to poll_data(), so it must be consumed (copied into the result array) before then.
+
         :param total_shots: Final value expected for the shot counter
         :type total_shots: int
         :param counter_addr: Data memory address for the shot counter
@@ -939,8 +1249,10 @@ class QickSoc(Overlay, QickConfig):
         :type ch_list: list of int
         :param reads_per_shot: Number of data points to expect per counter increment
         :type reads_per_shot: list of int
-        :param stride: Default number of measurements to transfer at a time.
-        :type stride: int
+        :param stride: Default number of measurements to transfer at a time. Use "adaptive" to choose the stride based on the measured shot rate (see streamer.AdaptiveStride).
+        :type stride: int or str
+        :param zero_copy: Return views into the DMA buffers instead of copies.
+        :type zero_copy: bool
         """
         ch_list = obtain(ch_list)
         reads_per_shot = obtain(reads_per_shot)
@@ -949,7 +1261,10 @@ class QickSoc(Overlay, QickConfig):
             reads_per_shot = [reads_per_shot]*len(ch_list)
         streamer = self.streamer
 
-        if not streamer.readout_worker.is_alive():
+        if streamer.readout_worker is None:
+            # the process streamer starts its worker on the first readout
+            streamer.start_worker()
+        elif not streamer.readout_worker.is_alive():
             print("restarting readout worker")
             streamer.start_worker()
             print("worker restarted")
@@ -978,8 +1293,19 @@ class QickSoc(Overlay, QickConfig):
         streamer.total_count = total_shots
         streamer.count = 0
 
+        streamer.alloc_bufs(ch_list, zero_copy)
+        streamer.reset_bufs(zero_copy)
+
         streamer.done_flag.clear()
-        streamer.job_queue.put((total_shots, counter_addr, ch_list, reads_per_shot, stride))
+        streamer.job_queue.put((total_shots, counter_addr, ch_list, reads_per_shot, stride, zero_copy))
+
+    def stop_readout(self):
+        """
+        Stop the tProc and the streaming readout, e.g. when an acquisition is abandoned before all its data has been read.
+        The next start_readout() waits for the readout loop to finish, and discards any data left in the streamer.
+        """
+        self.stop_tproc()
+        self.streamer.stop_readout()
 
     def poll_data(self, totaltime=0.1, timeout=None):
         """
@@ -990,18 +1316,27 @@ class QickSoc(Overlay, QickConfig):
         * timeout is defined, and the timeout expired without getting new data in the queue
         If there are errors in the error queue, raise the first one.
 
+        In zero-copy mode (see start_readout()), the data returned by the previous call is released for reuse by the streamer,
+        and we also stop when all the zero-copy buffers are in use.
+
         :param totaltime: How long to acquire data (negative value = ignore total time and total count, just read until timeout)
         :type totaltime: float
         :param timeout: How long to wait for the next data packet (None = wait forever)
         :type timeout: float
-        :return: list of (data, stats) pairs, oldest first
+        :return: list of (number of shots, (data, stats)) pairs, oldest first;
+            stats is a tuple of (time since the start of the readout, shots counted by the tProc, buffer address of the last channel, shots in this transfer, stride)
         :rtype: list
         """
         streamer = self.streamer
 
+        # the data we returned last time has been consumed, so the streamer can reuse its buffers
+        streamer.release_bufs()
+
         time_end = time.time() + totaltime
         new_data = []
         while (totaltime < 0) or (streamer.count < streamer.total_count and time.time() < time_end):
+            if streamer.bufs_exhausted():
+                break
             try:
                 raise RuntimeError("exception in readout loop") from streamer.error_queue.get(block=False)
             except queue.Empty:
@@ -1012,12 +1347,16 @@ class QickSoc(Overlay, QickConfig):
                 if streamer.stop_flag.is_set() or data is None:
                     break
                 streamer.count += length
+                # dummy packets (from errors) don't hold a buffer
+                if data[0] is not None:
+                    data = (streamer.unpack_data(data[0]), data[1])
+                    streamer.hold_buf()
                 new_data.append((length, data))
             except queue.Empty:
                 break
         return new_data
 
-    def clear_ddr4(self, length=None):
+    def clear_ddr4(self, length=None, start=0):
         """Clear the DDR4 buffer, filling it with 0's.
         This is not necessary (the buffer will overwrite old data), but may be useful for debugging.
         Clearing the full buffer (4 GB) typically takes 4-5 seconds.
@@ -1025,14 +1364,20 @@ class QickSoc(Overlay, QickConfig):
         Parameters
         ----------
         length : int
-            Number of samples to clear (starting at the beginning of the buffer). If None, clear the entire buffer.
+            Number of samples to clear. If None, clear to the end of the buffer.
+        start : int
+            First sample to clear.
         """
-        self.ddr4_buf.clear_mem(length)
+        self.ddr4_buf.clear_mem(length, start)
 
-    def get_ddr4(self, nt, start=None):
+    def get_ddr4(self, nt, start=None, out=None, chunk_len=None):
         """Get data from the DDR4 buffer.
         The first samples (typically 401 or 801) of the buffer are always stale data from the previous acquisition.
 
+        By default, the whole capture is returned as a new array.
+        For captures too large to hold in memory, give an output array or file (the data is then copied in chunks),
+        or use iter_ddr4().
+
         Parameters
         ----------
         nt : int
@@ -1043,8 +1388,45 @@ class QickSoc(Overlay, QickConfig):
             If a value is specified, the end address of the transfer window will also be incremented.
             If None, the junk at the start of the buffer will be skipped but the end address will not be incremented.
             This reduces the amount of data, giving you exactly the block of valid data from a DDR4 trigger with the same value of nt.
+        out : array-like or str
+            Array to copy the data into, with shape (n_samples, 2) - typically a numpy memmap or an HDF5 dataset.
+            If a str, the data is written to a new .npy file at this path, which is returned as a memmap.
+        chunk_len : int
+            Number of samples per chunk, if out is defined (None = default).
+
+        Returns
+        -------
+        ndarray
+            I,Q pairs (out, if defined)
         """
-        return self.ddr4_buf.get_mem(nt, start)
+        if out is None:
+            return self.ddr4_buf.get_mem(nt, start)
+        if isinstance(out, str):
+            out = np.lib.format.open_memmap(out, mode='w+', dtype=np.int16, shape=(self.ddr4_buf.mem_len(nt, start), 2))
+        return self.ddr4_buf.read_mem_into(out, nt, start, chunk_len)
+
+    def iter_ddr4(self, nt, start=None, chunk_len=None, copy=False):
+        """Get data from the DDR4 buffer in chunks, so large captures can be processed with constant memory use.
+        The chunks cover the same data as get_ddr4().
+
+        Parameters
+        ----------
+        nt : int
+            Number of data transfers, see get_ddr4().
+        start : int
+            Number of samples to skip, see get_ddr4().
+        chunk_len : int
+            Number of samples per chunk (must be even, None = default).
+        copy : bool
+            Yield a new array for each chunk. Otherwise, each chunk is a view into a reused buffer and is only valid until the next chunk.
+            Use copy=True if you are iterating over Pyro.
+
+        Returns
+        -------
+        generator
+            (offset, data) pairs, where offset is the index of the chunk's first sample and data is an array of I,Q pairs.
+        """
+        return self.ddr4_buf.iter_mem(nt, start, chunk_len, copy)
 
     def arm_ddr4(self, ch, nt, force_overwrite=False):
         """Prepare the DDR4 buffer to take data.
@@ -1066,6 +1448,101 @@ class QickSoc(Overlay, QickConfig):
         self.ddr4_buf.set_switch(self['readouts'][ch]['avgbuf_fullpath'])
         self.ddr4_buf.arm(nt, force_overwrite)
 
+    def arm_ddr4_segments(self, ch, nt, n_segments, force_overwrite=False):
+        """Prepare the DDR4 buffer for a segmented capture, which records many shots with a single arm.
+
+        The buffer only responds to the first trigger, so the capture is one continuous recording of n_segments*nt transfers
+        (plus the junk at the start of the buffer), which is split into segments by ``get_ddr4_segments``.
+        For each segment to hold one shot, the program must trigger the buffer once and then run its shots with a period of exactly
+        nt transfers (nt*burst_len decimated samples; see the QickSoc config for burst_len).
+
+        Parameters
+        ----------
+        ch : int
+            The readout channel to record (index in 'readouts' list).
+        nt : int
+            Number of data transfers per segment.
+        n_segments : int
+            Number of segments.
+        force_overwrite : bool
+            See ``arm_ddr4``.
+        """
+        self.ddr4_buf.set_switch(self['readouts'][ch]['avgbuf_fullpath'])
+        self.ddr4_buf.arm_segments(nt, n_segments, force_overwrite)
+
+    def get_ddr4_segments(self, nt, n_segments, samples=None, out=None):
+        """Get the data from a segmented capture (see ``arm_ddr4_segments``).
+
+        Parameters
+        ----------
+        nt : int
+            Number of data transfers per segment.
+        n_segments : int
+            Number of segments.
+        samples : int
+            Number of samples to keep at the start of each segment. If None, keep the whole segment (nt*burst_len samples).
+        out : array-like
+            Array to copy the data into, with shape (n_segments*nt*burst_len, 2), see ``get_ddr4``.
+
+        Returns
+        -------
+        ndarray
+            I,Q pairs, with shape (n_segments, samples, 2); this is a view into a single array holding the whole capture
+        """
+        return self.ddr4_buf.get_segments(nt, n_segments, samples, out)
+
+    def sum_ddr4_segments(self, nt, n_segments, samples=None, calc_var=False):
+        """Sum the data from a segmented capture over segments, reading the DDR4 buffer in blocks.
+        This is used by ``average_ddr4_segments`` and ``AcquireMixin.acquire_ddr4_averaged``.
+
+        Parameters
+        ----------
+        nt : int
+            Number of data transfers per segment.
+        n_segments : int
+            Number of segments.
+        samples : int
+            Number of samples to keep at the start of each segment, see ``get_ddr4_segments``.
+        calc_var : bool
+            Also compute the sum of squares.
+
+        Returns
+        -------
+        ndarray
+            Sum of I,Q pairs over segments (int64), with shape (samples, 2)
+        ndarray
+            Sum of squares, or None if calc_var is False
+        """
+        return self.ddr4_buf.sum_segments(nt, n_segments, samples, calc_var)
+
+    def average_ddr4_segments(self, nt, n_segments, samples=None, calc_var=False):
+        """Average the data from a segmented capture over segments (see ``arm_ddr4_segments``).
+        The buffer is read in blocks, so this uses much less memory than ``get_ddr4_segments``.
+
+        Parameters
+        ----------
+        nt : int
+            Number of data transfers per segment.
+        n_segments : int
+            Number of segments.
+        samples : int
+            Number of samples to keep at the start of each segment, see ``get_ddr4_segments``.
+        calc_var : bool
+            Also compute the variance over segments.
+
+        Returns
+        -------
+        ndarray
+            Mean I,Q pairs, with shape (samples, 2)
+        ndarray
+            Variance (only if calc_var is True)
+        """
+        d_sum, d_sumsq = self.sum_ddr4_segments(nt, n_segments, samples, calc_var)
+        mean = d_sum/n_segments
+        if calc_var:
+            return mean, d_sumsq/n_segments - mean**2
+        return mean
+
     def arm_mr(self, ch):
         """Prepare the Multi-Rate buffer to take data.
         This must be called before starting a program that triggers the buffer.
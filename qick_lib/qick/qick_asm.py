@@ -4,11 +4,13 @@ This contains tools for managing the board configuration and the base class for
 The assembly language for QICK programs is defined separately for the v1 and v2 tProcessors.
 """
 import logging
+import asyncio
 import numpy as np
 import json
 from collections import namedtuple, OrderedDict, defaultdict
 import operator
 import functools
+from concurrent.futures import ThreadPoolExecutor
 from abc import ABC, abstractmethod
 from tqdm.auto import tqdm
 
@@ -950,18 +952,23 @@ class AbsQickProgram:
             for name, env in envdict['envs'].items():
                 env['data'] = decode_array(env['data'])
 
-    def config_all(self, soc, load_pulses=True, reset=False):
+    def config_all(self, soc, load_pulses=True, reset=False, force=False):
         """
         Load the waveform memory, gens, ROs, and program memory as specified for this program.
         The decimated+accumulated buffers are not configured, since those should be re-configured for each acquisition.
         The tProc is set to internal start before any other configuration is done, to prevent spurious external starts.
 
+        The QickSoc remembers the configuration it last applied, and only applies what has changed since then
+        (see QickSoc.get_config_stats()).
+
         Parameters
         ----------
         reset : bool
             Force-stop the tProc before loading the program.
             This option only affects tProc v1, where the reset takes several ms.
             For tProc v2, where reset is easy, we always do the reset.
+        force : bool
+            Apply the entire configuration, even the parts that are unchanged.
         """
         # compile() first, because envelopes might be declared in a make_program() inside _make_asm()
         if self.binprog is None:
@@ -973,9 +980,12 @@ class AbsQickProgram:
         # now stop the tproc (if the tproc supports it)
         soc.stop_tproc(lazy=not reset)
 
+        if force:
+            soc.invalidate_config()
+
         # Load the pulses from the program into the soc
         if load_pulses:
-            self.load_pulses(soc)
+            self.load_pulses(soc, force=force)
 
         # Configure signal generators
         self.config_gens(soc)
@@ -1393,20 +1403,23 @@ class AbsQickProgram:
 
         self.add_envelope(ch, name, idata=triang(length=lenreg, maxv=maxv))
 
-    def load_pulses(self, soc):
+    def load_pulses(self, soc, force=False):
         """Loads pulses that were added using add_envelope into the SoC's signal generator memories.
+        Pulses that are already loaded (same data at the same address) are skipped, unless force=True.
 
         Parameters
         ----------
         soc : Qick object
             Qick object
+        force : bool
+            Load every pulse, even if it's already in memory.
 
         """
         for iCh, pulses in enumerate(self.envelopes):
-            for name, pulse in pulses['envs'].items():
-                soc.load_pulse_data(iCh,
-                        data=pulse['data'],
-                        addr=pulse['addr'])
+            # the envelopes are packed contiguously in memory, so each generator's envelopes can be loaded with a single DMA
+            envs = [(pulse['data'], pulse['addr']) for pulse in pulses['envs'].values()]
+            if envs:
+                soc.load_pulse_batch(iCh, envs, force=force)
 
     def reset_timestamps(self, gen_t0=None):
         # used by init and sync_all()
@@ -1452,6 +1465,8 @@ class AbsQickProgram:
 
 class AcquireMixin:
     """Adds acquire() and acquire_decimated() methods for acquiring readout data, and run_rounds() for running repeatedly without acquisition.
+    Each of these has an asyncio version (acquire_async(), acquire_decimated_async(), run_rounds_async()).
+    acquire_ddr4_averaged() records waveforms with the DDR4 buffer and averages them on the QickSoc.
     Program classes that use this mixin must call setup_acquire() after _init_prog() and before acquire()/acquire_decimated().
     """
     def __init__(self, *args, **kwargs):
@@ -1464,8 +1479,23 @@ class AcquireMixin:
         # measurements from the most recent acquisition
         # raw I/Q data without normalizing to window length or averaging over reps
         self.d_buf = None
-        # shot-by-shot threshold classification
-        self.shots = None
+        # shot-by-shot threshold classification, packed 8 to a byte (see get_shots())
+        self._shot_bits = None
+        # number of shots over threshold at each point of the averaged result, for the round in progress
+        self._shot_counts = None
+        # running sums over the averaged loop, used instead of d_buf when acquire() is called with save_raw=False
+        self.run_sum = None
+        self.run_sumsq = None
+        self.run_count = None
+        # parameters and round-averaged data of the acquire() in progress
+        # with pipelined rounds, _avg_d is only written by the worker thread, and only read after the worker has been joined
+        self._acq_params = None
+        self._avg_d = None
+        # raw data buffers, worker thread, and pending averaging jobs for pipelined acquire() rounds
+        self._d_bufs = None
+        self._round_pool = None
+        self._round_jobs = None
+        self._ibuf = None
 
     def _init_declarations(self):
         super()._init_declarations()
@@ -1542,19 +1572,65 @@ class AcquireMixin:
         """
         return self.d_buf
 
-    def get_shots(self):
-        """Get the shot-by-shot threshold decisions.
+    @property
+    def shots(self):
+        """Shot-by-shot threshold decisions from the last round (see get_shots()).
+        """
+        return self.get_shots()
+
+    def get_shots(self, packed=False):
+        """Get the shot-by-shot threshold decisions from the last round.
+        The decisions are stored packed 8 to a byte, and unpacked on each call.
+
+        Parameters
+        ----------
+        packed : bool
+            Return the decisions as stored, packed 8 to a byte in the format used by np.packbits().
 
         Returns
         -------
         list of ndarray
-            Array of shots for each readout channel.
+            Array of shots (0 or 1, as floats) for each readout channel, with dimensions (*loop_dims, n_reads) if not packed.
         """
-        return self.shots
+        if packed or self._shot_bits is None:
+            return self._shot_bits
+        return self._unpack_shots()
+
+    def _unpack_shots(self):
+        """Convert the packed shot decisions from a round to the format of self.shots.
 
-    def acquire(self, soc, soft_avgs=1, load_pulses=True, start_src="internal", threshold=None, angle=None, progress=True, remove_offset=True):
+        Returns
+        -------
+        list of ndarray
+            Array of shots (0 or 1, as floats) for each readout channel, with dimensions (*loop_dims, n_reads).
+        """
+        total_count = functools.reduce(operator.mul, self.loop_dims)
+        shots = []
+        for packed_shots, nreads in zip(self._shot_bits, self.reads_per_shot):
+            shots.append(np.unpackbits(packed_shots, count=total_count*nreads).reshape((*self.loop_dims, nreads)).astype(float))
+        return shots
+
+    def acquire(self, soc, soft_avgs=1, load_pulses=True, start_src="internal", threshold=None, angle=None, progress=True, remove_offset=True, save_raw=True, calc_var=False, hist_bins=None, hist_range=None):
         """Acquire data using the accumulated readout.
 
+        By default, the raw data for every shot is saved (see get_raw()) and averaged at the end of each round.
+        With save_raw=False, each chunk of data is instead folded into running sums as it arrives,
+        so memory scales with the number of points in the averaged result rather than the number of shots,
+        and partial averages are available while the acquisition runs (see get_running_avg()).
+        This skips any custom _average_buf() defined by a subclass.
+
+        With save_raw=True and multiple rounds, each round is averaged by a worker thread while the next round runs,
+        using two raw data buffers in alternation; get_raw() returns the buffer for the last round.
+        The average over rounds belongs to the worker until the acquisition finishes: get_acquire_result() waits for the worker before reading it,
+        and starting a new acquisition waits for the worker of an interrupted one.
+        If the acquisition is interrupted by an exception (including an error in the worker), the readout is stopped and the worker is waited for.
+
+        Thresholding and shot histograms are computed on each chunk of data as it arrives, so thresholding doesn't require save_raw=True.
+        The shot decisions are stored packed 8 to a byte (see get_shots()).
+        With save_raw=True, the decisions are counted at each point of the averaged result as they arrive, and averaged at the end of each round;
+        a subclass that defines its own _average_buf() gets them as raw data instead, as if the I values were the decisions and the Q values were 0.
+        With save_raw=False, they are averaged with running sums.
+
         Parameters
         ----------
         soc : QickSoc
@@ -1580,6 +1656,14 @@ class AcquireMixin:
         remove_offset: bool
             Some readouts (muxed and tProc-configured) introduce a small fixed offset to the I and Q values of every decimated sample.
             This subtracts that offset, if any, before returning the averaged IQ values or rotating to apply software thresholding.
+        save_raw: bool
+            Save the raw data for every shot. If False, only running sums are kept.
+        calc_var: bool
+            If save_raw is False, also accumulate sums of squares, so the shot-to-shot variance is available from get_running_var().
+        hist_bins: int
+            If defined, histogram the rotated I values of every shot (see get_shot_hist()).
+        hist_range: (float, float)
+            Lower and upper edges of the histogram, in length-normalized units; must be defined if hist_bins is.
 
         Returns
         -------
@@ -1590,19 +1674,9 @@ class AcquireMixin:
             dimensions for a simple averaging program: (n_ch, n_reads, 2)
             dimensions for a program with multiple expts/steps: (n_ch, n_reads, n_expts, 2)
         """
-        self.config_all(soc, load_pulses=load_pulses)
-
-        if any([x is None for x in [self.counter_addr, self.loop_dims, self.avg_level]]):
-            raise RuntimeError("data dimensions need to be defined with setup_acquire() before calling acquire()")
-
-        # configure tproc for internal/external start
-        soc.start_src(start_src)
-
-        n_ro = len(self.ro_chs)
+        self._setup_acquire_run(soc, soft_avgs, load_pulses, start_src, threshold, angle, remove_offset, save_raw, calc_var, hist_bins, hist_range)
 
         total_count = functools.reduce(operator.mul, self.loop_dims)
-        self.d_buf = [np.zeros((*self.loop_dims, nreads, 2), dtype=np.int32) for nreads in self.reads_per_shot]
-        self.stats = []
 
         # select which tqdm progress bar to show
         hiderounds = True
@@ -1613,53 +1687,620 @@ class AcquireMixin:
             else:
                 hidereps = False
 
-        # avg_d doesn't have a specific shape here, so that it's easier for child programs to write custom _average_buf
-        avg_d = None
-        for ir in tqdm(range(soft_avgs), disable=hiderounds):
-            # Configure and enable buffer capture.
-            self.config_bufs(soc, enable_avg=True, enable_buf=False)
+        finished = False
+        try:
+            for ir in tqdm(range(soft_avgs), disable=hiderounds):
+                self._start_acquire_round(soc, ir)
+                count = 0
+                with tqdm(total=total_count, disable=hidereps) as pbar:
+                    while count<total_count:
+                        newcount = self._poll_acquire_data(soc, count)
+                        pbar.update(newcount-count)
+                        count = newcount
+                self._finish_acquire_round()
+            finished = True
+        finally:
+            if not finished:
+                self._abort_acquire_run(soc)
+
+        return self.get_acquire_result()
+
+    async def acquire_iter_async(self, soc, soft_avgs=1, load_pulses=True, start_src="internal", threshold=None, angle=None, remove_offset=True, save_raw=True, calc_var=False, hist_bins=None, hist_range=None, poll_timeout=0.1):
+        """Asynchronous version of acquire(), as an async iterator that yields progress as the data arrives.
+        Each step of the acquisition - configuring the board, starting each round, polling for data and processing each chunk,
+        and finishing each round - runs as a call in the event loop's default executor, since these calls to the QickSoc may block,
+        and the processing may take a while.
+        Other coroutines (including acquisitions on other boards) can run while this one waits for data.
+        Don't run more than one acquisition on the same QickSoc at a time.
+
+        If the iterator is closed or cancelled before it's exhausted, the readout is stopped and any pending round averaging is waited for.
+
+        Partial results are available from get_raw(), get_running_avg() etc. each time the iterator yields.
+        Once the iterator is exhausted, get_acquire_result() returns the same result as acquire().
 
-            count = 0
-            with tqdm(total=total_count, disable=hidereps) as pbar:
-                soc.start_readout(total_count, counter_addr=self.counter_addr,
-                                       ch_list=list(self.ro_chs), reads_per_shot=self.reads_per_shot)
+        Parameters
+        ----------
+        soc : QickSoc
+            Qick object
+        poll_timeout : float
+            How long each poll of the data queue waits for new data (seconds).
+            This limits how long the executor thread stays blocked after the iterator is abandoned.
+
+        All other parameters are the same as acquire().
+
+        Yields
+        ------
+        int
+            Index of the current round.
+        int
+            Number of shots acquired so far in the current round.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(self._setup_acquire_run, soc, soft_avgs, load_pulses, start_src,
+                                                           threshold, angle, remove_offset, save_raw, calc_var, hist_bins, hist_range))
+
+        total_count = functools.reduce(operator.mul, self.loop_dims)
+        finished = False
+        try:
+            for ir in range(soft_avgs):
+                await loop.run_in_executor(None, self._start_acquire_round, soc, ir)
+                count = 0
                 while count<total_count:
-                    new_data = obtain(soc.poll_data())
-                    for new_points, (d, s) in new_data:
-                        for ii, nreads in enumerate(self.reads_per_shot):
-                            #print(count, new_points, nreads, d[ii].shape, total_count)
-                            if new_points*nreads != d[ii].shape[0]:
-                                logger.error("data size mismatch: new_points=%d, nreads=%d, data shape %s"%(new_points, nreads, d[ii].shape))
-                            if count+new_points > total_count:
-                                logger.error("got too much data: count=%d, new_points=%d, total_count=%d"%(count, new_points, total_count))
-                            # use reshape to view the d_buf array in a shape that matches the raw data
-                            self.d_buf[ii].reshape((-1,2))[count*nreads:(count+new_points)*nreads] = d[ii]
-                        count += new_points
-                        self.stats.append(s)
-                        pbar.update(new_points)
-
-            # if we're thresholding, apply the threshold before averaging
-            if threshold is None:
-                d_reps = self.d_buf
-                round_d = self._average_buf(d_reps, self.reads_per_shot, length_norm=True, remove_offset=remove_offset)
-            else:
-                d_reps = [np.zeros_like(d) for d in self.d_buf]
-                self.shots = self._apply_threshold(self.d_buf, threshold, angle, remove_offset=remove_offset)
-                for i, ch_shot in enumerate(self.shots):
-                    d_reps[i][...,0] = ch_shot
-                round_d = self._average_buf(d_reps, self.reads_per_shot, length_norm=False)
-
-            # sum over rounds axis
-            if avg_d is None:
-                avg_d = round_d
-            else:
-                for ii, d in enumerate(round_d): avg_d[ii] += d
+                    newcount = await loop.run_in_executor(None, self._poll_acquire_data, soc, count, poll_timeout)
+                    if newcount != count:
+                        count = newcount
+                        yield ir, count
+                await loop.run_in_executor(None, self._finish_acquire_round)
+            finished = True
+        finally:
+            if not finished:
+                await loop.run_in_executor(None, self._abort_acquire_run, soc)
+
+    async def acquire_async(self, soc, soft_avgs=1, load_pulses=True, start_src="internal", threshold=None, angle=None, remove_offset=True, save_raw=True, calc_var=False, hist_bins=None, hist_range=None, poll_timeout=0.1):
+        """Asynchronous version of acquire().
+        See acquire_iter_async() for details; the parameters are the same.
+
+        Returns
+        -------
+        list of ndarray
+            averaged IQ values, as returned by acquire()
+        """
+        async for _ in self.acquire_iter_async(soc, soft_avgs=soft_avgs, load_pulses=load_pulses, start_src=start_src,
+                                               threshold=threshold, angle=angle, remove_offset=remove_offset, save_raw=save_raw,
+                                               calc_var=calc_var, hist_bins=hist_bins, hist_range=hist_range, poll_timeout=poll_timeout):
+            pass
+        return self.get_acquire_result()
+
+    def _setup_acquire_run(self, soc, soft_avgs, load_pulses, start_src, threshold, angle, remove_offset, save_raw, calc_var, hist_bins, hist_range):
+        """Configure the board and allocate the data buffers for acquire().
+        The acquisition parameters are saved for use by the other acquisition steps.
+        """
+        # clean up after an acquisition that was interrupted:
+        # its worker may still be averaging a round, using the buffers and parameters we're about to replace
+        self._shutdown_round_pool(check=False)
+
+        self.config_all(soc, load_pulses=load_pulses)
+
+        if any([x is None for x in [self.counter_addr, self.loop_dims, self.avg_level]]):
+            raise RuntimeError("data dimensions need to be defined with setup_acquire() before calling acquire()")
+
+        # configure tproc for internal/external start
+        soc.start_src(start_src)
+
+        if save_raw:
+            # with multiple rounds, alternate between two buffers,
+            # so one round can be averaged while the next one is acquired
+            nbufs = min(soft_avgs, 2)
+            self._d_bufs = [[np.zeros((*self.loop_dims, nreads, 2), dtype=np.int32) for nreads in self.reads_per_shot] for i in range(nbufs)]
+            self.d_buf = self._d_bufs[0]
+        else:
+            self._d_bufs = None
+            self.d_buf = None
+        use_running = not save_raw
+        if use_running:
+            # the running sums accumulate over all rounds
+            self._init_running_avg(calc_var)
+        thresholds, angles = None, None
+        if threshold is not None or hist_bins is not None:
+            thresholds, angles = self._get_threshold_params(threshold, angle)
+        if hist_bins is not None:
+            if hist_range is None:
+                raise RuntimeError("hist_range must be defined if hist_bins is defined")
+            self._init_shot_hist(hist_bins, hist_range)
+        self.stats = []
+
+        self._acq_params = {'soft_avgs': soft_avgs,
+                            'threshold': threshold,
+                            'thresholds': thresholds,
+                            'angles': angles,
+                            'remove_offset': remove_offset,
+                            'save_raw': save_raw,
+                            'use_running': use_running,
+                            # count the shots over threshold, unless a custom _average_buf() needs them as raw data
+                            'count_shots': save_raw and threshold is not None and type(self)._average_buf is AcquireMixin._average_buf,
+                            'hist': hist_bins is not None}
+        # avg_d doesn't have a specific shape here, so that it's easier for child programs to write custom _average_buf
+        self._avg_d = None
+        if save_raw and soft_avgs > 1:
+            # rounds are averaged in order by a single worker thread
+            self._round_pool = ThreadPoolExecutor(max_workers=1)
+            self._round_jobs = [None]*len(self._d_bufs)
+
+    def _start_acquire_round(self, soc, ir):
+        """Configure the buffers and start the readout for one round of acquire().
+
+        Parameters
+        ----------
+        soc : QickSoc
+            Qick object
+        ir : int
+            Index of the round.
+        """
+        if self._d_bufs is not None:
+            ibuf = ir % len(self._d_bufs)
+            if self._round_pool is not None and self._round_jobs[ibuf] is not None:
+                # wait until this buffer has been averaged before overwriting it
+                self._round_jobs[ibuf].result()
+                self._round_jobs[ibuf] = None
+            self._ibuf = ibuf
+            self.d_buf = self._d_bufs[ibuf]
+
+        # Configure and enable buffer capture.
+        self.config_bufs(soc, enable_avg=True, enable_buf=False)
+
+        total_count = functools.reduce(operator.mul, self.loop_dims)
+        if self._acq_params['threshold'] is not None:
+            # shot decisions for this round, packed 8 to a byte
+            self._shot_bits = [np.zeros((total_count*nreads+7)//8, dtype=np.uint8) for nreads in self.reads_per_shot]
+        if self._acq_params['count_shots']:
+            # new arrays every round, since the worker may still be averaging the previous round's
+            n_pts = total_count//self.loop_dims[self.avg_level]
+            self._shot_counts = [np.zeros((n_pts, nreads), dtype=np.int64) for nreads in self.reads_per_shot]
+
+        # each chunk of data is copied into d_buf before the next poll_data(), so we can use zero-copy mode
+        soc.start_readout(total_count, counter_addr=self.counter_addr,
+                               ch_list=list(self.ro_chs), reads_per_shot=self.reads_per_shot, zero_copy=True)
+
+    def _poll_acquire_data(self, soc, count, timeout=None):
+        """Poll the readout for new data and process it.
+
+        Parameters
+        ----------
+        soc : QickSoc
+            Qick object
+        count : int
+            Number of shots already acquired in this round.
+        timeout : float
+            Passed to QickSoc.poll_data().
+
+        Returns
+        -------
+        int
+            Updated number of shots acquired in this round.
+        """
+        p = self._acq_params
+        total_count = functools.reduce(operator.mul, self.loop_dims)
+        new_data = obtain(soc.poll_data(timeout=timeout))
+        for new_points, (d, s) in new_data:
+            for ii, nreads in enumerate(self.reads_per_shot):
+                #print(count, new_points, nreads, d[ii].shape, total_count)
+                if new_points*nreads != d[ii].shape[0]:
+                    logger.error("data size mismatch: new_points=%d, nreads=%d, data shape %s"%(new_points, nreads, d[ii].shape))
+                if count+new_points > total_count:
+                    logger.error("got too much data: count=%d, new_points=%d, total_count=%d"%(count, new_points, total_count))
+                if p['save_raw']:
+                    # use reshape to view the d_buf array in a shape that matches the raw data
+                    self.d_buf[ii].reshape((-1,2))[count*nreads:(count+new_points)*nreads] = d[ii]
+            if p['angles'] is not None:
+                rotated = [self._rotate_chunk(ii, d[ii], p['angles'][ii], p['remove_offset']) for ii in range(len(d))]
+            if p['hist']:
+                self._update_shot_hist(count, new_points, rotated)
+            if p['threshold'] is not None:
+                d_shots = []
+                for ii, nreads in enumerate(self.reads_per_shot):
+                    bits = rotated[ii] > p['thresholds'][ii]
+                    self._write_bits(self._shot_bits[ii], count*nreads, bits)
+                    if p['count_shots']:
+                        self._count_shots(ii, count, new_points, bits)
+                    elif not p['save_raw']:
+                        # fraction over threshold goes in I, Q is 0
+                        d_shots.append(np.stack([bits, np.zeros_like(bits)], axis=-1))
+                if not p['save_raw']:
+                    self._update_running_avg(count, new_points, d_shots)
+            elif not p['save_raw']:
+                self._update_running_avg(count, new_points, d)
+            count += new_points
+            self.stats.append(s)
+        return count
+
+    def _finish_acquire_round(self):
+        """Add the raw data from a completed round of acquire() to the average over rounds.
+        With multiple rounds, this is done by a worker thread, so the next round can start right away.
+        """
+        p = self._acq_params
+        if p['use_running']:
+            # the running sums are averaged once all rounds are done
+            return
+
+        if p['count_shots']:
+            args = (None, None, self._shot_counts)
+        elif p['threshold'] is not None:
+            args = (self.d_buf, self._unpack_shots())
+        else:
+            args = (self.d_buf,)
+        if self._round_pool is None:
+            self._average_round(*args)
+        else:
+            self._round_jobs[self._ibuf] = self._round_pool.submit(self._average_round, *args)
+
+    def _average_round(self, d_buf, shots=None, shot_counts=None):
+        """Average the data from one round of acquire(), and add it to the sum over rounds.
+        With pipelined rounds this runs on the worker thread, which is the only writer of self._avg_d;
+        anything that reads self._avg_d must first wait for the worker with _shutdown_round_pool().
+
+        Parameters
+        ----------
+        d_buf : list of ndarray
+            Raw IQ data from the round.
+        shots : list of ndarray
+            Threshold decisions from the round, if thresholding with a custom _average_buf(); these are averaged instead of the raw data.
+        shot_counts : list of ndarray
+            Number of shots over threshold at each point of the averaged result, if thresholding otherwise; these are averaged instead of the raw data.
+        """
+        if shot_counts is not None:
+            round_d = self._average_shot_counts(shot_counts)
+        elif shots is None:
+            round_d = self._average_buf(d_buf, self.reads_per_shot, length_norm=True, remove_offset=self._acq_params['remove_offset'])
+        else:
+            # fraction over threshold goes in I, Q is 0
+            d_reps = [np.zeros_like(d) for d in d_buf]
+            for i, ch_shot in enumerate(shots):
+                d_reps[i][...,0] = ch_shot
+            round_d = self._average_buf(d_reps, self.reads_per_shot, length_norm=False)
+
+        # sum over rounds axis
+        if self._avg_d is None:
+            self._avg_d = round_d
+        else:
+            for ii, d in enumerate(round_d): self._avg_d[ii] += d
+
+    def _count_shots(self, i_ch, count, new_points, bits):
+        """Add a chunk of shot decisions to the counts of shots over threshold for the round.
+
+        Parameters
+        ----------
+        i_ch : int
+            Index of the readout channel in this program.
+        count : int
+            Index of the first shot in this chunk.
+        new_points : int
+            Number of shots in this chunk.
+        bits : ndarray of bool
+            Shot decisions, with shape (new_points*nreads,).
+        """
+        counts = self._shot_counts[i_ch]
+        nreads = counts.shape[1]
+        # flat index into the counts for each decision
+        idx = self._avg_index(count, new_points)[:, np.newaxis]*nreads + np.arange(nreads)
+        counts += np.bincount(idx[bits.reshape((new_points, nreads))], minlength=counts.size).reshape(counts.shape)
+
+    def _average_shot_counts(self, shot_counts):
+        """Convert the counts of shots over threshold from a round to the output format of _average_buf().
+
+        Parameters
+        ----------
+        shot_counts : list of ndarray
+            Number of shots over threshold at each point of the averaged result, for each readout channel.
+
+        Returns
+        -------
+        list of ndarray
+            fraction of shots over threshold in I, and 0 in Q
+        """
+        round_d = []
+        for counts, nreads in zip(shot_counts, self.reads_per_shot):
+            shape = self._running_shape(nreads)
+            avg = np.zeros(shape)
+            avg[..., 0] = counts.reshape(shape[:-1])/self.loop_dims[self.avg_level]
+            # the reads_per_shot axis should be the first one
+            round_d.append(np.moveaxis(avg, -2, 0))
+        return round_d
+
+    def get_acquire_result(self):
+        """Get the averaged result of the most recent acquire(), after all rounds have completed.
+
+        Returns
+        -------
+        list of ndarray
+            averaged IQ values, as returned by acquire()
+        """
+        # wait for the rounds that are still being averaged
+        self._shutdown_round_pool()
+
+        p = self._acq_params
+        if not p['save_raw']:
+            if p['threshold'] is not None:
+                return self.get_running_avg(length_norm=False)
+            return self.get_running_avg(length_norm=True, remove_offset=p['remove_offset'])
 
         # divide total by rounds
-        for d in avg_d: d /= soft_avgs
+        return [d/p['soft_avgs'] for d in self._avg_d]
+
+    def _abort_acquire_run(self, soc):
+        """Clean up after an acquisition that was abandoned before all its data was read:
+        stop the readout, and wait for any pending round averaging.
+        """
+        soc.stop_readout()
+        self._shutdown_round_pool(check=False)
+
+    def _shutdown_round_pool(self, check=True):
+        """Wait for any pending round averaging to finish, and stop the worker thread.
+
+        Parameters
+        ----------
+        check : bool
+            Raise any exception from the worker.
+        """
+        if self._round_pool is not None:
+            self._round_pool.shutdown(wait=True)
+            jobs = [job for job in self._round_jobs if job is not None]
+            self._round_pool = None
+            self._round_jobs = None
+            if check:
+                for job in jobs: job.result()
+
+    def _get_threshold_params(self, threshold, angle):
+        """Convert the threshold and angle arguments of acquire() to lists with one value per readout channel.
+
+        Returns
+        -------
+        list of float
+            thresholds (None if threshold is None)
+        list of float
+            angles
+        """
+        # try to convert threshold to list of floats; if that fails, assume it's already a list
+        try:
+            thresholds = [float(threshold)]*len(self.ro_chs)
+        except TypeError:
+            thresholds = threshold
+        # angle is 0 if not specified
+        if angle is None: angle = 0.0
+        try:
+            angles = [float(angle)]*len(self.ro_chs)
+        except TypeError:
+            angles = angle
+        return thresholds, angles
+
+    def _rotate_chunk(self, i_ch, d, angle, remove_offset):
+        """Normalize and rotate a chunk of raw IQ data, as needed for thresholding.
+
+        Parameters
+        ----------
+        i_ch : int
+            Index of the readout channel in this program.
+        d : ndarray
+            Raw IQ data, with shape (n, 2).
+        angle : float
+            Rotation angle (radians).
+        remove_offset : bool
+            Subtract the readout's IQ offset, if any.
+
+        Returns
+        -------
+        ndarray
+            Rotated I values, with shape (n,).
+        """
+        ro_ch, ro = list(self.ro_chs.items())[i_ch]
+        c, s = np.cos(angle), np.sin(angle)
+        rotated = (d[:, 0]*c + d[:, 1]*s)/ro['length']
+        if remove_offset:
+            rotated -= self.soccfg['readouts'][ro_ch]['iq_offset']*(c + s)
+        return rotated
+
+    def _write_bits(self, packed, offset, bits):
+        """Write a block of bits into a packed bit array.
+        The bits past the end of the block in its last byte are cleared, so blocks must be written in order.
+
+        Parameters
+        ----------
+        packed : ndarray of uint8
+            Bit array, in the format used by np.packbits().
+        offset : int
+            Index of the first bit to write.
+        bits : ndarray of bool
+            Bits to write.
+        """
+        start, lead = divmod(offset, 8)
+        if lead:
+            # merge with the bits already written in the first byte
+            bits = np.concatenate([np.unpackbits(packed[start:start+1])[:lead].astype(bool), bits])
+        newbytes = np.packbits(bits)
+        packed[start:start+len(newbytes)] = newbytes
+
+    def _init_shot_hist(self, bins, hist_range):
+        """Allocate the shot histograms used by acquire().
+
+        Parameters
+        ----------
+        bins : int
+            Number of histogram bins.
+        hist_range : (float, float)
+            Lower and upper edges of the histogram (values outside the range are not counted).
+        """
+        avg_dims = self.loop_dims[:self.avg_level] + self.loop_dims[self.avg_level+1:]
+        n_pts = functools.reduce(operator.mul, avg_dims, 1)
+        self.hist_edges = np.linspace(hist_range[0], hist_range[1], bins+1)
+        self.shot_hist = [np.zeros((n_pts, nreads, bins), dtype=np.int64) for nreads in self.reads_per_shot]
+
+    def _update_shot_hist(self, count, new_points, rotated):
+        """Add a chunk of rotated shot values to the shot histograms.
+
+        Parameters
+        ----------
+        count : int
+            Index of the first shot in this chunk.
+        new_points : int
+            Number of shots in this chunk.
+        rotated : list of ndarray
+            Rotated I values for each readout channel, with shape (new_points*nreads,).
+        """
+        lo, hi = self.hist_edges[0], self.hist_edges[-1]
+        idx = self._avg_index(count, new_points)
+        for ii, nreads in enumerate(self.reads_per_shot):
+            hist = self.shot_hist[ii]
+            n_pts, _, bins = hist.shape
+            vals = rotated[ii]
+            # points and reads for every value, then drop the values that are out of range
+            flat = (idx[:, np.newaxis]*nreads + np.arange(nreads)).ravel()
+            ibin = np.floor((vals - lo)*(bins/(hi - lo))).astype(np.int64)
+            # the upper edge is inclusive, like np.histogram
+            ibin[vals == hi] = bins - 1
+            inrange = (ibin >= 0) & (ibin < bins)
+            hist.reshape(-1)[:] += np.bincount(flat[inrange]*bins + ibin[inrange], minlength=hist.size)
+
+    def get_shot_hist(self):
+        """Get the histograms of rotated I values accumulated by acquire() with hist_bins defined.
 
+        Returns
+        -------
+        list of ndarray
+            Shot counts for each readout channel, with dimensions (n_reads, *averaged loop dimensions, n_bins).
+        ndarray
+            Bin edges.
+        """
+        hists = []
+        for ii, nreads in enumerate(self.reads_per_shot):
+            hist = self.shot_hist[ii].reshape(self._running_shape(nreads)[:-1] + (-1,))
+            hists.append(np.moveaxis(hist, -2, 0))
+        return hists, self.hist_edges
+
+    def _init_running_avg(self, calc_var):
+        """Allocate the running sums used by acquire() when save_raw=False.
+        Each sum has one row per point of the averaged result (the loop dimensions, excluding the averaged loop).
+
+        Parameters
+        ----------
+        calc_var : bool
+            Also allocate sums of squares.
+        """
+        avg_dims = self.loop_dims[:self.avg_level] + self.loop_dims[self.avg_level+1:]
+        n_pts = functools.reduce(operator.mul, avg_dims, 1)
+        self.run_sum = [np.zeros((n_pts, nreads, 2)) for nreads in self.reads_per_shot]
+        if calc_var:
+            self.run_sumsq = [np.zeros((n_pts, nreads, 2)) for nreads in self.reads_per_shot]
+        else:
+            self.run_sumsq = None
+        self.run_count = np.zeros(n_pts, dtype=np.int64)
+
+    def _update_running_avg(self, count, new_points, d):
+        """Fold a chunk of streamed data into the running sums.
+
+        Parameters
+        ----------
+        count : int
+            Index of the first shot in this chunk.
+        new_points : int
+            Number of shots in this chunk.
+        d : list of ndarray
+            Raw IQ data for each readout channel, with shape (new_points*nreads, 2).
+        """
+        n_pts = len(self.run_count)
+        idx = self._avg_index(count, new_points)
+        self.run_count += np.bincount(idx, minlength=n_pts)
+        for ii, nreads in enumerate(self.reads_per_shot):
+            cols = d[ii].reshape((new_points, nreads*2))
+            run_sum = self.run_sum[ii].reshape((n_pts, nreads*2))
+            for j in range(nreads*2):
+                run_sum[:, j] += np.bincount(idx, weights=cols[:, j], minlength=n_pts)
+            if self.run_sumsq is not None:
+                run_sumsq = self.run_sumsq[ii].reshape((n_pts, nreads*2))
+                for j in range(nreads*2):
+                    run_sumsq[:, j] += np.bincount(idx, weights=np.square(cols[:, j], dtype=np.float64), minlength=n_pts)
+
+    def _avg_index(self, count, new_points):
+        """Map a block of shots to their points in the averaged result, by dropping the index of the averaged loop.
+
+        Parameters
+        ----------
+        count : int
+            Index of the first shot.
+        new_points : int
+            Number of shots.
+
+        Returns
+        -------
+        ndarray of int
+            Flat index into the averaged result for each shot.
+        """
+        n_avg = self.loop_dims[self.avg_level]
+        n_inner = functools.reduce(operator.mul, self.loop_dims[self.avg_level+1:], 1)
+        shots = np.arange(count, count+new_points)
+        return (shots // (n_avg*n_inner))*n_inner + shots % n_inner
+
+    def _running_shape(self, nreads):
+        # shape of a running sum for one channel, as it would come out of averaging d_buf over the averaged loop
+        avg_dims = self.loop_dims[:self.avg_level] + self.loop_dims[self.avg_level+1:]
+        return (*avg_dims, nreads, 2)
+
+    def get_running_avg(self, length_norm=True, remove_offset=True):
+        """Get the averages accumulated so far by acquire() with save_raw=False.
+        This can be called while the acquisition is running, to get partial results.
+        Points that have not been measured yet are NaN.
+
+        Parameters
+        ----------
+        length_norm : bool
+            Normalize by readout window length.
+        remove_offset : bool
+            If normalizing by length, also subtract the readout's IQ offset if any.
+
+        Returns
+        -------
+        list of ndarray
+            averaged IQ values (float), with the same shapes as the output of acquire()
+        """
+        avg_d = []
+        for i_ch, (ch, ro) in enumerate(self.ro_chs.items()):
+            with np.errstate(invalid='ignore'):
+                avg = self.run_sum[i_ch] / self.run_count[:, np.newaxis, np.newaxis]
+            avg = avg.reshape(self._running_shape(self.reads_per_shot[i_ch]))
+            if length_norm:
+                avg /= ro['length']
+                if remove_offset:
+                    avg -= self._ro_offset(ch, ro['ro_config'])
+            # the reads_per_shot axis should be the first one
+            avg_d.append(np.moveaxis(avg, -2, 0))
         return avg_d
 
+    def get_running_var(self, length_norm=True):
+        """Get the shot-to-shot variance of the I and Q values accumulated so far by acquire() with save_raw=False and calc_var=True.
+        Points that have not been measured yet are NaN.
+
+        Parameters
+        ----------
+        length_norm : bool
+            Normalize by readout window length (the variance is divided by the square of the length).
+
+        Returns
+        -------
+        list of ndarray
+            IQ variances (float), with the same shapes as the output of acquire()
+        """
+        if self.run_sumsq is None:
+            raise RuntimeError("variance was not accumulated, use acquire() with save_raw=False and calc_var=True")
+        var_d = []
+        for i_ch, (ch, ro) in enumerate(self.ro_chs.items()):
+            n = self.run_count[:, np.newaxis, np.newaxis]
+            with np.errstate(invalid='ignore'):
+                mean = self.run_sum[i_ch] / n
+                var = self.run_sumsq[i_ch] / n - mean**2
+            var = var.reshape(self._running_shape(self.reads_per_shot[i_ch]))
+            if length_norm:
+                var /= ro['length']**2
+            var_d.append(np.moveaxis(var, -2, 0))
+        return var_d
+
     def _ro_offset(self, ch, chcfg):
         """Computes the IQ offset expected from this readout.
 
@@ -1740,26 +2381,12 @@ class AcquireMixin:
             Single shot data
 
         """
-        # try to convert threshold to list of floats; if that fails, assume it's already a list
-        try:
-            thresholds = [float(threshold)]*len(self.ro_chs)
-        except TypeError:
-            thresholds = threshold
-        # angle is 0 if not specified
-        if angle is None: angle = 0.0
-        try:
-            angles = [float(angle)]*len(self.ro_chs)
-        except TypeError:
-            angles = angle
+        thresholds, angles = self._get_threshold_params(threshold, angle)
 
         shots = []
-        for i_ch, (ro_ch, ro) in enumerate(self.ro_chs.items()):
-            avg = d_buf[i_ch]/ro['length']
-            if remove_offset:
-                offset = self.soccfg['readouts'][ro_ch]['iq_offset']
-                avg -= offset
-            rotated = np.inner(avg, [np.cos(angles[i_ch]), np.sin(angles[i_ch])])
-            shots.append(np.heaviside(rotated - thresholds[i_ch], 0))
+        for i_ch in range(len(self.ro_chs)):
+            rotated = self._rotate_chunk(i_ch, d_buf[i_ch].reshape((-1,2)), angles[i_ch], remove_offset)
+            shots.append((rotated > thresholds[i_ch]).reshape(d_buf[i_ch].shape[:-1]).astype(float))
         return shots
 
     def get_time_axis(self, ro_index):
@@ -1830,13 +2457,7 @@ class AcquireMixin:
         progress: bool
             if true, displays progress bar
         """
-        self.config_all(soc, load_pulses=load_pulses)
-
-        if any([x is None for x in [self.counter_addr, self.loop_dims]]):
-            raise RuntimeError("data dimensions need to be defined with setup_acquire() before calling run_rounds()")
-
-        # configure tproc for internal/external start
-        soc.start_src(start_src)
+        self._setup_run_rounds(soc, load_pulses, start_src)
 
         total_count = functools.reduce(operator.mul, self.loop_dims)
 
@@ -1851,12 +2472,7 @@ class AcquireMixin:
 
         # run each round
         for ii in tqdm(range(rounds), disable=hiderounds):
-            # make sure count variable is reset to 0
-            soc.set_tproc_counter(addr=self.counter_addr, val=0)
-
-            # run the assembly program
-            # if start_src="external", you must pulse the trigger input once for every round
-            soc.start_tproc()
+            self._start_counted_round(soc)
 
             count = 0
             with tqdm(total=total_count, disable=hidereps) as pbar:
@@ -1865,6 +2481,58 @@ class AcquireMixin:
                     pbar.update(newcount-count)
                     count = newcount
 
+    async def run_rounds_async(self, soc, rounds=1, load_pulses=True, start_src="internal", poll_interval=0.01):
+        """Asynchronous version of run_rounds().
+        Calls to the QickSoc run in the event loop's default executor, and the event loop is free between polls of the rep counter.
+
+        Parameters
+        ----------
+        soc : QickSoc
+            Qick object
+        rounds : int
+            number of times to rerun the program
+        load_pulses : bool
+            if True, load pulse envelopes
+        start_src: str
+            "internal" (tProc starts immediately) or "external" (each round waits for an external trigger)
+        poll_interval : float
+            Time between polls of the rep counter (seconds).
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._setup_run_rounds, soc, load_pulses, start_src)
+        for ii in range(rounds):
+            await loop.run_in_executor(None, self._start_counted_round, soc)
+            await self._wait_counter_async(soc, poll_interval)
+
+    def _setup_run_rounds(self, soc, load_pulses, start_src):
+        """Configure the board for run_rounds().
+        """
+        self.config_all(soc, load_pulses=load_pulses)
+
+        if any([x is None for x in [self.counter_addr, self.loop_dims]]):
+            raise RuntimeError("data dimensions need to be defined with setup_acquire() before calling run_rounds()")
+
+        # configure tproc for internal/external start
+        soc.start_src(start_src)
+
+    def _start_counted_round(self, soc):
+        """Reset the rep counter and start the program.
+        """
+        # make sure count variable is reset to 0
+        soc.set_tproc_counter(addr=self.counter_addr, val=0)
+
+        # run the assembly program
+        # if start_src="external", you must pulse the trigger input once for every round
+        soc.start_tproc()
+
+    async def _wait_counter_async(self, soc, poll_interval):
+        """Wait for the rep counter to reach the total number of shots, without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        total_count = functools.reduce(operator.mul, self.loop_dims)
+        while await loop.run_in_executor(None, functools.partial(soc.get_tproc_counter, addr=self.counter_addr)) < total_count:
+            await asyncio.sleep(poll_interval)
+
     def acquire_decimated(self, soc, soft_avgs, load_pulses=True, start_src="internal", progress=True, remove_offset=True):
         """Acquire data using the decimating readout.
 
@@ -1891,6 +2559,138 @@ class AcquireMixin:
             multi-rep or multi-read: (n_reps*n_reads, length, 2)
             multi-rep and multi-read: (n_reps, n_reads, length, 2)
         """
+        self._setup_decimated(soc, soft_avgs, load_pulses, start_src)
+
+        total_count = functools.reduce(operator.mul, self.loop_dims)
+
+        # round whose decimated data has not been transferred yet
+        pending = None
+        # for each soft average, run and acquire decimated data
+        for ir in tqdm(range(soft_avgs), disable=not progress):
+            self._start_decimated_round(soc, ir)
+
+            # transfer the previous round's data while this round runs
+            if pending is not None:
+                self._add_decimated_round(soc, pending)
+                pending = None
+
+            count = 0
+            while count < total_count:
+                count = soc.get_tproc_counter(addr=self.counter_addr)
+
+            self._read_accumulated_round(soc)
+            if self._dec_overlap:
+                pending = ir
+            else:
+                self._add_decimated_round(soc, ir)
+        if pending is not None:
+            self._add_decimated_round(soc, pending)
+
+        return self._average_decimated(soc, soft_avgs, remove_offset)
+
+    async def acquire_decimated_async(self, soc, soft_avgs, load_pulses=True, start_src="internal", remove_offset=True, poll_interval=0.01):
+        """Asynchronous version of acquire_decimated().
+        Calls to the QickSoc run in the event loop's default executor, and the event loop is free between polls of the rep counter.
+
+        Parameters
+        ----------
+        poll_interval : float
+            Time between polls of the rep counter (seconds).
+
+        All other parameters and the return value are the same as acquire_decimated().
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._setup_decimated, soc, soft_avgs, load_pulses, start_src)
+        pending = None
+        for ir in range(soft_avgs):
+            await loop.run_in_executor(None, self._start_decimated_round, soc, ir)
+            if pending is not None:
+                await loop.run_in_executor(None, self._add_decimated_round, soc, pending)
+                pending = None
+            await self._wait_counter_async(soc, poll_interval)
+            await loop.run_in_executor(None, self._read_accumulated_round, soc)
+            if self._dec_overlap:
+                pending = ir
+            else:
+                await loop.run_in_executor(None, self._add_decimated_round, soc, ir)
+        if pending is not None:
+            await loop.run_in_executor(None, self._add_decimated_round, soc, pending)
+        return await loop.run_in_executor(None, self._average_decimated, soc, soft_avgs, remove_offset)
+
+    def acquire_ddr4_averaged(self, soc, ro_ch, nt, soft_avgs=1, samples=None, load_pulses=True, start_src="internal", progress=True, remove_offset=True, calc_var=False):
+        """Acquire decimated waveforms with a segmented DDR4 capture (one segment per shot), averaged over shots and rounds.
+        The averaging is done on the QickSoc, block by block, so the full capture never needs to be copied out of the DDR4 buffer.
+
+        Your program must trigger the DDR4 buffer once at the start, and run its shots with a period of exactly nt DDR4 transfers
+        (see QickSoc.arm_ddr4_segments()).
+
+        Parameters
+        ----------
+        soc : QickSoc
+            Qick object
+        ro_ch : int
+            readout channel to record (index in 'readouts' list); this must be a readout declared in this program
+        nt : int
+            number of DDR4 transfers per shot
+        soft_avgs : int
+            number of times to rerun the program, averaging results in software (aka "rounds")
+        samples : int
+            number of samples to keep at the start of each shot (None = the whole shot)
+        load_pulses : bool
+            if True, load pulse envelopes
+        start_src: str
+            "internal" (tProc starts immediately) or "external" (each round waits for an external trigger)
+        progress: bool
+            if true, displays progress bar
+        remove_offset: bool
+            Subtract the readout's IQ offset, if any.
+        calc_var: bool
+            Also compute the shot-to-shot variance.
+
+        Returns
+        -------
+        ndarray
+            decimated values, averaged over shots and rounds (float), with shape (samples, 2)
+        ndarray
+            variance over shots and rounds (only if calc_var is True)
+        """
+        self._setup_run_rounds(soc, load_pulses, start_src)
+        if ro_ch not in self.ro_chs:
+            raise RuntimeError("readout %d is not declared in this program" % (ro_ch))
+
+        n_segments = functools.reduce(operator.mul, self.loop_dims)
+        d_sum = 0
+        d_sumsq = 0
+        for ir in tqdm(range(soft_avgs), disable=not progress):
+            soc.arm_ddr4_segments(ro_ch, nt, n_segments)
+            self._start_counted_round(soc)
+
+            count = 0
+            while count < n_segments:
+                count = soc.get_tproc_counter(addr=self.counter_addr)
+
+            round_sum, round_sumsq = obtain(soc.sum_ddr4_segments(nt, n_segments, samples, calc_var))
+            d_sum += round_sum
+            if calc_var:
+                d_sumsq += round_sumsq
+
+        n_shots = n_segments*soft_avgs
+        mean = d_sum/n_shots
+        if calc_var:
+            var = d_sumsq/n_shots - mean**2
+        if remove_offset:
+            mean -= self._ro_offset(ro_ch, self.ro_chs[ro_ch]['ro_config'])
+        if calc_var:
+            return mean, var
+        return mean
+
+    def _setup_decimated(self, soc, soft_avgs, load_pulses, start_src):
+        """Configure the board and allocate the accumulators for acquire_decimated().
+
+        The decimated data is summed over rounds on the QickSoc, in integer accumulators, straight from the DMA buffer.
+        If two rounds of data fit in the decimated buffer, alternate rounds are captured in alternate halves of the buffer,
+        so each round's data can be transferred while the next round runs.
+        """
         self.config_all(soc, load_pulses=load_pulses)
 
         if any([x is None for x in [self.counter_addr, self.loop_dims, self.avg_level]]):
@@ -1901,45 +2701,61 @@ class AcquireMixin:
 
         total_count = functools.reduce(operator.mul, self.loop_dims)
 
+        # int16 samples: an int32 sum can't overflow for up to 2^16 rounds
+        dtype = np.int32 if soft_avgs <= 2**16 else np.int64
+
         # Initialize data buffers
-        # buffer for decimated data
-        dec_buf = []
+        # capture address in the decimated buffer for even and odd rounds
+        self._dec_addrs = [{}, {}]
+        self._dec_overlap = True
         for ch, ro in self.ro_chs.items():
             maxlen = self.soccfg['readouts'][ch]['buf_maxlen']
-            if ro['length']*ro['trigs']*total_count > maxlen:
+            length = ro['length']*ro['trigs']*total_count
+            if length > maxlen:
                 raise RuntimeError("Warning: requested readout length (%d x %d trigs x %d reps) exceeds buffer size (%d)"%(ro['length'], ro['trigs'], total_count, maxlen))
-            dec_buf.append(np.zeros((ro['length']*total_count*ro['trigs'], 2), dtype=float))
-
-        # for each soft average, run and acquire decimated data
-        for ii in tqdm(range(soft_avgs), disable=not progress):
-            # buffer for accumulated data (for convenience/debug)
-            self.d_buf = []
-
-            # Configure and enable buffer capture.
-            self.config_bufs(soc, enable_avg=True, enable_buf=True)
-
-            # make sure count variable is reset to 0
-            soc.set_tproc_counter(addr=self.counter_addr, val=0)
+            if length > maxlen//2:
+                self._dec_overlap = False
+            self._dec_addrs[0][ch] = 0
+            self._dec_addrs[1][ch] = maxlen//2
+            soc.clear_decimated_sum(ch, length, dtype=dtype)
+        if not self._dec_overlap:
+            self._dec_addrs[1] = self._dec_addrs[0]
+
+    def _start_decimated_round(self, soc, ir):
+        """Configure the buffers and start the program for a round of acquire_decimated().
+        """
+        # Configure and enable buffer capture.
+        self.config_bufs(soc, enable_avg=True, enable_buf=False)
+        for ch, ro in self.ro_chs.items():
+            soc.config_buf(ch, address=self._dec_addrs[ir%2][ch], length=ro['length'], enable=True)
 
-            # run the assembly program
-            # if start_src="external", you must pulse the trigger input once for every round
-            soc.start_tproc()
+        self._start_counted_round(soc)
 
-            count = 0
-            while count < total_count:
-                count = soc.get_tproc_counter(addr=self.counter_addr)
+    def _read_accumulated_round(self, soc):
+        """Read out the accumulated buffers after a round of acquire_decimated().
+        """
+        total_count = functools.reduce(operator.mul, self.loop_dims)
+        # buffer for accumulated data (for convenience/debug)
+        self.d_buf = []
+        for ii, (ch, ro) in enumerate(self.ro_chs.items()):
+            self.d_buf.append(obtain(soc.get_accumulated(ch=ch, address=0, length=ro['trigs']*total_count).reshape((*self.loop_dims, ro['trigs'], 2))))
 
-            for ii, (ch, ro) in enumerate(self.ro_chs.items()):
-                dec_buf[ii] += obtain(soc.get_decimated(ch=ch,
-                                    address=0, length=ro['length']*ro['trigs']*total_count))
-                self.d_buf.append(obtain(soc.get_accumulated(ch=ch, address=0, length=ro['trigs']*total_count).reshape((*self.loop_dims, ro['trigs'], 2))))
+    def _add_decimated_round(self, soc, ir):
+        """Add the decimated data from a round of acquire_decimated() to the sums on the QickSoc.
+        """
+        for ch in self.ro_chs:
+            soc.add_decimated(ch, address=self._dec_addrs[ir%2][ch])
 
+    def _average_decimated(self, soc, soft_avgs, remove_offset):
+        """Average the decimated data from acquire_decimated() over rounds, and split it into reps.
+        """
+        total_count = functools.reduce(operator.mul, self.loop_dims)
         onetrig = all([ro['trigs']==1 for ro in self.ro_chs.values()])
 
         # average the decimated data
         result = []
         for ii, (ch, ro) in enumerate(self.ro_chs.items()):
-            d_avg = dec_buf[ii]/soft_avgs
+            d_avg = obtain(soc.get_decimated_sum(ch))/soft_avgs
             if remove_offset:
                 d_avg -= self._ro_offset(ch, ro['ro_config'])
             if total_count == 1 and onetrig:
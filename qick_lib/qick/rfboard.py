@@ -2,7 +2,7 @@ import os
 from .qick import SocIp, QickSoc
 from .qick_asm import QickConfig
 from pynq.overlay import Overlay, DefaultIP
-from pynq.buffer import allocate
+from .drivers.dma_pool import dma_pool
 import xrfclk
 import numpy as np
 import time
@@ -59,19 +59,18 @@ class AxisSignalGenV3(SocIp):
         time.sleep(0.1)
 
         # Define buffer.
-        self.buff = allocate(shape=(len(buff_in)), dtype=np.int16)
-
-        ###################
-        ### Load I data ###
-        ###################
-        np.copyto(self.buff, buff_in)
-
-        # Enable writes.
-        self.wr_enable(addr)
-
-        # DMA data.
-        self.dma.sendchannel.transfer(self.buff)
-        self.dma.sendchannel.wait()
+        with dma_pool.borrow(len(buff_in), np.int16) as buff:
+            ###################
+            ### Load I data ###
+            ###################
+            np.copyto(buff, buff_in)
+
+            # Enable writes.
+            self.wr_enable(addr)
+
+            # DMA data.
+            self.dma.sendchannel.transfer(buff)
+            self.dma.sendchannel.wait()
 
         # Disable writes.
         self.wr_disable()
@@ -1,5 +1,7 @@
-from threading import Thread, Event
+from threading import Thread, Event, Semaphore
 from queue import Queue
+import multiprocessing
+import atexit
 import time
 import numpy as np
 import traceback
@@ -12,8 +14,91 @@ import traceback
 # In the worst case where the tProc is running fast, we should actually be waiting for IO a lot (due to the DMA).
 # So we think it's safe to use threads.
 # However, this is a complicated problem and we may ultimately need to mess around with sys.setswitchinterval() or go back to Process.
-# To use Process instead of Thread, use the following import and change WORKERTYPE.
-#from multiprocessing import Process, Queue, Event
+# ProcessDataStreamer is the Process version, for when the main process is busy with CPU-bound work.
+
+class AdaptiveStride():
+    """
+    Chooses the streamer stride (number of shots per transfer) from the observed shot rate and DMA time.
+
+    The goal is to start each transfer when the unread data fills a target fraction of the averages buffer,
+    leaving enough headroom for the shots that arrive while we are polling and transferring.
+    When the tProc is slow, the streamer sleeps between counter polls instead of busy-polling.
+
+    :param capacity: Number of shots that fit in the averages buffer (for the most constrained channel)
+    :type capacity: float
+    :param stride: Initial stride, used until we have measured the shot rate
+    :type stride: int
+    """
+    # target fraction of the buffer filled with unread data when a transfer starts
+    FILL_TARGET = 0.25
+    # never let the buffer get fuller than this (including headroom for shots that arrive during a transfer)
+    FILL_MAX = 0.5
+    # smoothing factor for the exponential moving averages of shot rate and DMA time
+    ALPHA = 0.3
+    # longest time to sleep between counter polls (s)
+    MAX_SLEEP = 0.01
+
+    def __init__(self, capacity, stride):
+        self.capacity = capacity
+        self.stride = max(1, int(stride))
+        # shot rate (shots/s), or None if not measured yet
+        self.rate = None
+        # time per transfer (s)
+        self.t_xfer = 0.0
+        # time and counter value at the previous transfer
+        self.last_t = None
+        self.last_shots = 0
+
+    def _smooth(self, old, new):
+        if old is None:
+            return new
+        return (1-self.ALPHA)*old + self.ALPHA*new
+
+    def start(self, t):
+        """
+        Record the time when the tProc was started.
+        """
+        self.last_t = t
+
+    def update(self, t, shots, t_xfer):
+        """
+        Update the estimates after a transfer, and choose the next stride.
+
+        :param t: time (s) when the counter was polled for this transfer
+        :type t: float
+        :param shots: counter value for this transfer
+        :type shots: int
+        :param t_xfer: time (s) spent transferring
+        :type t_xfer: float
+        :return: the new stride
+        :rtype: int
+        """
+        if t > self.last_t and shots > self.last_shots:
+            self.rate = self._smooth(self.rate, (shots-self.last_shots)/(t-self.last_t))
+        self.t_xfer = self._smooth(self.t_xfer, t_xfer)
+        self.last_t = t
+        self.last_shots = shots
+
+        if self.rate is not None:
+            # shots that may arrive between the poll that triggers a transfer and the end of that transfer
+            headroom = self.rate*(self.t_xfer + self.MAX_SLEEP)
+            stride = min(self.FILL_TARGET*self.capacity, self.FILL_MAX*self.capacity - headroom)
+            self.stride = max(1, int(stride))
+        return self.stride
+
+    def poll_delay(self, shots_needed):
+        """
+        How long to wait before polling the counter again.
+
+        :param shots_needed: number of shots until the next transfer
+        :type shots_needed: int
+        :return: delay (s)
+        :rtype: float
+        """
+        if self.rate is None or self.rate <= 0:
+            return 0
+        # sleep for half the expected time, so we don't overshoot by much
+        return min(self.MAX_SLEEP, 0.5*shots_needed/self.rate)
 
 class DataStreamer():
     """
@@ -30,30 +115,47 @@ class DataStreamer():
     #WORKERTYPE = Process
     WORKERTYPE = Thread
 
+    # Number of DMA buffers per readout channel used in zero-copy mode.
+    N_ZEROCOPY_BUFS = 4
+
     def __init__(self, soc):
         self.soc = soc
 
         self.start_worker()
 
+    def _sync_types(self):
+        """
+        Get the types used for the worker and for communicating with it.
+
+        :return: worker, queue, event and semaphore types
+        :rtype: tuple
+        """
+        return self.WORKERTYPE, Queue, Event, Semaphore
+
     def start_worker(self):
+        worker_type, queue_type, event_type, semaphore_type = self._sync_types()
         # Initialize flags and queues.
         # Passes run commands from the main thread to the worker thread.
-        self.job_queue = Queue()
+        self.job_queue = queue_type()
         # Passes data from the worker thread to the main thread.
-        self.data_queue = Queue()
+        self.data_queue = queue_type()
         # Passes exceptions from the worker thread to the main thread.
-        self.error_queue = Queue()
+        self.error_queue = queue_type()
         # The main thread can use this flag to tell the worker thread to stop.
         # The main thread clears the flag when starting readout.
-        self.stop_flag = Event()
+        self.stop_flag = event_type()
         # The worker thread uses this to tell the main thread when it's done.
         # The main thread clears the flag when starting readout.
-        self.done_flag = Event()
+        self.done_flag = event_type()
         self.done_flag.set()
+        # Bookkeeping for zero-copy DMA buffers.
+        # The worker thread acquires a buffer before each transfer, poll_data() releases it after the data has been consumed.
+        self.free_bufs = semaphore_type(self.N_ZEROCOPY_BUFS)
+        self.reset_bufs(False)
 
         # Process object for the streaming readout.
         # daemon=True means the readout thread will be killed if the parent is killed
-        self.readout_worker = self.WORKERTYPE(target=self._run_readout, daemon=True)
+        self.readout_worker = worker_type(target=self._run_readout, daemon=True)
         self.readout_worker.start()
 
     def stop_readout(self):
@@ -62,6 +164,13 @@ class DataStreamer():
         """
         self.stop_flag.set()
 
+    def close(self):
+        """
+        Release the streamer's resources.
+        The worker thread is a daemon and holds nothing that needs to be freed, so this only stops the readout loop.
+        """
+        self.stop_readout()
+
     def readout_running(self):
         """
         Test if the readout loop is running.
@@ -71,6 +180,116 @@ class DataStreamer():
         """
         return not self.done_flag.is_set()
 
+    def reset_bufs(self, zero_copy):
+        """
+        Reset the bookkeeping for the zero-copy DMA buffers.
+        This must only be called while the readout loop is not running.
+
+        :param zero_copy: whether the next readout will use zero-copy buffers
+        :type zero_copy: bool
+        """
+        self.zero_copy = zero_copy
+        # Make all the buffers free.
+        while self.free_bufs.acquire(False):
+            pass
+        for i in range(self.N_ZEROCOPY_BUFS):
+            self.free_bufs.release()
+        # Number of buffers handed out to the consumer and not yet released.
+        self.held_bufs = 0
+
+    def alloc_bufs(self, ch_list, zero_copy):
+        """
+        Allocate the zero-copy DMA buffers, if needed.
+        This must only be called while the readout loop is not running.
+
+        :param ch_list: List of readout channels
+        :type ch_list: list of int
+        :param zero_copy: whether the next readout will use zero-copy buffers
+        :type zero_copy: bool
+        """
+        if zero_copy:
+            for ch in ch_list:
+                self.soc.avg_bufs[ch].alloc_avg_buffs(self.N_ZEROCOPY_BUFS)
+
+    def _use_bufs(self, zero_copy):
+        """
+        Test if the readout loop should transfer data through the buffer ring.
+
+        :param zero_copy: zero-copy setting of the readout
+        :type zero_copy: bool
+        :return: whether to use the ring
+        :rtype: bool
+        """
+        return zero_copy
+
+    def _start_transfer(self, ch, address, length, buff_idx):
+        """
+        Start a transfer from a readout's accumulated buffer.
+        """
+        self.soc.start_accumulated(ch=ch, address=address, length=length, buff_idx=buff_idx)
+
+    def _finish_transfer(self, ch, length, buff_idx):
+        """
+        Wait for a transfer to complete, and get the data.
+        """
+        return self.soc.finish_accumulated(ch=ch, length=length)
+
+    def _pack_data(self, d_buf, ch_list, lengths, buff_idx):
+        """
+        Get the data to put in the data queue.
+        """
+        return d_buf
+
+    def unpack_data(self, data):
+        """
+        Convert a payload from the data queue back to a list of arrays.
+        This is called by poll_data().
+
+        :param data: data as put in the queue by the readout loop
+        :type data: list
+        :return: I,Q pairs for each readout channel
+        :rtype: list of ndarray
+        """
+        return data
+
+    def hold_buf(self):
+        """
+        Record that a data packet (and its zero-copy buffer) has been handed out to the consumer.
+        """
+        if self.zero_copy:
+            self.held_bufs += 1
+
+    def release_bufs(self):
+        """
+        Release all the zero-copy buffers held by the consumer, so the worker thread can reuse them.
+        """
+        for i in range(self.held_bufs):
+            self.free_bufs.release()
+        self.held_bufs = 0
+
+    def bufs_exhausted(self):
+        """
+        Test if all the zero-copy buffers are held by the consumer, in which case no new data can arrive until they are released.
+
+        :return: buffer status
+        :rtype: bool
+        """
+        return self.zero_copy and self.held_bufs >= self.N_ZEROCOPY_BUFS
+
+    def _acquire_buf(self):
+        """
+        Wait for a free zero-copy buffer.
+
+        :return: buffer index, or None if the stop flag was set while waiting
+        :rtype: int
+        """
+        while not self.free_bufs.acquire(timeout=0.1):
+            if self.stop_flag.is_set():
+                return None
+        buff_idx = self.buf_count % self.N_ZEROCOPY_BUFS
+        self.buf_count += 1
+        return buff_idx
+
     def data_available(self):
         """
         Test if data is available in the queue.
@@ -92,21 +311,36 @@ class DataStreamer():
         :type addr: list of int
         :param reads_per_count: Number of data points to expect per counter increment
         :type reads_per_count: list of int
+        :param stride: Number of shots to transfer at a time, None for the default, or "adaptive" to use AdaptiveStride
+        :type stride: int or str
+        :param zero_copy: DMA into the zero-copy buffers and pass views to the main thread
+        :type zero_copy: bool
         """
         while True:
             try:
                 # wait for a job
-                total_shots, counter_addr, ch_list, reads_per_count, stride = self.job_queue.get(block=True)
+                total_shots, counter_addr, ch_list, reads_per_count, stride, zero_copy = self.job_queue.get(block=True)
                 #print("streamer loop: start", total_count)
 
                 shots = 0
                 last_shots = 0
+                # Number of buffers filled so far in this readout (buffers are used round-robin).
+                self.buf_count = 0
 
                 # how many shots worth of data to transfer at a time
-                if stride is None:
+                adaptive = None
+                if stride == "adaptive":
+                    # number of shots that fit in the most constrained channel's buffer
+                    capacity = min([self.soc.get_avg_max_length(ch)/nreads for ch, nreads in zip(ch_list, reads_per_count) if nreads > 0])
+                    adaptive = AdaptiveStride(capacity, 0.1*capacity)
+                    stride = adaptive.stride
+                elif stride is None:
                     stride = int(0.1 * self.soc.get_avg_max_length(0)/max(reads_per_count))
                 # bigger stride is more efficient, but the transfer size must never exceed AVG_MAX_LENGTH, so the stride should be set with some safety margin
 
+                # channels that have their own DMA engines can be transferred concurrently
+                batches = self.soc.plan_avg_transfers(ch_list)
+
                 # make sure count variable is reset to 0 before starting processor
                 self.soc.set_tproc_counter(addr=counter_addr, val=0)
                 stats = []
@@ -116,36 +350,69 @@ class DataStreamer():
                 # if the tproc is configured for internal start, this will start the program
                 # for external start, the program will not start until a start pulse is received
                 self.soc.start_tproc()
+                if adaptive is not None:
+                    adaptive.start(t_start)
+
+                # counter value polled while the previous transfer was in flight
+                next_shots = None
 
                 # Keep streaming data until you get all of it
                 while last_shots < total_shots:
                     if self.stop_flag.is_set():
                         print("streamer loop: got stop flag")
                         break
-                    shots = self.soc.get_tproc_counter(addr=counter_addr)
+                    if next_shots is None:
+                        shots = self.soc.get_tproc_counter(addr=counter_addr)
+                    else:
+                        shots = next_shots
+                        next_shots = None
+                    t_poll = time.time()
                     # wait until either you've gotten a full stride of measurements or you've finished (so you don't go crazy trying to download every measurement)
-                    if shots >= min(last_shots+stride, total_shots):
+                    if shots < min(last_shots+stride, total_shots):
+                        if adaptive is not None:
+                            # back off instead of busy-polling
+                            time.sleep(adaptive.poll_delay(min(last_shots+stride, total_shots) - shots))
+                    else:
+                        # in zero-copy mode, all channels DMA into the next free buffer in the ring
+                        buff_idx = None
+                        if self._use_bufs(zero_copy):
+                            buff_idx = self._acquire_buf()
+                            if buff_idx is None:
+                                print("streamer loop: got stop flag")
+                                break
                         newshots = shots-last_shots
                         # buffer for each channel
                         d_buf = [None for nreads in reads_per_count]
 
-                        # for each adc channel get the single shot data and add it to the buffer
+                        # check all channels for overflow before starting any transfers
+                        newpoints = [newshots*nreads for nreads in reads_per_count]
+                        addrs = []
                         for iCh, ch in enumerate(ch_list):
-                            newpoints = newshots*reads_per_count[iCh]
-                            if newpoints >= self.soc.get_avg_max_length(ch):
+                            if newpoints[iCh] >= self.soc.get_avg_max_length(ch):
                                 raise RuntimeError("Overflowed the averages buffer (%d unread samples >= buffer size %d)."
-                                                   % (newpoints, self.soc.get_avg_max_length(ch)) +
+                                                   % (newpoints[iCh], self.soc.get_avg_max_length(ch)) +
                                                    "\nYou need to slow down the tProc by increasing relax_delay." +
                                                    "\nIf the TQDM progress bar is enabled, disabling it may help.")
+                            addrs.append(last_shots * reads_per_count[iCh] % self.soc.get_avg_max_length(ch))
 
-                            addr = last_shots * reads_per_count[iCh] % self.soc.get_avg_max_length(ch)
-                            data = self.soc.get_accumulated(ch=ch, address=addr, length=newpoints)
-                            d_buf[iCh] = data
+                        # for each adc channel get the single shot data and add it to the buffer
+                        # start one transfer on each DMA engine, then wait for them all
+                        for iBatch, batch in enumerate(batches):
+                            for iCh in batch:
+                                self._start_transfer(ch_list[iCh], addrs[iCh], newpoints[iCh], buff_idx)
+                            # while the last DMAs are running, poll the counter for the next iteration
+                            if iBatch == len(batches)-1 and shots < total_shots:
+                                next_shots = self.soc.get_tproc_counter(addr=counter_addr)
+                            for iCh in batch:
+                                d_buf[iCh] = self._finish_transfer(ch_list[iCh], newpoints[iCh], buff_idx)
 
                         last_shots += newshots
 
-                        stats = (time.time()-t_start, shots, addr, newshots)
-                        self.data_queue.put((newshots, (d_buf, stats)))
+                        t_now = time.time()
+                        stats = (t_now-t_start, shots, addrs[-1], newshots, stride)
+                        if adaptive is not None:
+                            stride = adaptive.update(t_poll, shots, t_now-t_poll)
+                        self.data_queue.put((newshots, (self._pack_data(d_buf, ch_list, newpoints, buff_idx), stats)))
                 #if last_count==total_count: print("streamer loop: normal completion")
 
             except Exception as e:
@@ -160,3 +427,90 @@ class DataStreamer():
                 self.done_flag.set()
                 # set tproc for internal start so we don't run the program repeatedly (this also clears the internal-start register)
                 self.soc.start_src("internal")
+
+class ProcessDataStreamer(DataStreamer):
+    """
+    A DataStreamer that runs the readout loop in a separate process, so it doesn't compete for the GIL with the main process.
+
+    The worker process is forked when the first readout is started, and inherits the QickSoc's memory mappings.
+    It only has a copy of the QickSoc's Python state as of when it was forked:
+    configuration that the readout loop depends on (the buffer drivers and their DMA buffers) must be done before the first readout.
+    If that configuration changes afterwards, call close(), and the next readout will fork a fresh worker.
+
+    The shared memory is freed by close(), which is called by QickSoc.close() and at interpreter exit.
+
+    The data is passed back through a ring of shared-memory buffers, and only the buffer index and the data lengths go through the data queue.
+    Every readout goes through the ring: in zero-copy mode, poll_data() returns views into shared memory, otherwise copies.
+
+    :param soc: The QickSoc object.
+    :type soc: QickSoc
+    """
+
+    def __init__(self, soc):
+        self.soc = soc
+        self.shm = None
+        # the worker is forked by QickSoc.start_readout(), see start_worker()
+        self.readout_worker = None
+        atexit.register(self.close)
+
+    def _sync_types(self):
+        ctx = multiprocessing.get_context("fork")
+        return ctx.Process, ctx.Queue, ctx.Event, ctx.Semaphore
+
+    def start_worker(self):
+        from multiprocessing import shared_memory
+        self.close()
+        # one slot per readout in each buffer, big enough for a full averages buffer
+        self.ring_offsets = []
+        offset = 0
+        for ch in range(len(self.soc.avg_bufs)):
+            self.ring_offsets.append(offset)
+            offset += 2*self.soc.get_avg_max_length(ch)
+        # the ring must exist before the worker is forked
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, 4*offset*self.N_ZEROCOPY_BUFS))
+        self.ring = np.ndarray((self.N_ZEROCOPY_BUFS, offset), dtype=np.int32, buffer=self.shm.buf)
+        super().start_worker()
+
+    def close(self):
+        """
+        Stop the worker process and free the shared memory.
+        The next readout will fork a new worker.
+        """
+        if self.shm is not None:
+            self.readout_worker.terminate()
+            self.readout_worker.join()
+            self.readout_worker = None
+            self.ring = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def alloc_bufs(self, ch_list, zero_copy):
+        # the ring is allocated when the worker is started
+        pass
+
+    def _use_bufs(self, zero_copy):
+        return True
+
+    def _ring_view(self, buff_idx, ch, length):
+        start = self.ring_offsets[ch]
+        return self.ring[buff_idx, start:start+2*length].reshape((-1,2))
+
+    def _start_transfer(self, ch, address, length, buff_idx):
+        # the zero-copy DMA buffers are allocated by the main process, so the worker can't use them
+        self.soc.start_accumulated(ch=ch, address=address, length=length)
+
+    def _finish_transfer(self, ch, length, buff_idx):
+        self.soc.finish_accumulated(ch=ch, length=length, out=self._ring_view(buff_idx, ch, length))
+
+    def _pack_data(self, d_buf, ch_list, lengths, buff_idx):
+        return (buff_idx, ch_list, lengths)
+
+    def unpack_data(self, data):
+        buff_idx, ch_list, lengths = data
+        d_buf = [self._ring_view(buff_idx, ch, length) for ch, length in zip(ch_list, lengths)]
+        if not self.zero_copy:
+            # copy the data out and give the buffer back right away
+            d_buf = [d.copy() for d in d_buf]
+            self.free_bufs.release()
+        return d_buf
@@ -227,6 +227,8 @@ regex = {
     'CDS'       : r'\s*([\w&\+\']+)'}
 
 import re
+import copy
+import numpy as np
 
 ###  LOGGER ###
 class Logger():
@@ -1243,6 +1245,50 @@ class Assembler():
             binary_array.append(binary_line)
         return binary_program_list, binary_array
 
+    @staticmethod
+    def list2array(program_list : list, label_dict : dict = {}, check : bool = False) -> np.ndarray:
+        """
+            translates a program list to binary form, like list2bin(), but faster.
+            instructions are encoded with integer arithmetic (see IntInstruction) where possible, and by list2bin() otherwise.
+            :program_list (list): each element is a dictionary with all the commands and instructions. see ' asm2list() '
+            :label_dict (dict): dictionary with label information only if program_list contains labels.
+            :check (bool): also run list2bin() on a copy of the program list, and raise an error if the results differ.
+            :returns (ndarray): (n, 8) uint32 array, the same values as the binary program from list2bin(); empty if there was an error
+        """
+        if check:
+            _, expected = Assembler.list2bin(copy.deepcopy(program_list), label_dict)
+
+        for line_number, command in enumerate(program_list, start=1):
+            if (('LABEL' in command) and (command['LABEL'] in label_dict) and 'ADDR' not in command):
+                command['ADDR'] = label_dict[ command['LABEL'] ]
+            if not 'LINE' in command:
+                command['LINE'] = line_number
+
+        words = []
+        for command in program_list:
+            if ('CMD' in command):
+                if not ('UF' in command):
+                    command['UF'] = '0'
+                code = IntInstruction.encode(command)
+                if code is not None:
+                    words.extend(code)
+                    continue
+            # fall back to the string encoder
+            _, binary_array = Assembler.list2bin([command])
+            if not binary_array:
+                words = []
+                break
+            words.extend(line[2] << 64 | line[1] << 32 | line[0] for line in binary_array)
+
+        binary_array = np.zeros((len(words), 8), dtype=np.uint32)
+        binary_array[:, 0] = [w & 0xFFFFFFFF for w in words]
+        binary_array[:, 1] = [(w >> 32) & 0xFFFFFFFF for w in words]
+        binary_array[:, 2] = [w >> 64 for w in words]
+
+        if check and not np.array_equal(binary_array, np.array(expected, dtype=np.uint32).reshape(-1, 8)):
+            raise RuntimeError("integer encoder does not match list2bin()")
+        return binary_array
+
     def file_asm2bin(filename : str, save_unparsed_filename : str = "") -> list:
         """  opens file with assembler and returns the binary
         
@@ -2173,3 +2219,380 @@ class Instruction():
             error, CODE = Instruction.REG_WR(current)
         return error, CODE        
 
+
+###############################################################################
+## INTEGER ENCODER
+###############################################################################
+# The 72-bit instruction word, as built by the Instruction methods, is made of these fields (MSB first):
+# HEADER(3) AI(1) DF(2) COND(3) CFG(7) ADDR(17) DATA(32) RD(7)
+# IntInstruction builds the same words with integer arithmetic.
+# It handles the common forms of the common instructions; for anything else it returns None,
+# and the instruction is encoded by the Instruction methods instead.
+# The IntInstruction methods only modify the command dictionary when they succeed,
+# and then make the same changes as the Instruction methods.
+
+class IntInstruction():
+    RE_REG  = re.compile(r'([srw])(\d+)')
+    RE_IMM  = re.compile(r'#(-?\d+)|#u(\d+)|#b(\d+)|#h([0-9A-F]+)|&(\d+)|@(-?\d+)')
+    RE_INT  = re.compile(r'-?\d+')
+    RE_ADDR = re.compile(r'&(\d+)|([sr])(\d+)')
+    REG_TYPE = {'s': (0, 15), 'r': (1, 31), 'w': (2, 5)}
+    COND  = {k: int(v, 2) for k, v in condList.items()}
+    ALU   = {k: int(v, 2) for k, v in aluList.items()}
+    ALU_S = {k: int(v, 2) for k, v in aluList_s.items()}
+    TIME_OP = {'rst': 0b0001, 'updt': 0b0010, 'set_ref': 0b0100, 'inc_ref': 0b1000}
+    FLAG_OP = {'set': 0b0001, 'clr': 0b0010}
+    WAIT_OP = {'port_dt': ('s10 AND #h8000', 'Z'),
+               'div_rdy': ('s10 AND #h4', 'Z'),
+               'div_dt':  ('s10 AND #h8', 'Z'),
+               'qpa_rdy': ('s10 AND #h100', 'Z'),
+               'qpa_dt':  ('s10 AND #h200', 'Z')}
+
+    @staticmethod
+    def word(hdr, ai, df, cond, cfg, addr, data, rd):
+        return (hdr<<69) | (ai<<68) | (df<<66) | (cond<<63) | (cfg<<56) | (addr<<39) | (data<<7) | rd
+
+    @staticmethod
+    def reg(name):
+        """
+        :returns (int): register address (type and number, as for get_reg_addr), or None
+        """
+        m = IntInstruction.RE_REG.fullmatch(name)
+        if m is None:
+            return None
+        rtype, rmax = IntInstruction.REG_TYPE[m.group(1)]
+        num = int(m.group(2))
+        if num > rmax:
+            return None
+        return (rtype << 5) | num
+
+    @staticmethod
+    def imm(lit, bits, raw=False):
+        """
+        :returns (int): literal value truncated to the field width (as for get_imm_dt), or None
+        """
+        m = IntInstruction.RE_IMM.fullmatch(lit)
+        if m is None:
+            return None
+        s, u, b, h, a, t = m.groups()
+        signed = s is not None or t is not None
+        if s is not None:   val = int(s)
+        elif u is not None: val = int(u)
+        elif b is not None:
+            if b.strip('01'): return None
+            val = int(b, 2)
+        elif h is not None: val = int(h, 16)
+        elif a is not None: val = int(a)
+        else:               val = int(t)
+        if signed:
+            if not -2**(bits-1) <= val < 2**(bits-1): return None
+        elif not 0 <= val < 2**bits:
+            return None
+        if raw:
+            return val
+        return val & ((1<<bits) - 1)
+
+    @staticmethod
+    def flag(command, key):
+        v = command[key]
+        if v == '0': return 0
+        if v == '1': return 1
+        return None
+
+    @staticmethod
+    def cond(command):
+        if 'IF' in command:
+            return IntInstruction.COND.get(command['IF'])
+        return 0
+
+    @staticmethod
+    def mem_addr(addr):
+        """
+        :returns (tuple): (rsA0, AI) for a single-operand address, or None
+        """
+        m = IntInstruction.RE_ADDR.fullmatch(addr)
+        if m is None:
+            return None
+        lit, rtype, num = m.groups()
+        if lit is not None:
+            val = int(lit)
+            return (val, 1) if val <= 1023 else None
+        val = int(num)
+        if val > 15:
+            return None
+        return ((rtype=='r') << 5 | val, 0)
+
+    @staticmethod
+    def source(command, full):
+        """
+        Integer version of Instruction.__PROCESS_SOURCE.
+        :returns (tuple): (DATA, alu_op, DF), or None
+        """
+        I = IntInstruction
+        if 'OP' in command:
+            cmd_op = command['OP'].split()
+            if len(cmd_op) == 1:
+                rsD0 = I.reg(cmd_op[0])
+                if rsD0 is None: return None
+                if 'LIT' in command:
+                    imm = I.imm(command['LIT'], 16)
+                    if imm is None: return None
+                else:
+                    imm = 0
+                return (rsD0 << 24 | imm, 0, 0b01)
+            elif len(cmd_op) == 3:
+                rsD0 = I.reg(cmd_op[0])
+                if rsD0 is None: return None
+                operation = cmd_op[1]
+                alu_op = (I.ALU if full else I.ALU_S).get(operation)
+                if alu_op is None: return None
+                if cmd_op[2].startswith('#'):
+                    val = I.imm(cmd_op[2], 24, raw=True)
+                    if val is None: return None
+                    # shifts over 15 are reported (but still encoded) by the Instruction methods
+                    if operation in ['SR', 'SL', 'ASR'] and val > 15: return None
+                    return (rsD0 << 24 | (val & 0xFFFFFF), alu_op, 0b10)
+                rsD1 = I.reg(cmd_op[2])
+                if rsD1 is None: return None
+                if 'LIT' in command:
+                    imm = I.imm(command['LIT'], 16)
+                    if imm is None: return None
+                else:
+                    imm = 0
+                return (rsD0 << 24 | rsD1 << 16 | imm, alu_op, 0b01)
+            return None
+        elif 'LIT' in command:
+            imm = I.imm(command['LIT'], 32)
+            if imm is None: return None
+            return (imm, 0, 0b11)
+        return (0, 0, 0b11)
+
+    @staticmethod
+    def REG_WR(command):
+        I = IntInstruction
+        if 'WR' in command or 'WP' in command: return None
+        uf = I.flag(command, 'UF')
+        cond = I.cond(command)
+        if uf is None or cond is None: return None
+        src = command['SRC']
+        if src == 'op':
+            if 'OP' not in command: return None
+            s = I.source(command, True)
+            if s is None: return None
+            data, alu_op, df = s
+            cfg = uf << 4 | alu_op
+            ai = addr = 0
+        elif src == 'imm':
+            if 'LIT' not in command: return None
+            s = I.source(command, False)
+            if s is None: return None
+            data, alu_op, df = s
+            cfg = 0b11 << 5 | uf << 4 | alu_op
+            ai = addr = 0
+        elif src == 'wmem':
+            if cond != 0 or 'ADDR' not in command or command['DST'] == 'w0': return None
+            s = I.source(command, False)
+            a = I.mem_addr(command['ADDR'])
+            if s is None or a is None: return None
+            data, alu_op, df = s
+            rsA0, ai = a
+            cond = ('WW' in command) << 2
+            cfg = 0b10 << 5 | uf << 4 | alu_op
+            return (I.word(0b100, ai, df, cond, cfg, rsA0 << 6, data, 0),)
+        else:
+            return None
+        rd = I.reg(command['DST'])
+        if rd is None: return None
+        return (I.word(0b100, ai, df, cond, cfg, addr, data, rd),)
+
+    @staticmethod
+    def WMEM_WR(command):
+        I = IntInstruction
+        if 'WR' in command or 'WP' in command or 'DST' not in command: return None
+        uf = I.flag(command, 'UF')
+        a = I.mem_addr(command['DST'])
+        s = I.source(command, False)
+        if uf is None or a is None or s is None: return None
+        rsA0, ai = a
+        data, alu_op, df = s
+        ti = 0
+        if 'TIME' in command:
+            ti = 1
+            data = I.imm(command['TIME'], 32)
+            if data is None: return None
+        cfg = 1 << 6 | ti << 5 | uf << 4 | alu_op
+        return (I.word(0b101, ai, df, 0b100, cfg, rsA0 << 6, data, 0),)
+
+    @staticmethod
+    def TEST(command, uf=1):
+        I = IntInstruction
+        if 'WR' in command: return None
+        cond = I.cond(command)
+        s = I.source(command, False)
+        if cond is None or s is None: return None
+        data, alu_op, df = s
+        return (I.word(0b000, 0, df, cond, uf << 4 | alu_op, 0, data, 0),)
+
+    @staticmethod
+    def BRANCH(command, cj):
+        I = IntInstruction
+        if 'WR' in command: return None
+        uf = 0 if cj == 0b11 else I.flag(command, 'UF')
+        cond = I.cond(command)
+        s = I.source(command, False)
+        if uf is None or cond is None or s is None: return None
+        data, alu_op, df = s
+        if cj == 0b11:
+            ai = addr = 0
+        else:
+            if 'ADDR' not in command: return None
+            a = command['ADDR']
+            if a == 's15':
+                ai = addr = 0
+            else:
+                m = I.RE_ADDR.fullmatch(a)
+                if m is None or m.group(1) is None or int(m.group(1)) > 1023: return None
+                ai = 1
+                addr = int(m.group(1)) << 6
+        if cj == 0b11:
+            command['UF'] = '0'
+        return (I.word(0b001, ai, df, cond, cj << 5 | uf << 4 | alu_op, addr, data, 0),)
+
+    @staticmethod
+    def PORT_WR(command):
+        I = IntInstruction
+        if 'WR' in command or 'DST' not in command: return None
+        cmd = command['CMD']
+        dst = command['DST']
+        if I.RE_INT.fullmatch(dst) is None: return None
+        ai = ww = sp = so = rsA0 = 0
+        if cmd == 'TRIG':
+            if command['SRC'] == 'set':   rsA0 = 1
+            elif command['SRC'] == 'clr': rsA0 = 0
+            else: return None
+            wp = ai = sp = 1
+            dst = str(int(dst) + 32)
+        elif cmd == 'DPORT_WR':
+            if command['SRC'] != 'imm' or 'DATA' not in command: return None
+            if I.RE_INT.fullmatch(command['DATA']) is None: return None
+            val = int(command['DATA'])
+            if not -1024 <= val <= 1023: return None
+            wp = ai = sp = 1
+            rsA0 = val & 0x7FF
+        elif cmd == 'DPORT_RD':
+            wp = 0
+        else:
+            so = wp = 1
+            if command['SRC'] == 'wmem':
+                if 'ADDR' not in command: return None
+                a = I.mem_addr(command['ADDR'])
+                if a is None: return None
+                rsA0, ai = a
+            elif command['SRC'] == 'r_wave':
+                sp = 1
+                if 'WW' in command:
+                    if 'ADDR' not in command: return None
+                    a = I.mem_addr(command['ADDR'])
+                    if a is None: return None
+                    rsA0, ai = a
+                    ww = 1
+            else:
+                return None
+        if 'TIME' in command:
+            if 'OP' in command: return None
+            data = I.imm(command['TIME'], 32)
+            if data is None: return None
+            df = 0b11
+            cfg = so << 6 | 1 << 5
+        else:
+            uf = I.flag(command, 'UF')
+            s = I.source(command, False)
+            if uf is None or s is None: return None
+            data, alu_op, df = s
+            cfg = so << 6 | uf << 4 | alu_op
+        rsA1 = int(dst)
+        if not 0 <= rsA1 <= 63: return None
+        command['DST'] = dst
+        return (I.word(0b110, ai, df, ww << 2 | sp << 1 | wp, cfg, rsA0 << 6 | rsA1, data, 0),)
+
+    @staticmethod
+    def CTRL(command):
+        I = IntInstruction
+        cond = I.cond(command)
+        if cond is None: return None
+        df = 0b01
+        data = 0
+        if command['CMD'] == 'TIME':
+            if 'C_OP' not in command: return None
+            op = I.TIME_OP.get(command['C_OP'])
+            if op is None: return None
+            cfg = 0b000 << 4 | op
+            if 'LIT' in command:
+                df = 0b11
+                data = I.imm(command['LIT'], 32)
+                if data is None: return None
+            elif 'R1' in command:
+                rd1 = I.reg(command['R1'])
+                if rd1 is None: return None
+                data = rd1 << 16
+            elif command['C_OP'] != 'rst':
+                return None
+        elif command['CMD'] == 'FLAG':
+            if 'C_OP' not in command: return None
+            op = I.FLAG_OP.get(command['C_OP'])
+            if op is None: return None
+            cfg = 0b001 << 4 | op
+        else:
+            return None
+        return (I.word(0b010, 0, df, cond, cfg, 0, data, 0),)
+
+    @staticmethod
+    def WAIT(command):
+        I = IntInstruction
+        if 'C_OP' not in command or 'P_ADDR' not in command: return None
+        if command['C_OP'] == 'time':
+            if 'TIME' not in command or I.RE_INT.fullmatch(command['TIME'][1:]) is None: return None
+            test_op, jump_cond = 's11 - #' + str(int(command['TIME'][1:])-10), 'S'
+        elif command['C_OP'] in I.WAIT_OP:
+            test_op, jump_cond = I.WAIT_OP[command['C_OP']]
+        else:
+            return None
+        current = command.copy()
+        current['ADDR'] = '&'+str(current['P_ADDR'])
+        current['OP'] = test_op
+        current['UF'] = '1'
+        test = I.TEST(current)
+        current['IF'] = jump_cond
+        jump = I.BRANCH(current, 0b00)
+        if test is None or jump is None: return None
+        command.update(current)
+        return test + jump
+
+    @staticmethod
+    def encode(command):
+        """
+        Encode one command, as list2bin() does.
+        :returns (tuple): the instruction words as 72-bit ints, or None if this command must be encoded by the Instruction methods
+        """
+        I = IntInstruction
+        cmd = command['CMD']
+        if cmd == 'NOP':
+            return (0,)
+        elif cmd == 'REG_WR':
+            return I.REG_WR(command)
+        elif cmd == 'WMEM_WR':
+            return I.WMEM_WR(command)
+        elif cmd == 'TEST':
+            words = I.TEST(command)
+            if words is not None:
+                command['UF'] = '1'
+            return words
+        elif cmd in ['JUMP', 'CALL', 'RET']:
+            return I.BRANCH(command, {'JUMP': 0b00, 'CALL': 0b10, 'RET': 0b11}[cmd])
+        elif cmd in ['TRIG', 'DPORT_WR', 'DPORT_RD', 'WPORT_WR']:
+            return I.PORT_WR(command)
+        elif cmd in ['TIME', 'FLAG']:
+            return I.CTRL(command)
+        elif cmd == 'WAIT':
+            return I.WAIT(command)
+        return None
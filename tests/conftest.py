@@ -0,0 +1,5 @@
+import os
+import sys
+
+# run the tests against the library in this checkout, without needing it installed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'qick_lib'))
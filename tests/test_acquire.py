@@ -0,0 +1,257 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from qick.qick_asm import AcquireMixin
+
+# readout window lengths and IQ offsets of the two readout channels
+LENGTHS = [10, 20]
+IQ_OFFSETS = [0.5, -0.25]
+
+
+class AcqProgram(AcquireMixin):
+    """Just the acquisition logic of a program: board configuration is skipped, and the dimensions are set directly."""
+
+    def __init__(self, loop_dims, avg_level, reads_per_shot=(1, 2)):
+        self.dump_keys = []
+        super().__init__()
+        self.counter_addr = 1
+        self.loop_dims = list(loop_dims)
+        self.avg_level = avg_level
+        self.reads_per_shot = list(reads_per_shot)
+        self.ro_chs = OrderedDict((ch, {'length': LENGTHS[ch], 'ro_config': {}}) for ch in range(len(reads_per_shot)))
+        self.soccfg = {'readouts': [{'iq_offset': offset} for offset in IQ_OFFSETS]}
+
+    def config_all(self, soc, load_pulses=True):
+        pass
+
+    def config_bufs(self, soc, enable_avg=True, enable_buf=True):
+        pass
+
+
+class FakeSoc:
+    """Stands in for a QickSoc: each round streams the next round of raw data, a few shots per poll.
+    The chunks don't line up with the loops, so the averaging has to handle partial loops."""
+
+    def __init__(self, data, shots_per_poll=7):
+        # raw data for each channel, with shape (rounds, *loop_dims, nreads, 2)
+        self.data = data
+        self.shots_per_poll = shots_per_poll
+        self.round = -1
+        self.stopped = 0
+
+    def start_src(self, src):
+        pass
+
+    def start_readout(self, total_shots, counter_addr, ch_list, reads_per_shot, zero_copy):
+        self.round += 1
+        self.count = 0
+        self.total_shots = total_shots
+        self.reads_per_shot = reads_per_shot
+
+    def poll_data(self, totaltime=0.1, timeout=None):
+        if self.count >= self.total_shots:
+            return []
+        n = min(self.shots_per_poll, self.total_shots-self.count)
+        d = [x[self.round].reshape((-1, 2))[self.count*nreads:(self.count+n)*nreads]
+             for x, nreads in zip(self.data, self.reads_per_shot)]
+        self.count += n
+        return [(n, (d, None))]
+
+    def stop_readout(self):
+        self.stopped += 1
+
+
+def make_data(loop_dims, rounds, reads_per_shot=(1, 2), seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(-1000, 1000, (rounds, *loop_dims, nreads, 2)).astype(np.int32) for nreads in reads_per_shot]
+
+
+def reference_avg(data, avg_level):
+    # mean over rounds and the averaged loop, normalized and offset-corrected, with the reads axis first
+    return [np.moveaxis(x.mean(axis=(0, avg_level+1))/LENGTHS[i] - IQ_OFFSETS[i], -2, 0) for i, x in enumerate(data)]
+
+
+def reference_var(data, avg_level):
+    return [np.moveaxis(x.var(axis=(0, avg_level+1))/LENGTHS[i]**2, -2, 0) for i, x in enumerate(data)]
+
+
+def reference_shots(prog, data, avg_level, threshold, angle):
+    # fraction of shots over threshold, using the rotation and threshold of the original non-streaming code
+    shots = [prog._apply_threshold([x[ir] for x in data], threshold, angle, True) for ir in range(len(data[0]))]
+    return [np.moveaxis(np.mean([s[i] for s in shots], axis=0).mean(axis=avg_level), -1, 0) for i in range(len(data))]
+
+
+@pytest.mark.parametrize("loop_dims", [[12], [4, 5], [3, 4, 5]])
+def test_avg_index(loop_dims):
+    total = int(np.prod(loop_dims))
+    shots = np.unravel_index(np.arange(total), loop_dims)
+    for avg_level in range(len(loop_dims)):
+        prog = AcqProgram(loop_dims, avg_level)
+        avg_dims = loop_dims[:avg_level] + loop_dims[avg_level+1:]
+        ref = np.ravel_multi_index(shots[:avg_level] + shots[avg_level+1:], avg_dims) if avg_dims else np.zeros(total, dtype=int)
+        assert np.array_equal(prog._avg_index(0, total), ref)
+        # any block of shots maps the same way
+        assert np.array_equal(prog._avg_index(3, 7), ref[3:10])
+
+
+@pytest.mark.parametrize("loop_dims, avg_level", [([20], 0), ([4, 5], 0), ([4, 5], 1), ([3, 4, 5], 1)])
+def test_running_avg(loop_dims, avg_level):
+    data = make_data(loop_dims, rounds=3)
+    prog = AcqProgram(loop_dims, avg_level)
+    avg = prog.acquire(FakeSoc(data), soft_avgs=3, progress=False, save_raw=False, calc_var=True)
+    assert prog.d_buf is None
+    for x, ref in zip(avg, reference_avg(data, avg_level)):
+        assert x.shape == ref.shape
+        assert np.allclose(x, ref)
+    for x, ref in zip(prog.get_running_var(), reference_var(data, avg_level)):
+        assert np.allclose(x, ref)
+    # the same result as averaging the raw data
+    raw_avg = AcqProgram(loop_dims, avg_level).acquire(FakeSoc(data), soft_avgs=3, progress=False)
+    for x, y in zip(avg, raw_avg):
+        assert np.allclose(x, y)
+
+
+def test_running_avg_partial():
+    loop_dims, avg_level = [4, 5], 0
+    data = make_data(loop_dims, rounds=1)
+    prog = AcqProgram(loop_dims, avg_level)
+    prog._init_running_avg(calc_var=False)
+    # the first 7 shots cover the first point of the averaged loop, and two points of the inner loop
+    prog._update_running_avg(0, 7, [x[0].reshape((-1, 2))[:7*nreads] for x, nreads in zip(data, prog.reads_per_shot)])
+    assert list(prog.run_count) == [2, 2, 1, 1, 1]
+    avg = prog.get_running_avg(remove_offset=False)
+    assert np.allclose(avg[1][:, 0], data[1][0, :2, 0].mean(axis=0)/LENGTHS[1])
+    assert np.allclose(avg[0][:, 3], data[0][0, 0, 3]/LENGTHS[0])
+    with pytest.raises(RuntimeError):
+        prog.get_running_var()
+
+
+def test_running_avg_unmeasured():
+    prog = AcqProgram([4, 5], 1)
+    prog._init_running_avg(calc_var=True)
+    prog._update_running_avg(0, 5, [np.ones((5*nreads, 2)) for nreads in prog.reads_per_shot])
+    # only the first point has been measured
+    for avg in prog.get_running_avg() + prog.get_running_var():
+        assert not np.any(np.isnan(avg[:, 0]))
+        assert np.all(np.isnan(avg[:, 1:]))
+
+
+@pytest.mark.parametrize("save_raw", [True, False])
+def test_running_threshold(save_raw):
+    loop_dims, avg_level = [4, 5], 0
+    threshold, angle = [0.0, 2.0], [0.3, -1.0]
+    data = make_data(loop_dims, rounds=2)
+    prog = AcqProgram(loop_dims, avg_level)
+    avg = prog.acquire(FakeSoc(data), soft_avgs=2, threshold=threshold, angle=angle, progress=False, save_raw=save_raw)
+    for x, ref in zip(avg, reference_shots(prog, data, avg_level, threshold, angle)):
+        assert np.allclose(x[..., 0], ref)
+        assert not np.any(x[..., 1])
+    # the shots from the last round are kept either way
+    for x, ref in zip(prog.get_shots(), prog._apply_threshold([x[1] for x in data], threshold, angle, True)):
+        assert np.array_equal(x, ref)
+
+
+class SlowAvgProgram(AcqProgram):
+    """Records when each round starts and is averaged, with averaging slow enough that the next round starts first."""
+
+    def __init__(self, *args, fail_round=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = []
+        self.avg_threads = set()
+        self.fail_round = fail_round
+        self.n_averaged = 0
+
+    def _start_acquire_round(self, soc, ir):
+        super()._start_acquire_round(soc, ir)
+        self.events.append(('start', ir))
+
+    def _average_buf(self, d_reps, reads_per_shot, length_norm=True, remove_offset=True):
+        ir = self.n_averaged
+        self.n_averaged += 1
+        self.avg_threads.add(threading.get_ident())
+        self.events.append(('avg begin', ir))
+        time.sleep(0.05)
+        if ir == self.fail_round:
+            raise ValueError("averaging failed")
+        avg = super()._average_buf(d_reps, reads_per_shot, length_norm, remove_offset)
+        self.events.append(('avg end', ir))
+        return avg
+
+
+@pytest.mark.parametrize("soft_avgs", [1, 2, 5])
+def test_pipelined_rounds(soft_avgs):
+    loop_dims, avg_level = [4, 5], 1
+    data = make_data(loop_dims, rounds=soft_avgs)
+    prog = SlowAvgProgram(loop_dims, avg_level)
+    avg = prog.acquire(FakeSoc(data), soft_avgs=soft_avgs, progress=False)
+    for x, ref in zip(avg, reference_avg(data, avg_level)):
+        assert np.allclose(x, ref)
+    # the raw data is from the last round
+    for x, ref in zip(prog.get_raw(), data):
+        assert np.array_equal(x, ref[-1])
+    assert prog._round_pool is None
+    if soft_avgs == 1:
+        # a single round is averaged directly
+        assert prog.avg_threads == {threading.get_ident()}
+        return
+    assert len(prog._d_bufs) == 2
+    assert threading.get_ident() not in prog.avg_threads
+    events = prog.events
+    for ir in range(soft_avgs-1):
+        # each round starts while the previous one is being averaged
+        assert events.index(('start', ir+1)) < events.index(('avg end', ir))
+    for ir in range(soft_avgs-2):
+        # but not before the round that used the same buffer has been averaged
+        assert events.index(('avg end', ir)) < events.index(('start', ir+2))
+
+
+def test_pipelined_round_error():
+    loop_dims, avg_level = [4, 5], 1
+    data = make_data(loop_dims, rounds=4)
+    prog = SlowAvgProgram(loop_dims, avg_level, fail_round=1)
+    soc = FakeSoc(data)
+    with pytest.raises(ValueError):
+        prog.acquire(soc, soft_avgs=4, progress=False)
+    # the readout and the worker were stopped, and the next acquisition works
+    assert soc.stopped == 1
+    assert prog._round_pool is None
+    prog.fail_round = None
+    prog.n_averaged = 0
+    avg = prog.acquire(FakeSoc(data), soft_avgs=4, progress=False)
+    for x, ref in zip(avg, reference_avg(data, avg_level)):
+        assert np.allclose(x, ref)
+
+
+@pytest.mark.parametrize("kwargs", [{}, {'save_raw': False}, {'threshold': 0.1}])
+def test_acquire_async(kwargs):
+    loop_dims, avg_level = [4, 5], 0
+    data = make_data(loop_dims, rounds=3)
+    avg = AcqProgram(loop_dims, avg_level).acquire(FakeSoc(data), soft_avgs=3, progress=False, **kwargs)
+    avg_async = asyncio.run(AcqProgram(loop_dims, avg_level).acquire_async(FakeSoc(data), soft_avgs=3, **kwargs))
+    for x, y in zip(avg, avg_async):
+        assert np.allclose(x, y)
+
+
+def test_acquire_async_abandoned():
+    loop_dims, avg_level = [4, 5], 0
+    data = make_data(loop_dims, rounds=3)
+    prog = SlowAvgProgram(loop_dims, avg_level)
+    soc = FakeSoc(data)
+
+    async def first_rounds():
+        it = prog.acquire_iter_async(soc, soft_avgs=3)
+        async for ir, count in it:
+            if ir == 1:
+                break
+        await it.aclose()
+
+    asyncio.run(first_rounds())
+    # the readout was stopped, and the worker was waited for
+    assert soc.stopped == 1
+    assert prog._round_pool is None
+    assert ('avg end', 0) in prog.events
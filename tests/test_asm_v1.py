@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+from qick import __version__
+from qick.qick_asm import QickConfig
+from qick.asm_v1 import QickProgram
+from qick.compile_cache import compile_cache
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SEEDS = range(5)
+
+# operator arguments: (argument index, choices) for the instructions that take them
+OPS = {'mathi': (3, ['+', '-', '*']),
+       'math': (3, ['+', '-', '*']),
+       'bitwi': (3, ['&', '|', '^', '~', '<<', '>>']),
+       'bitw': (3, ['&', '|', '^', '~', '<<', '>>']),
+       'condj': (2, ['>', '>=', '<', '<=', '==', '!=']),
+       'read': (2, ['upper', 'lower'])}
+# label arguments
+LABEL_ARGS = {'loopnz': 2, 'condj': 4}
+
+
+def make_soccfg():
+    tproc = {'type': 'axis_tproc64x32_x8', 'f_time': 430.08, 'pmem_size': 2**16, 'dmem_size': 4096,
+             'output_pins': [], 'start_pin': None, 'trig_output': 0, 'revision': 1}
+    return QickConfig({'tprocs': [tproc], 'gens': [], 'readouts': [], 'iqs': [],
+                       'sw_version': __version__, 'board': 'ZCU216', 'refclk_freq': 245.76})
+
+
+def random_prog(soccfg, seed, n=2000):
+    """A program of random instructions, covering the whole instruction set, with labels, jumps and comments."""
+    r = random.Random(seed)
+    prog = QickProgram(soccfg)
+    names = [name for name in QickProgram.instructions if name not in ['comment', 'end']]
+    n_labels = n//50
+    label_at = dict(zip(r.sample(range(n), n_labels), range(n_labels)))
+    for i in range(n):
+        if i in label_at:
+            prog.label("L%d" % label_at[i])
+        name = r.choice(names)
+        idef = QickProgram.instructions[name]
+        nargs = max(iarg for iarg, pos in idef['fmt']) + 1
+        args = []
+        for iarg in range(nargs):
+            if LABEL_ARGS.get(name) == iarg:
+                args.append("L%d" % r.randrange(n_labels))
+            elif name in OPS and OPS[name][0] == iarg:
+                args.append(r.choice(OPS[name][1]))
+            elif "${%d}" % iarg in idef['repr']:
+                args.append(r.randrange(32))
+            elif idef['type'] == "I" and iarg == nargs - 1:
+                args.append(r.choice([r.randrange(-2**30, 2**31), r.randrange(-100, 100), 0]))
+            else:
+                # page or channel
+                args.append(r.randrange(8))
+        if r.random() < 0.2:
+            args.append("comment %d" % i)
+        getattr(prog, name)(*args)
+    prog.end()
+    return prog
+
+
+def digest(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def prog_digests(prog):
+    return {'binprog': digest(np.asarray(prog.binprog, dtype=np.uint64).tobytes()),
+            'asm': digest(prog.asm()),
+            'prog_list': digest(json.dumps([dict(inst) for inst in prog.prog_list]))}
+
+
+@pytest.fixture(scope="module")
+def soccfg():
+    return make_soccfg()
+
+
+@pytest.fixture(scope="module")
+def reference():
+    # digests of the output of the original assembler, which built the encoders with eval() and stored prog_list as a list
+    with open(os.path.join(HERE, 'data', 'asm_v1_reference.json')) as f:
+        return json.load(f)
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    monkeypatch.setattr(compile_cache, 'maxsize', 0)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_compile(soccfg, reference, seed):
+    prog = random_prog(soccfg, seed)
+    prog.compile()
+    assert prog_digests(prog) == reference[str(seed)]
+
+
+@pytest.mark.parametrize("seed", SEEDS[:2])
+def test_compile_debug(soccfg, reference, seed, capsys):
+    # the debug path encodes one instruction at a time, with the closure encoders
+    prog = random_prog(soccfg, seed)
+    prog.compile(debug=True)
+    assert prog_digests(prog) == reference[str(seed)]
+
+
+def test_encoders_match_vectorized(soccfg):
+    prog = random_prog(soccfg, 10)
+    prog.compile()
+    labels = {}
+    addr = 0
+    for inst in prog.prog_list:
+        if inst['name'] == 'comment':
+            continue
+        if 'label' in inst:
+            labels[inst['label']] = addr
+        addr += 1
+    insts = [inst for inst in prog.prog_list if inst['name'] != 'comment']
+    mcodes = [prog.compile_instruction(inst, labels) for inst in insts]
+    assert mcodes == [int(x) for x in prog.binprog]
+
+
+def test_prog_list_read_only(soccfg):
+    prog = random_prog(soccfg, 0, n=50)
+    assert isinstance(prog.prog_list, tuple)
+    with pytest.raises(TypeError):
+        prog.prog_list[0]['args'] = (0,)
+    with pytest.raises(TypeError):
+        prog.prog_list[0] = {'name': 'end', 'args': ()}
+    # assigning a new list replaces the program
+    prog_list = [dict(inst) for inst in prog.prog_list]
+    prog2 = QickProgram(soccfg)
+    prog2.prog_list = prog_list
+    assert prog2.prog_list == prog.prog_list
+    assert prog2.asm() == prog.asm()
+
+
+@pytest.mark.parametrize("seed", SEEDS[:2])
+def test_pickle(soccfg, reference, seed):
+    prog = random_prog(soccfg, seed)
+    prog.compile()
+    prog2 = pickle.loads(pickle.dumps(prog))
+    assert prog_digests(prog2) == reference[str(seed)]
+    # the unpickled program can still be extended
+    prog2.end()
+    assert len(prog2.prog_list) == len(prog.prog_list) + 1
+
+
+@pytest.mark.parametrize("name, args", [("popi", (0, 2**30)),
+                                        ("regwi", (0, -1, 5)),
+                                        ("memr", (0, 1, 2**60))])
+def test_out_of_range(soccfg, name, args):
+    prog = QickProgram(soccfg)
+    getattr(prog, name)(*args)
+    prog.end()
+    with pytest.raises(RuntimeError, match=name):
+        prog.compile()
+    with pytest.raises(RuntimeError, match=name):
+        prog.compile(debug=True)
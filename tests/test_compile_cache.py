@@ -0,0 +1,192 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from qick import asm_v2
+from qick.asm_v2 import QickProgramV2, QickSweepRaw, Waveform, _pack_waveform
+from qick.compile_cache import CompileCache
+from qick.tprocv2_assembler import Logger
+
+
+def entry(i):
+    return {'binprog': np.arange(i, i+4, dtype=np.uint64)}
+
+
+def test_lru():
+    cache = CompileCache(maxsize=3)
+    keys = [cache.key('prog', i) for i in range(4)]
+    for i, key in enumerate(keys[:3]):
+        cache.put(key, entry(i))
+    # using the oldest entry makes the second-oldest the one to evict
+    assert np.array_equal(cache.get(keys[0])['binprog'], entry(0)['binprog'])
+    cache.put(keys[3], entry(3))
+    assert cache.get(keys[1]) is None
+    for i in [0, 2, 3]:
+        assert np.array_equal(cache.get(keys[i])['binprog'], entry(i)['binprog'])
+    assert cache.get_stats() == {'hits': 4, 'disk_hits': 0, 'misses': 1, 'entries': 3}
+    cache.reset_stats()
+    cache.clear()
+    assert cache.get(keys[0]) is None
+    assert cache.get_stats() == {'hits': 0, 'disk_hits': 0, 'misses': 1, 'entries': 0}
+
+
+def test_copies():
+    cache = CompileCache()
+    key = cache.key('prog')
+    data = entry(0)
+    cache.put(key, data)
+    # neither the caller's arrays nor the arrays returned by get() are the cached ones
+    data['binprog'][0] = 100
+    got = cache.get(key)
+    got['binprog'][1] = 100
+    assert np.array_equal(cache.get(key)['binprog'], entry(0)['binprog'])
+
+
+def test_key():
+    cache = CompileCache()
+    assert cache.key('v2', [{'CMD': 'NOP'}], {}) == cache.key('v2', [{'CMD': 'NOP'}], {})
+    # every part counts, and so does the order of the parts
+    keys = {cache.key('v2', [{'CMD': 'NOP'}], {}),
+            cache.key('v2', [{'CMD': 'NOP'}], {'L1': '&1'}),
+            cache.key('v1', [{'CMD': 'NOP'}], {}),
+            cache.key({}, [{'CMD': 'NOP'}], 'v2'),
+            cache.key(b'\x00\x01'),
+            cache.key(np.arange(2, dtype=np.uint8).tobytes() + b'\x02')}
+    assert len(keys) == 6
+    # dict ordering doesn't matter, numpy values are serialized as the equivalent Python values
+    assert cache.key({'a': 1, 'b': 2}) == cache.key({'b': 2, 'a': np.int64(1)})
+
+
+def test_disk(tmp_path):
+    path = tmp_path / 'cache'
+    cache = CompileCache(maxsize=2)
+    cache.set_path(str(path))
+    keys = [cache.key('prog', i) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, entry(i))
+    assert sorted(p.name for p in path.iterdir()) == sorted(key + '.npz' for key in keys)
+    # an entry evicted from memory is read back from disk, and is back in memory
+    assert np.array_equal(cache.get(keys[0])['binprog'], entry(0)['binprog'])
+    assert np.array_equal(cache.get(keys[0])['binprog'], entry(0)['binprog'])
+    assert cache.get_stats() == {'hits': 1, 'disk_hits': 1, 'misses': 0, 'entries': 2}
+    # a new cache (e.g. in a new process) using the same directory
+    cache2 = CompileCache(path=str(path))
+    for i, key in enumerate(keys):
+        got = cache2.get(key)
+        assert got['binprog'].dtype == np.uint64
+        assert np.array_equal(got['binprog'], entry(i)['binprog'])
+    assert cache2.get_stats() == {'hits': 0, 'disk_hits': 3, 'misses': 0, 'entries': 3}
+    # a damaged file is a miss
+    (path / (keys[0] + '.npz')).write_bytes(b'junk')
+    cache2.clear()
+    assert cache2.get(keys[0]) is None
+    # without a path, only the memory is used
+    cache2.set_path(None)
+    assert cache2.get(keys[1]) is None
+
+
+def test_disabled():
+    cache = CompileCache(maxsize=0)
+    assert not cache.enabled
+    key = cache.key('prog')
+    cache.put(key, entry(0))
+    assert cache.get(key) is None
+    assert cache.get_stats()['entries'] == 0
+    assert CompileCache().enabled
+
+
+def reference_pack(startvals):
+    # the packing done by Waveform.compile() before it was memoized
+    rawbytes = b''.join([int(i % 2**(8*w)).to_bytes(length=w, byteorder='little', signed=False)
+                         for i, w in zip(startvals, Waveform.widths)])
+    paddedbytes = rawbytes[:11] + bytes(1) + rawbytes[11:] + bytes(10)
+    return np.frombuffer(paddedbytes, dtype=np.int32)
+
+
+WAVES = [Waveform(123456789, 2**31 + 5, 1000, 30000, 100, 0b10101),
+         # negative values wrap
+         Waveform(-1, -2**20, 0, -5, 3, 0),
+         # swept parameters are written with their start values
+         Waveform(QickSweepRaw('freq', 1000, {'loop': 500}), 0,
+                  2**24 - 1, QickSweepRaw('gain', -200, {'loop': 400}), 2**32 - 1, 2**16 - 1),
+         # a Fraction gain is truncated
+         Waveform(0, 7, 12, Fraction(1000, 3), 50, 3)]
+
+
+@pytest.mark.parametrize("wave", WAVES)
+def test_pack_waveform(wave):
+    startvals = wave.startvals()
+    assert not any(isinstance(x, QickSweepRaw) for x in startvals)
+    packed = wave.compile()
+    assert packed.dtype == np.int32
+    assert np.array_equal(packed, reference_pack(startvals))
+
+
+def test_pack_waveform_memoized():
+    _pack_waveform.cache_clear()
+    wave = Waveform(1, 2, 3, 4, 5, 6)
+    wave.compile()
+    assert _pack_waveform.cache_info().misses == 1
+    # an identical waveform (e.g. the same pulse in another program) isn't packed again
+    packed = Waveform(1, 2, 3, 4, 5, 6).compile()
+    assert _pack_waveform.cache_info().hits == 1
+    assert np.array_equal(packed, reference_pack(wave.startvals()))
+    Waveform(1, 2, 3, 4, 5, 7).compile()
+    assert _pack_waveform.cache_info().misses == 2
+
+
+PROG_LIST = [{'CMD': 'REG_WR', 'DST': 'r1', 'SRC': 'imm', 'LIT': '#100'},
+             {'CMD': 'TEST', 'OP': 'r1 - #10', 'UF': '1'},
+             {'CMD': 'JUMP', 'LABEL': 'L1', 'IF': 'NZ'},
+             {'CMD': 'WPORT_WR', 'DST': '4', 'SRC': 'wmem', 'ADDR': '&1', 'TIME': '@1000'},
+             {'CMD': 'NOP'}]
+
+
+def make_prog(waves):
+    """A QickProgramV2 that already has its ASM and waveform list, so only the binary needs to be made."""
+    prog = object.__new__(QickProgramV2)
+    prog.prog_list = [dict(inst) for inst in PROG_LIST]
+    prog.labels = {'L1': '&2'}
+    prog.waves = waves
+    return prog
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(Logger, 'filename', str(tmp_path / 'assembler.log'))
+    cache = CompileCache()
+    monkeypatch.setattr(asm_v2, 'compile_cache', cache)
+    return cache
+
+
+def test_make_binprog_v2(cache):
+    prog = make_prog(WAVES[:2])
+    prog._make_binprog()
+    assert cache.get_stats()['misses'] == 1
+    pmem, filled = prog.binprog['pmem'], prog.prog_list
+    assert len(pmem)
+    assert np.array_equal(prog.binprog['wmem'], np.stack([w.compile() for w in WAVES[:2]]))
+    # the same ASM with different waveforms: the program memory and the filled-in ASM come from the cache
+    prog = make_prog(WAVES[2:])
+    prog._make_binprog()
+    assert cache.get_stats()['hits'] == 1
+    assert np.array_equal(prog.binprog['pmem'], pmem)
+    assert prog.prog_list == filled
+    assert np.array_equal(prog.binprog['wmem'], np.stack([w.compile() for w in WAVES[2:]]))
+    # the binary is the same as with no cache
+    cache.maxsize = 0
+    uncached = make_prog(WAVES[2:])
+    uncached._make_binprog()
+    assert np.array_equal(uncached.binprog['pmem'], pmem)
+    assert np.array_equal(uncached.binprog['wmem'], prog.binprog['wmem'])
+    assert uncached.prog_list == filled
+
+
+def test_make_binprog_v2_error(cache):
+    # a program that fails to assemble isn't cached
+    prog = make_prog([])
+    prog.prog_list.append({'CMD': 'TIME', 'C_OP': 'bad'})
+    prog._make_binprog()
+    assert len(prog.binprog['pmem']) == 0
+    assert cache.get_stats()['entries'] == 0
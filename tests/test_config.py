@@ -0,0 +1,123 @@
+from collections import Counter
+
+import pytest
+
+# QickSoc is only importable where pynq is
+pytest.importorskip("pynq")
+from qick.qick import QickSoc
+
+
+class FakeBlock:
+    """Stands in for a readout, generator, PFB or tProc driver: records the configuration calls it gets."""
+    HAS_OUTSEL = True
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return lambda *args: self.calls.append((name,) + args)
+
+
+class FakeAvgBuf:
+    def __init__(self):
+        self.readout = FakeBlock()
+
+
+def make_soc(tproc_version):
+    """A QickSoc with no hardware behind it, just the blocks that the configuration methods use."""
+    soc = object.__new__(QickSoc)
+    soc._applied = {}
+    soc._config_loads = Counter()
+    soc._config_skips = Counter()
+    soc.TPROC_VERSION = tproc_version
+    soc._tproc = FakeBlock()
+    soc.avg_bufs = [FakeAvgBuf(), FakeAvgBuf()]
+    soc.gens = [FakeBlock(), FakeBlock()]
+    soc.pfb_0 = FakeBlock()
+    return soc
+
+
+@pytest.fixture
+def soc():
+    return make_soc(1)
+
+
+def test_configure_readout(soc):
+    regs = {'freq': 100, 'mode': 'product'}
+    soc.configure_readout(0, regs)
+    soc.configure_readout(0, dict(regs))
+    # the configuration is per channel
+    soc.configure_readout(1, regs)
+    assert soc.avg_bufs[0].readout.calls == [('set_all_int', regs)]
+    assert len(soc.avg_bufs[1].readout.calls) == 1
+    # the applied configuration is copied, so changing the caller's dict is a change
+    regs['freq'] = 200
+    soc.configure_readout(0, regs)
+    assert soc.avg_bufs[0].readout.calls[-1] == ('set_all_int', {'freq': 200, 'mode': 'product'})
+    assert soc.get_config_stats() == {'applied': {'readout': 3}, 'skipped': {'readout': 1}}
+
+
+def test_config_mux(soc):
+    tones = [{'freq': 1, 'gain': 2}, {'freq': 3, 'gain': 4}]
+    soc.config_mux_gen(0, tones)
+    soc.config_mux_gen(0, [dict(t) for t in tones])
+    assert soc.gens[0].calls == [('set_tones_int', tones)]
+    cfgs = [{'ch': 0, 'freq': 5}]
+    soc.config_mux_readout('pfb_0', cfgs)
+    soc.config_mux_readout('pfb_0', cfgs)
+    # the output selection is part of the configuration
+    soc.config_mux_readout('pfb_0', cfgs, sel='input')
+    assert soc.pfb_0.calls == [('set_out', 'product'), ('set_freq_int', cfgs[0]),
+                               ('set_out', 'input'), ('set_freq_int', cfgs[0])]
+    assert soc.get_config_stats() == {'applied': {'mux_gen': 1, 'mux_readout': 2},
+                                      'skipped': {'mux_gen': 1, 'mux_readout': 1}}
+
+
+def test_load_bin_program_v1(soc):
+    binprog = [1, 2, 2**63 + 5]
+    soc.load_bin_program(binprog)
+    soc.load_bin_program(list(binprog))
+    assert soc.tproc.calls == [('load_bin_program', binprog)]
+    soc.load_bin_program(binprog, force=True)
+    soc.load_bin_program(binprog[:2])
+    assert len(soc.tproc.calls) == 3
+
+
+def test_load_bin_program_v2():
+    soc = make_soc(2)
+    binprog = {'pmem': [[1, 2], [3, 4]], 'wmem': [[5, 6]]}
+    soc.load_bin_program(binprog)
+    soc.load_bin_program(binprog)
+    # the wave memory is written every time
+    assert soc.tproc.calls == [('Load_PMEM', binprog['pmem']), ('load_mem', 3, binprog['wmem']),
+                               ('load_mem', 3, binprog['wmem'])]
+
+
+def test_invalidate_config(soc):
+    regs = {'freq': 100}
+    tones = [{'freq': 1}]
+
+    def apply_all():
+        soc.configure_readout(0, regs)
+        soc.config_mux_gen(0, tones)
+        soc.load_bin_program([1, 2, 3])
+
+    apply_all()
+    soc.reset_config_stats()
+    apply_all()
+    assert soc.get_config_stats() == {'applied': {}, 'skipped': {'readout': 1, 'mux_gen': 1, 'prog': 1}}
+    # forget one type of configuration
+    soc.invalidate_config('mux_gen')
+    soc.reset_config_stats()
+    apply_all()
+    assert soc.get_config_stats() == {'applied': {'mux_gen': 1}, 'skipped': {'readout': 1, 'prog': 1}}
+    # forget everything
+    soc.invalidate_config()
+    soc.reset_config_stats()
+    apply_all()
+    assert soc.get_config_stats() == {'applied': {'readout': 1, 'mux_gen': 1, 'prog': 1}, 'skipped': {}}
+    assert len(soc.avg_bufs[0].readout.calls) == 2
+    assert len(soc.gens[0].calls) == 3
+    assert len(soc.tproc.calls) == 2
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+# the drivers are only importable where pynq is
+pytest.importorskip("pynq")
+from qick.drivers.readout import AxisBufferDdrV1
+
+
+def make_buffer(maxlen, data_width=256, burst_size=16):
+    """An AxisBufferDdrV1 with no hardware behind it: the DDR4 memory is a plain array filled with random data.
+    Only the configuration that the read methods use is filled in."""
+    buf = object.__new__(AxisBufferDdrV1)
+    buf._cfg = {'type': 'axis_buffer_ddr_v1', 'fullpath': 'ddr4_buf', 'maxlen': maxlen}
+    buf.cfg['burst_len'] = data_width*burst_size//32
+    buf.cfg['junk_len'] = 50*data_width//32 + 1
+    buf.cfg['junk_nt'] = int(np.ceil(buf['junk_len']/buf['burst_len']))
+    rng = np.random.default_rng(0)
+    buf.ddr4_array = rng.integers(0, 2**32, maxlen, dtype=np.uint32)
+    return buf
+
+
+def iq(buf, start, end):
+    # the I,Q pairs stored in a range of samples
+    return buf.ddr4_array[start:end].view(np.int16).reshape((-1, 2))
+
+
+@pytest.fixture
+def buf():
+    return make_buffer(2**16)
+
+
+@pytest.mark.parametrize("start", [None, 0, 1, 1000, 1001])
+def test_get_mem(buf, start):
+    nt = 20
+    data = buf.get_mem(nt, start)
+    if start is None:
+        assert np.array_equal(data, iq(buf, buf['junk_len'], nt*buf['burst_len']))
+    else:
+        assert np.array_equal(data, iq(buf, start, start + nt*buf['burst_len']))
+    assert data.shape[0] == buf.mem_len(nt, start)
+
+
+@pytest.mark.parametrize("start", [None, 0, 1, 1001])
+@pytest.mark.parametrize("chunk_len", [2, 100, 1024, 2**16])
+def test_iter_mem(buf, start, chunk_len):
+    nt = 20
+    ref = buf.get_mem(nt, start)
+    offset = 0
+    chunks = []
+    for chunk_offset, data in buf.iter_mem(nt, start, chunk_len=chunk_len, copy=True):
+        assert chunk_offset == offset
+        assert 0 < data.shape[0] <= chunk_len
+        chunks.append(data)
+        offset += data.shape[0]
+    assert np.array_equal(np.concatenate(chunks), ref)
+
+
+def test_iter_mem_reuses_buffer(buf):
+    chunks = [data for offset, data in buf.iter_mem(20, chunk_len=256)]
+    assert len(chunks) > 2
+    # without copy, every chunk is a view of the same buffer
+    assert all(np.shares_memory(chunks[0], data) for data in chunks[1:])
+    # and none of them is a view of the memory, which could change under it
+    assert not any(np.shares_memory(buf.ddr4_array, data) for data in chunks)
+    with pytest.raises(RuntimeError):
+        next(buf.iter_mem(20, chunk_len=255))
+
+
+def test_read_mem_into(buf, tmp_path):
+    nt, start = 30, 1001
+    out = np.lib.format.open_memmap(str(tmp_path / "capture.npy"), mode='w+', dtype=np.int16,
+                                    shape=(buf.mem_len(nt, start), 2))
+    assert buf.read_mem_into(out, nt, start, chunk_len=1000) is out
+    out.flush()
+    assert np.array_equal(np.load(str(tmp_path / "capture.npy")), buf.get_mem(nt, start))
+
+
+@pytest.mark.parametrize("length, start", [(None, 0), (None, 5000), (3001, 7), (10, 0)])
+def test_clear_mem(buf, length, start):
+    orig = buf.ddr4_array.copy()
+    buf.clear_mem(length, start, chunk_len=1000)
+    end = buf['maxlen'] if length is None else start + length
+    assert not np.any(buf.ddr4_array[start:end])
+    assert np.array_equal(buf.ddr4_array[:start], orig[:start])
+    assert np.array_equal(buf.ddr4_array[end:], orig[end:])
+
+
+def segments_ref(buf, nt, n_segments, samples):
+    # segment i starts i*nt*burst_len samples after the junk
+    seg_len = nt*buf['burst_len']
+    return np.stack([iq(buf, buf['junk_len'] + i*seg_len, buf['junk_len'] + i*seg_len + samples)
+                     for i in range(n_segments)])
+
+
+def test_segments_nt(buf):
+    # the junk takes 401 samples, or 4 transfers of 128
+    assert buf['junk_nt'] == 4
+    assert buf.segments_nt(3, 10) == 34
+    assert buf.segments_nt(3, 10)*buf['burst_len'] >= buf['junk_len'] + 10*3*buf['burst_len']
+
+
+@pytest.mark.parametrize("samples", [None, 1, 100])
+def test_get_segments(buf, samples):
+    nt, n_segments = 2, 50
+    segs = buf.get_segments(nt, n_segments, samples)
+    if samples is None:
+        samples = nt*buf['burst_len']
+    assert segs.shape == (n_segments, samples, 2)
+    assert np.array_equal(segs, segments_ref(buf, nt, n_segments, samples))
+
+
+def test_get_segments_into(buf):
+    nt, n_segments = 2, 50
+    out = np.zeros((n_segments*nt*buf['burst_len'], 2), dtype=np.int16)
+    segs = buf.get_segments(nt, n_segments, samples=10, out=out)
+    assert np.shares_memory(segs, out)
+    assert np.array_equal(segs, segments_ref(buf, nt, n_segments, 10))
+    with pytest.raises(RuntimeError):
+        buf.get_segments(nt, n_segments, samples=nt*buf['burst_len'] + 1)
+
+
+@pytest.mark.parametrize("block_len", [None, 1, 256, 1000, 2**20])
+@pytest.mark.parametrize("samples", [None, 7])
+def test_sum_segments(buf, block_len, samples):
+    nt, n_segments = 2, 37
+    ref = segments_ref(buf, nt, n_segments, nt*buf['burst_len'] if samples is None else samples).astype(np.int64)
+    d_sum, d_sumsq = buf.sum_segments(nt, n_segments, samples, calc_var=True, block_len=block_len)
+    assert d_sum.dtype == np.int64
+    assert np.array_equal(d_sum, ref.sum(axis=0))
+    assert np.array_equal(d_sumsq, (ref**2).sum(axis=0))
+    d_sum, d_sumsq = buf.sum_segments(nt, n_segments, samples, block_len=block_len)
+    assert np.array_equal(d_sum, ref.sum(axis=0))
+    assert d_sumsq is None
+
+
+def test_sum_segments_narrow_bus():
+    # a narrower bus has shorter bursts and less junk; the junk length is odd, so every block read is unaligned
+    buf = make_buffer(2**14, data_width=128, burst_size=8)
+    assert (buf['burst_len'], buf['junk_len']) == (32, 201)
+    ref = segments_ref(buf, 3, 20, 3*buf['burst_len']).astype(np.int64)
+    d_sum, d_sumsq = buf.sum_segments(3, 20, calc_var=True, block_len=100)
+    assert np.array_equal(d_sum, ref.sum(axis=0))
+    assert np.array_equal(d_sumsq, (ref**2).sum(axis=0))
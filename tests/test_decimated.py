@@ -0,0 +1,184 @@
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from qick.qick_asm import AcquireMixin
+
+IQ_OFFSET = 0.5
+
+
+class DecProgram(AcquireMixin):
+    """Just the acquisition logic of a program, with one decimated readout: board configuration is skipped."""
+
+    def __init__(self, loop_dims, trigs, length, buf_maxlen):
+        self.dump_keys = []
+        super().__init__()
+        self.counter_addr = 1
+        self.loop_dims = list(loop_dims)
+        self.avg_level = 0
+        self.reads_per_shot = [trigs]
+        self.ro_chs = OrderedDict([(0, {'length': length, 'trigs': trigs, 'ro_config': {}})])
+        self.soccfg = {'readouts': [{'iq_offset': IQ_OFFSET, 'buf_maxlen': buf_maxlen}]}
+
+    def config_all(self, soc, load_pulses=True):
+        pass
+
+    def config_bufs(self, soc, enable_avg=True, enable_buf=True):
+        pass
+
+
+class FakeDecSoc:
+    """Stands in for a QickSoc: starting the tProc writes the next round of data into the decimated buffer,
+    at the address the buffer was configured with, and the decimated sums are kept as QickSoc keeps them."""
+
+    def __init__(self, data, buf_maxlen):
+        # decimated data for each round, with shape (rounds, samples, 2)
+        self.data = data
+        self.mem = np.zeros((buf_maxlen, 2), dtype=np.int16)
+        self.round = -1
+        self.events = []
+
+    def start_src(self, src):
+        pass
+
+    def config_buf(self, ch, address=0, length=1, enable=True):
+        self.address = address
+
+    def set_tproc_counter(self, addr, val):
+        pass
+
+    def start_tproc(self):
+        self.round += 1
+        self.events.append(('start', self.round, self.address))
+        self.mem[self.address:self.address+self.data.shape[1]] = self.data[self.round]
+
+    def get_tproc_counter(self, addr):
+        return 2**32
+
+    def get_accumulated(self, ch, address=0, length=None):
+        return np.zeros((length, 2), dtype=np.int32)
+
+    def clear_decimated_sum(self, ch, length, dtype=np.int64):
+        self.acc = np.zeros((length, 2), dtype=dtype)
+
+    def add_decimated(self, ch, address=0):
+        self.events.append(('add', address))
+        self.acc += self.mem[address:address+len(self.acc)]
+
+    def get_decimated_sum(self, ch):
+        return self.acc
+
+
+def run_decimated(loop_dims, trigs, length, buf_maxlen, soft_avgs, seed=0):
+    n_samples = int(np.prod(loop_dims))*trigs*length
+    rng = np.random.default_rng(seed)
+    data = rng.integers(-2**15, 2**15, (soft_avgs, n_samples, 2)).astype(np.int16)
+    soc = FakeDecSoc(data, buf_maxlen)
+    prog = DecProgram(loop_dims, trigs, length, buf_maxlen)
+    result = prog.acquire_decimated(soc, soft_avgs=soft_avgs, progress=False)
+    return result, data.mean(axis=0) - IQ_OFFSET, soc
+
+
+@pytest.mark.parametrize("loop_dims, trigs, shape", [([1], 1, (100, 2)),
+                                                     ([3], 1, (3, 100, 2)),
+                                                     ([1], 3, (3, 100, 2)),
+                                                     ([2, 3], 2, (6, 2, 100, 2))])
+def test_decimated_shape(loop_dims, trigs, shape):
+    result, ref, soc = run_decimated(loop_dims, trigs, 100, 4096, soft_avgs=3)
+    assert result[0].shape == shape
+    assert np.allclose(result[0].reshape((-1, 2)), ref)
+
+
+@pytest.mark.parametrize("soft_avgs", [1, 2, 5])
+def test_decimated_overlap(soft_avgs):
+    # two rounds fit in the buffer: alternate rounds use alternate halves, and each is transferred while the next runs
+    result, ref, soc = run_decimated([4], 1, 100, 1000, soft_avgs)
+    assert np.allclose(result[0].reshape((-1, 2)), ref)
+    expected = [('start', 0, 0)]
+    for ir in range(1, soft_avgs):
+        expected += [('start', ir, 500*(ir % 2)), ('add', 500*((ir-1) % 2))]
+    expected.append(('add', 500*((soft_avgs-1) % 2)))
+    assert soc.events == expected
+
+
+def test_decimated_no_overlap():
+    # only one round fits, so each round is transferred before the next one starts
+    result, ref, soc = run_decimated([4], 1, 200, 1000, soft_avgs=3)
+    assert np.allclose(result[0].reshape((-1, 2)), ref)
+    assert soc.events == [('start', 0, 0), ('add', 0), ('start', 1, 0), ('add', 0), ('start', 2, 0), ('add', 0)]
+    with pytest.raises(RuntimeError):
+        run_decimated([4], 1, 300, 1000, soft_avgs=1)
+
+
+def test_decimated_sum_dtype():
+    # full-scale data summed over many rounds overflows int16, but not the accumulator
+    result, ref, soc = run_decimated([1], 1, 10, 1000, soft_avgs=300)
+    assert soc.acc.dtype == np.int32
+    assert np.max(np.abs(soc.acc)) > 2**15
+    assert np.allclose(result[0], ref)
+
+
+class FakeSwitch:
+    def sel(self, slv=None, mst=None):
+        pass
+
+
+class FakeDmaChannel:
+    """Stands in for the receive channel of the raw-buffer DMA: a transfer copies samples out of the simulated
+    decimated buffer memory (wrapping around), starting at the address the buffer's reader was set to."""
+
+    def __init__(self, buf, mem):
+        self.buf = buf
+        self.mem = mem
+
+    def transfer(self, buff, nbytes):
+        n = nbytes//4
+        idx = (self.buf.buf_dr_addr_reg + np.arange(n)) % len(self.mem)
+        buff[:n] = self.mem[idx]
+        self.transferred = nbytes
+
+    def wait(self):
+        pass
+
+
+class FakeDma:
+    def __init__(self, recvchannel):
+        self.recvchannel = recvchannel
+
+
+@pytest.fixture
+def dec_soc():
+    pytest.importorskip("pynq")
+    from qick.qick import QickSoc
+    from qick.drivers.readout import AxisAvgBuffer
+
+    maxlen = 1024
+    buf = object.__new__(AxisAvgBuffer)
+    buf._cfg = {'type': 'axis_avg_buffer', 'fullpath': 'avg_buf_0', 'buf_maxlen': maxlen}
+    buf.switch_buf = FakeSwitch()
+    buf.switch_ch = 0
+    buf.buf_buff = np.zeros(maxlen, dtype=np.int32)
+    rng = np.random.default_rng(0)
+    buf.dma_buf = FakeDma(FakeDmaChannel(buf, rng.integers(-2**31, 2**31, maxlen).astype(np.int32)))
+
+    soc = object.__new__(QickSoc)
+    soc.avg_bufs = [buf]
+    soc._dec_sums = {}
+    return soc
+
+
+def test_decimated_sum(dec_soc):
+    mem = dec_soc.avg_bufs[0].dma_buf.recvchannel.mem.view(np.int16).reshape((-1, 2))
+    for length in [1, 100, 101]:
+        for dtype in [np.int32, np.int64]:
+            dec_soc.clear_decimated_sum(0, length, dtype=dtype)
+            ref = np.zeros((length, 2), dtype=np.int64)
+            for address in [0, 1, 500, 1024-length-1]:
+                d = dec_soc.get_decimated(0, address, length)
+                assert np.array_equal(d, mem[address:address+length])
+                ref += d
+                dec_soc.add_decimated(0, address)
+            total = dec_soc.get_decimated_sum(0)
+            assert total.dtype == dtype
+            assert np.array_equal(total, ref)
@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+
+from qick.drivers.dma_pool import DmaBufferPool
+
+
+class StubBuffer(np.ndarray):
+    """Stands in for a pynq buffer: a plain array that records whether it was freed."""
+    freed = False
+
+    def freebuffer(self):
+        self.freed = True
+
+
+class StubAllocator:
+    def __init__(self):
+        self.buffers = []
+
+    def __call__(self, shape, dtype):
+        buff = np.zeros(shape, dtype=dtype).view(StubBuffer)
+        self.buffers.append(buff)
+        return buff
+
+
+@pytest.fixture
+def alloc():
+    return StubAllocator()
+
+
+@pytest.fixture
+def pool(alloc):
+    return DmaBufferPool(allocator=alloc)
+
+
+def test_get_shape_and_dtype(pool, alloc):
+    buff = pool.get((100, 8), np.int32)
+    assert buff.shape == (100, 8)
+    assert buff.dtype == np.int32
+    assert np.shares_memory(buff, alloc.buffers[0])
+    buff = pool.get(10, np.int16)
+    assert buff.shape == (10,)
+
+
+def test_put_and_reuse(pool, alloc):
+    buff = pool.get(1000, np.int32)
+    buff[:] = 5
+    pool.put(buff)
+    # a different request in the same size class reuses the buffer
+    buff2 = pool.get((500, 2), np.int32)
+    assert len(alloc.buffers) == 1
+    assert np.shares_memory(buff2, alloc.buffers[0])
+    stats = pool.get_stats()
+    assert stats['n_alloc'] == 1
+    assert stats['n_reuse'] == 1
+
+
+def test_no_reuse_while_in_use(pool, alloc):
+    buff1 = pool.get(1000, np.int32)
+    buff2 = pool.get(1000, np.int32)
+    assert len(alloc.buffers) == 2
+    assert not np.shares_memory(buff1, buff2)
+
+
+def test_borrow(pool, alloc):
+    with pool.borrow(1000, np.int32) as buff:
+        assert pool.get_stats()['in_use_bytes'] > 0
+        buff[:] = 1
+    assert pool.get_stats()['in_use_bytes'] == 0
+    with pool.borrow(1000, np.int32) as buff:
+        pass
+    assert len(alloc.buffers) == 1
+
+
+def test_borrow_returns_buffer_on_error(pool):
+    with pytest.raises(RuntimeError):
+        with pool.borrow(1000, np.int32):
+            raise RuntimeError()
+    stats = pool.get_stats()
+    assert stats['in_use_bytes'] == 0
+    assert sum(stats['free'].values()) == 1
+
+
+@pytest.mark.parametrize("nbytes", [1, 100, 4096, 5000, 2**16, 2**20 + 1, 3*2**20 + 7])
+def test_size_class_rounding(pool, nbytes):
+    size = pool._size_class(nbytes)
+    assert size >= nbytes
+    assert size >= pool.MIN_SIZE
+    if nbytes > pool.MIN_SIZE:
+        # at most one class step (plus the slack) is wasted
+        step = 2**int(np.log2(nbytes)) // pool.CLASSES_PER_OCTAVE
+        assert size - nbytes < step + pool.SLACK
+    else:
+        assert size == pool.MIN_SIZE + pool.SLACK
+    # every request that rounds to a class fits in that class, and the class maps to itself
+    assert pool._size_class(size) == size
+
+
+def test_size_class_padding(pool):
+    # the averager buffers are a power of 2 plus 2 samples of padding; they must not spill into the next class
+    for n_avg in range(10, 17):
+        nbytes = (2**n_avg + 2)*np.dtype(np.int64).itemsize
+        assert pool._size_class(nbytes) == 2**n_avg*8 + pool.SLACK
+
+
+def test_size_classes_are_shared(pool, alloc):
+    buff = pool.get(5000, np.uint8)
+    pool.put(buff)
+    pool.get(pool._size_class(5000) - 1, np.uint8)
+    assert len(alloc.buffers) == 1
+    pool.get(pool._size_class(5000) + 1, np.uint8)
+    assert len(alloc.buffers) == 2
+
+
+def test_clear(pool, alloc):
+    kept = pool.get(1000, np.int32)
+    pool.put(pool.get(2**16, np.int32))
+    pool.put(pool.get(2**16, np.int32))
+    pool.put(pool.get(100, np.int64))
+    stats = pool.get_stats()
+    assert stats['pooled_bytes'] == sum(b.nbytes for b in alloc.buffers)
+    pool.clear()
+    stats = pool.get_stats()
+    assert stats['free'] == {}
+    assert stats['pooled_bytes'] == stats['in_use_bytes']
+    assert [b.freed for b in alloc.buffers] == [False, True, True]
+    # buffers in use are not affected
+    pool.put(kept)
+    assert pool.get_stats()['free'] == {pool._size_class(4000): 1}
+
+
+def test_get_stats(pool):
+    stats = pool.get_stats()
+    assert stats == {'n_alloc': 0, 'n_reuse': 0, 'in_use_bytes': 0, 'high_water_bytes': 0,
+                     'pooled_bytes': 0, 'free': {}}
+    a = pool.get(1000, np.int32)
+    b = pool.get(2**16, np.int32)
+    size_a, size_b = pool._size_class(4000), pool._size_class(2**18)
+    stats = pool.get_stats()
+    assert stats['in_use_bytes'] == size_a + size_b
+    assert stats['high_water_bytes'] == size_a + size_b
+    pool.put(b)
+    pool.put(a)
+    pool.get(1000, np.int32)
+    stats = pool.get_stats()
+    assert stats['n_alloc'] == 2
+    assert stats['n_reuse'] == 1
+    assert stats['in_use_bytes'] == size_a
+    assert stats['high_water_bytes'] == size_a + size_b
+    assert stats['pooled_bytes'] == size_a + size_b
+    assert stats['free'] == {size_b: 1}
+    pool.reset_stats()
+    stats = pool.get_stats()
+    assert stats['n_alloc'] == 0
+    assert stats['high_water_bytes'] == size_a
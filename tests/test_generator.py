@@ -0,0 +1,164 @@
+import numpy as np
+import pytest
+
+# the drivers are only importable where pynq is
+pytest.importorskip("pynq")
+from qick.drivers.generator import AbsArbSignalGen
+
+MAX_LENGTH = 1024
+
+
+class FakeSwitch:
+    def sel(self, slv=None, mst=None):
+        pass
+
+
+class FakeDmaChannel:
+    """Stands in for the send channel of the waveform DMA: a transfer writes to the simulated waveform memory,
+    starting at the address the generator's write-enable was set up with."""
+
+    def __init__(self, gen):
+        self.gen = gen
+        self.mem = np.zeros(MAX_LENGTH, dtype=np.int32)
+        # (address, length) of each transfer
+        self.transfers = []
+
+    def transfer(self, buff, nbytes):
+        assert self.gen.we_reg == 1
+        start, n = self.gen.start_addr_reg, nbytes//4
+        self.mem[start:start+n] = buff[:n]
+        self.transfers.append((start, n))
+
+    def wait(self):
+        pass
+
+
+class FakeDma:
+    def __init__(self, sendchannel):
+        self.sendchannel = sendchannel
+
+
+@pytest.fixture
+def gen():
+    """An arbitrary-waveform generator with no hardware behind it: the DMA writes to a simulated waveform memory."""
+    gen = object.__new__(AbsArbSignalGen)
+    gen.MAX_LENGTH = MAX_LENGTH
+    gen.buff = np.zeros(MAX_LENGTH, dtype=np.int32)
+    gen.env_cache = {}
+    gen.env_loads = 0
+    gen.env_skips = 0
+    gen.switch = FakeSwitch()
+    gen.switch_ch = 0
+    gen.dma = FakeDma(FakeDmaChannel(gen))
+    return gen
+
+
+def make_env(length, seed):
+    rng = np.random.default_rng(seed)
+    return rng.integers(-2**15, 2**15, (length, 2)).astype(np.int16)
+
+
+def mem_env(gen, addr, length):
+    # the envelope stored in the waveform memory
+    return gen.dma.sendchannel.mem[addr:addr+length].view(np.int16).reshape((-1, 2))
+
+
+def test_load_skip(gen):
+    env = make_env(100, 0)
+    gen.load(env, addr=10)
+    gen.load(env.copy(), addr=10)
+    assert gen.dma.sendchannel.transfers == [(10, 100)]
+    assert (gen.env_loads, gen.env_skips) == (1, 1)
+    assert np.array_equal(mem_env(gen, 10, 100), env)
+    # different data, a different length, or a different address is loaded
+    env2 = env.copy()
+    env2[50, 1] += 1
+    gen.load(env2, addr=10)
+    gen.load(env2[:99], addr=10)
+    gen.load(env2[:99], addr=11)
+    assert gen.dma.sendchannel.transfers == [(10, 100), (10, 100), (10, 99), (11, 99)]
+    assert np.array_equal(mem_env(gen, 11, 99), env2[:99])
+
+
+def test_load_force(gen):
+    env = make_env(100, 0)
+    gen.load(env)
+    gen.load(env, force=True)
+    assert len(gen.dma.sendchannel.transfers) == 2
+    gen.invalidate_envelopes()
+    gen.load(env)
+    assert len(gen.dma.sendchannel.transfers) == 3
+    gen.load(env)
+    assert len(gen.dma.sendchannel.transfers) == 3
+
+
+def test_load_overwrite(gen):
+    env_a, env_b, env_c = make_env(100, 0), make_env(100, 1), make_env(100, 2)
+    gen.load(env_a, addr=0)
+    gen.load(env_b, addr=100)
+    gen.load(env_c, addr=300)
+    # an envelope that overlaps the first two evicts them, but not the third
+    gen.load(make_env(100, 3), addr=50)
+    assert sorted(gen.env_cache) == [50, 300]
+    n = len(gen.dma.sendchannel.transfers)
+    gen.load(env_c, addr=300)
+    assert len(gen.dma.sendchannel.transfers) == n
+    gen.load(env_a, addr=0)
+    gen.load(env_b, addr=100)
+    assert len(gen.dma.sendchannel.transfers) == n + 2
+    assert np.array_equal(mem_env(gen, 0, 100), env_a)
+    assert np.array_equal(mem_env(gen, 100, 100), env_b)
+    # the overlapping envelope was partly overwritten, and was evicted
+    assert sorted(gen.env_cache) == [0, 100, 300]
+
+
+def test_load_too_long(gen):
+    with pytest.raises(RuntimeError):
+        gen.load(make_env(100, 0), addr=MAX_LENGTH-99)
+    assert gen.env_cache == {}
+
+
+def test_soc_pulse_cache(gen):
+    from qick.qick import QickSoc
+    soc = object.__new__(QickSoc)
+    # a generator without a waveform memory has no stats
+    soc.gens = [gen, object()]
+    env = make_env(100, 0)
+    soc.load_pulse_data(0, env, addr=0)
+    soc.load_pulse_data(0, env, addr=0)
+    assert soc.get_pulse_cache_stats() == [{'loads': 1, 'skips': 1, 'resident': 1}, None]
+    soc.invalidate_pulse_cache()
+    soc.load_pulse_data(0, env, addr=0)
+    assert soc.get_pulse_cache_stats()[0] == {'loads': 2, 'skips': 1, 'resident': 1}
+
+
+def test_load_batch_contiguous(gen):
+    lengths = [16, 100, 3, 50, 200]
+    addrs = np.cumsum([0] + lengths[:-1]) + 8
+    envs = [(make_env(length, i), addr) for i, (length, addr) in enumerate(zip(lengths, addrs))]
+    # contiguous envelopes are loaded with one DMA, whatever order they're given in
+    gen.load_batch(envs[::-1])
+    assert gen.dma.sendchannel.transfers == [(8, sum(lengths))]
+    assert gen.env_loads == len(envs)
+    for env, addr in envs:
+        assert np.array_equal(mem_env(gen, addr, env.shape[0]), env)
+
+
+def test_load_batch_blocks(gen):
+    envs = [(make_env(100, 0), 0), (make_env(100, 1), 100), (make_env(50, 2), 300), (make_env(50, 3), 350),
+            (make_env(10, 4), 500)]
+    gen.load_batch(envs)
+    # one DMA for each block of contiguous envelopes
+    assert gen.dma.sendchannel.transfers == [(0, 200), (300, 100), (500, 10)]
+    for env, addr in envs:
+        assert np.array_equal(mem_env(gen, addr, env.shape[0]), env)
+    # envelopes that are already loaded split the blocks
+    envs[0] = (make_env(100, 5), 0)
+    envs[3] = (make_env(50, 6), 350)
+    gen.load_batch(envs)
+    assert gen.dma.sendchannel.transfers[3:] == [(0, 100), (350, 50)]
+    assert (gen.env_loads, gen.env_skips) == (7, 3)
+    for env, addr in envs:
+        assert np.array_equal(mem_env(gen, addr, env.shape[0]), env)
+    gen.load_batch(envs, force=True)
+    assert gen.dma.sendchannel.transfers[5:] == [(0, 200), (300, 100), (500, 10)]
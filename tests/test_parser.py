@@ -0,0 +1,108 @@
+import json
+import os
+
+import pytest
+
+from qick.parser import parse_prog, parse_to_bin
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# ASM programs in the repo, by name in the reference file
+ASM_FILES = {'01_phase_calibration': os.path.join(ROOT, 'qick_demos', '01_phase_calibration.asm'),
+             'tproc_v1_prog': os.path.join(ROOT, 'firmware', 'ip', 'axis_tproc64x32_x8_v1', 'src', 'soft', 'prog.asm')}
+
+
+def generate_prog(n_blocks=20):
+    """A program that uses every instruction and syntax variant, with a spread of argument values.
+    The "bitw p, $ra, ~$rb" form is left out, since the original parser couldn't parse it (see test_bitw_not)."""
+    lines = ["// generated program", ""]
+    for i in range(n_blocks):
+        p = i % 8
+        ch = (i*3) % 8
+        r = [(i*5 + k*7) % 32 for k in range(8)]
+        imm = [0, 1, -1, 12345, -12345, 2**30 - 1, -2**30, 999][i % 8]
+        hexval = ["0x0", "0x1f", "0x7fffffff", "0xabc", "0xABC", "0x10", "0x4", "0x123456"][i % 8]
+        t = (i*37) % 1000
+        lines += [
+            "LOOP_%d: pushi %d, $%d, $%d, %d;" % (i, p, r[0], r[1], imm),
+            "    popi %d, $%d;" % (p, r[2]),
+            "    mathi %d, $%d, $%d %s %d;" % (p, r[0], r[1], "+-*"[i % 3], abs(imm) % 1000),
+            "    mathi %d, $%d, $%d + %s;" % (p, r[0], r[1], hexval),
+            "    seti %d, %d, $%d, %d;" % (ch, p, r[3], t),
+            "    synci %d;" % t,
+            "    waiti %d, %d;" % (ch, t),
+            "    bitwi %d, $%d, $%d %s %d;" % (p, r[1], r[2], ["&", "|", "^", "<<", ">>"][i % 5], i % 32),
+            "    bitwi %d, $%d, ~%s;" % (p, r[3], hexval),
+            "    memri %d, $%d, %d;" % (p, r[4], i*11),
+            "    memwi %d, $%d, %s;" % (p, r[5], hexval),
+            "    regwi %d, $%d, %d;" % (p, r[6], imm),
+            "    regwi %d, $%d, %s;" % (p, r[7], hexval),
+            "    setbi %d, %d, $%d, %d;" % (ch, p, r[0], t),
+            "    math %d, $%d, $%d %s $%d;" % (p, r[0], r[1], "+-*"[i % 3], r[2]),
+            "    set %d, %d, $%s;" % (ch, p, ", $".join(str(x) for x in r[:6])),
+            "    sync %d, $%d;" % (p, r[3]),
+            "    read %d, %d, %s $%d;" % (ch, p, ["upper", "lower"][i % 2], r[4]),
+            "    wait %d, %d, $%d;" % (ch, p, r[5]),
+            "    bitw %d, $%d, $%d %s $%d;" % (p, r[0], r[1], ["&", "|", "^", "<<", ">>"][i % 5], r[2]),
+            "    memr %d, $%d, $%d;" % (p, r[5], r[6]),
+            "    memw %d, $%d, $%d;" % (p, r[7], r[0]),
+            "    setb %d, %d, $%s;" % (ch, p, ", $".join(str(x) for x in r[2:8])),
+            "    condj %d, $%d %s $%d, @LOOP_%d;" % (p, r[1], [">", ">=", "<", "<=", "==", "!="][i % 6], r[2], (i*7) % n_blocks),
+            "    loopnz %d, $%d, @LOOP_%d;" % (p, r[3], i),
+            "",
+        ]
+    lines.append("end;")
+    return "\n".join(lines) + "\n"
+
+
+@pytest.fixture(scope="module")
+def reference():
+    # machine code from the original parser, in the "hex" output format of parse_prog()
+    with open(os.path.join(HERE, 'data', 'parser_reference.json')) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def generated_asm(tmp_path):
+    path = tmp_path / "generated.asm"
+    path.write_text(generate_prog())
+    return str(path)
+
+
+def check_prog(path, ref):
+    hexprog = parse_prog(path, outfmt="hex")
+    assert [hexprog[i] for i in range(len(hexprog))] == ref
+    binprog = parse_prog(path, outfmt="bin")
+    assert [int(binprog[i], 2) for i in range(len(binprog))] == parse_to_bin(path)
+    assert parse_to_bin(path) == [int(line.split()[0], 16) for line in ref]
+
+
+@pytest.mark.parametrize("name", list(ASM_FILES))
+def test_repo_programs(name, reference):
+    check_prog(ASM_FILES[name], reference[name])
+
+
+def test_generated_program(generated_asm, reference):
+    check_prog(generated_asm, reference['generated'])
+
+
+def test_bitw_not(tmp_path):
+    path = tmp_path / "not.asm"
+    path.write_text("bitw 1, $2, ~$3;\nend;\n")
+    # the operand goes in rc, as for the other bitw operations
+    assert parse_to_bin(str(path))[0] == (0b01010101 << 56) | (1 << 53) | (0b0011 << 46) | (2 << 41) | (3 << 31)
+
+
+def test_unknown_symbol(tmp_path):
+    path = tmp_path / "bad.asm"
+    path.write_text("loopnz 0, $1, @NOWHERE;\nend;\n")
+    with pytest.raises(RuntimeError):
+        parse_to_bin(str(path))
+
+
+def test_unknown_operation(tmp_path):
+    path = tmp_path / "bad.asm"
+    path.write_text("bitwi 0, $1, $2 && 3;\nend;\n")
+    with pytest.raises(RuntimeError):
+        parse_to_bin(str(path))
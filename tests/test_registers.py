@@ -0,0 +1,100 @@
+import pytest
+
+from qick import __version__
+from qick.helpers import RegisterAllocator
+from qick.qick_asm import QickConfig
+from qick.asm_v1 import QickProgram, QickRegisterManagerMixin
+from qick.asm_v2 import QickProgramV2, QickSweepRaw
+
+
+class RegProgram(QickRegisterManagerMixin, QickProgram):
+    pass
+
+
+def make_soccfg(tproc):
+    return QickConfig({'tprocs': [tproc], 'gens': [], 'readouts': [], 'iqs': [],
+                       'sw_version': __version__, 'board': 'ZCU216', 'refclk_freq': 245.76})
+
+
+@pytest.fixture
+def soccfg_v1():
+    return make_soccfg({'type': 'axis_tproc64x32_x8', 'f_time': 430.08, 'pmem_size': 2**16, 'dmem_size': 4096,
+                        'output_pins': [], 'start_pin': None, 'trig_output': 0, 'revision': 1})
+
+
+@pytest.fixture
+def soccfg_v2():
+    return make_soccfg({'type': 'qick_processor', 'revision': 20, 'dreg_qty': 16, 'f_time': 430.08, 'f_core': 200.0,
+                        'pmem_size': 2**12, 'dmem_size': 4096, 'wmem_size': 1024,
+                        'output_pins': [], 'start_pin': None, 'trig_output': 0})
+
+
+def test_allocator():
+    regs = RegisterAllocator(70, start=3)
+    assert regs.get_stats() == {'size': 67, 'used': 0, 'free': 67}
+    # reserved addresses count as in use, but not in the stats
+    assert 0 in regs and 2 in regs and 3 not in regs
+    assert regs.first_free() == 3
+    for addr in [3, 4, 6]:
+        regs.add(addr)
+    assert regs.first_free() == 5
+    regs.add(5)
+    assert regs.first_free() == 7
+    # addresses past 64 bits
+    for addr in range(7, 70):
+        assert regs.first_free() == addr
+        regs.add(addr)
+    assert regs.first_free() is None
+    assert regs.get_stats() == {'size': 67, 'used': 67, 'free': 0}
+    regs.free(4)
+    assert 4 not in regs
+    assert regs.first_free() == 4
+    assert regs.get_stats() == {'size': 67, 'used': 66, 'free': 1}
+    with pytest.raises(RuntimeError):
+        regs.free(4)
+    with pytest.raises(RuntimeError):
+        regs.free(1)
+
+
+def test_v1_page_registers(soccfg_v1):
+    prog = RegProgram(soccfg_v1)
+    # addresses 1-12 of each page, allocated in order, with explicit addresses skipped
+    prog.new_reg(2, addr=2)
+    regs = [prog.new_reg(2) for i in range(11)]
+    assert [reg.addr for reg in regs] == [1] + list(range(3, 13))
+    with pytest.raises(RuntimeError):
+        prog.new_reg(2)
+    with pytest.raises(ValueError):
+        prog.new_reg(3, addr=13)
+    # pages are independent
+    assert prog.new_reg(3).addr == 1
+    with pytest.raises(ValueError):
+        prog.new_reg(3, addr=1)
+    with pytest.raises(NameError):
+        prog.new_reg(4, name=regs[0].name)
+    assert prog.get_reg_stats() == {2: {'size': 12, 'used': 12, 'free': 0},
+                                    3: {'size': 12, 'used': 1, 'free': 11},
+                                    4: {'size': 12, 'used': 0, 'free': 12}}
+
+
+def test_v2_sweep_registers(soccfg_v2):
+    prog = QickProgramV2(soccfg_v2)
+    reg = prog.new_reg(addr=0)
+    # identical sweeps share a register, and sweeps that differ in any way don't
+    a = prog._get_sweep_reg(QickSweepRaw('freq', 5, {'loop1': 10}))
+    b = prog._get_sweep_reg(QickSweepRaw('gain', 5, {'loop1': 10}))
+    assert a is b
+    assert a.addr == 1
+    others = [prog._get_sweep_reg(QickSweepRaw('freq', 6, {'loop1': 10})),
+              prog._get_sweep_reg(QickSweepRaw('freq', 5, {'loop1': 11})),
+              prog._get_sweep_reg(QickSweepRaw('freq', 5, {'loop2': 10})),
+              prog._get_sweep_reg(QickSweepRaw('freq', 5, {'loop1': 10}, quantize=2)),
+              prog._get_sweep_reg(QickSweepRaw('freq', 5, {'loop1': 10, 'loop2': 10}))]
+    assert [r.addr for r in others] == [2, 3, 4, 5, 6]
+    # the order of the loops doesn't matter
+    assert prog._get_sweep_reg(QickSweepRaw('freq', 5, {'loop2': 10, 'loop1': 10})) is others[-1]
+    assert prog.get_reg_stats() == {'size': 16, 'used': 7, 'free': 9, 'shared': 2}
+    with pytest.raises(ValueError):
+        prog.new_reg(addr=reg.addr)
+    with pytest.raises(ValueError):
+        prog.new_reg(addr=16)
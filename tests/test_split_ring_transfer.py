@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from qick.helpers import split_ring_transfer
+
+
+def simulate(address, length, maxlen):
+    """Run the transfers planned by split_ring_transfer() on a fake ring buffer, checking the DMA constraints."""
+    ring = np.arange(maxlen)
+    dma = np.full(maxlen+2, -1)
+    segments, start = split_ring_transfer(address, length, maxlen)
+    assert 1 <= len(segments) <= 2
+    for seg_addr, transferlen, offset in segments:
+        assert transferlen % 2 == 0
+        assert 0 <= seg_addr and seg_addr + transferlen <= maxlen
+        assert offset + transferlen <= maxlen + 2
+        dma[offset:offset+transferlen] = ring[seg_addr:seg_addr+transferlen]
+    return dma[start:start+length]
+
+
+def expected(address, length, maxlen):
+    return (address + np.arange(length)) % maxlen
+
+
+def test_odd_length_wrap():
+    # the first segment (addresses 13-15) has odd length and ends at the end of the buffer
+    maxlen = 16
+    segments, start = split_ring_transfer(13, 8, maxlen)
+    assert segments == [(12, 4, 0), (0, 6, 4)]
+    assert start == 1
+    assert np.array_equal(simulate(13, 8, maxlen), expected(13, 8, maxlen))
+
+
+def test_even_length_wrap():
+    segments, start = split_ring_transfer(12, 8, 16)
+    assert segments == [(12, 4, 0), (0, 4, 4)]
+    assert start == 0
+
+
+def test_no_wrap():
+    assert split_ring_transfer(3, 5, 16) == ([(3, 6, 0)], 0)
+    # an odd read that ends at the end of the buffer can't be padded at its end
+    assert split_ring_transfer(11, 5, 16) == ([(10, 6, 0)], 1)
+
+
+@pytest.mark.parametrize("maxlen", [16, 32])
+def test_all_reads(maxlen):
+    for address in range(maxlen):
+        for length in range(1, maxlen):
+            assert np.array_equal(simulate(address, length, maxlen), expected(address, length, maxlen))
@@ -0,0 +1,170 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from qick.streamer import DataStreamer, ProcessDataStreamer
+
+MAX_LENGTH = 1000
+
+
+class FakeSoc:
+    """Stands in for a QickSoc: the tProc counter advances by a few shots per poll
+    (so the total number of shots in a readout must be a multiple of that),
+    and each transfer returns the buffer addresses it read, so the data shows which samples were transferred."""
+
+    def __init__(self, n_ch=3, shots_per_poll=7):
+        self.avg_bufs = [None]*n_ch
+        self.shots_per_poll = shots_per_poll
+        self.counter = 0
+        self.addresses = {}
+
+    def get_avg_max_length(self, ch):
+        return MAX_LENGTH
+
+    def plan_avg_transfers(self, ch_list):
+        return [[i] for i in range(len(ch_list))]
+
+    def set_tproc_counter(self, addr, val):
+        self.counter = val
+
+    def get_tproc_counter(self, addr):
+        self.counter += self.shots_per_poll
+        return self.counter
+
+    def start_tproc(self):
+        pass
+
+    def start_src(self, src):
+        pass
+
+    def start_accumulated(self, ch, address, length, buff_idx=None):
+        self.addresses[ch] = address
+
+    def finish_accumulated(self, ch, length, out=None):
+        if out is None:
+            out = np.zeros((length, 2), dtype=np.int32)
+        out[:, 0] = self.addresses[ch] + np.arange(length)
+        out[:, 1] = ch
+        return out
+
+
+def start_readout(streamer, total_shots, ch_list, reads_per_shot, zero_copy):
+    # the same steps as QickSoc.start_readout()
+    if streamer.readout_worker is None:
+        streamer.start_worker()
+    streamer.stop_flag.clear()
+    streamer.total_count = total_shots
+    streamer.count = 0
+    streamer.alloc_bufs(ch_list, zero_copy)
+    streamer.reset_bufs(zero_copy)
+    streamer.done_flag.clear()
+    streamer.job_queue.put((total_shots, 1, ch_list, reads_per_shot, 5, zero_copy))
+
+
+def read_all(streamer):
+    # the same steps as QickSoc.poll_data(), until all the data has arrived
+    chunks = []
+    while streamer.count < streamer.total_count:
+        streamer.release_bufs()
+        length, data = streamer.data_queue.get(timeout=10)
+        assert streamer.error_queue.empty()
+        streamer.count += length
+        d_buf = streamer.unpack_data(data[0])
+        streamer.hold_buf()
+        # copy the data before releasing the buffer it may point into
+        chunks.append((length, [d.copy() for d in d_buf], data[1]))
+    streamer.release_bufs()
+    assert streamer.done_flag.wait(timeout=10)
+    return chunks
+
+
+def check_data(chunks, total_shots, ch_list, reads_per_shot):
+    assert sum(length for length, _, _ in chunks) == total_shots
+    for i, (ch, nreads) in enumerate(zip(ch_list, reads_per_shot)):
+        d = np.concatenate([d_buf[i] for _, d_buf, _ in chunks])
+        assert np.array_equal(d[:, 0], np.arange(total_shots*nreads))
+        assert np.all(d[:, 1] == ch)
+    # stats: (time, shots, address, newshots, stride)
+    stats = [s for _, _, s in chunks]
+    assert all(len(s) == 5 for s in stats)
+    assert [s[3] for s in stats] == [length for length, _, _ in chunks]
+    assert stats[-1][1] == total_shots
+
+
+needs_fork = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),
+                                reason="ProcessDataStreamer needs the fork start method")
+
+
+@pytest.fixture
+def process_streamer():
+    streamer = ProcessDataStreamer(FakeSoc())
+    yield streamer
+    streamer.close()
+
+
+def test_thread_streamer():
+    streamer = DataStreamer(FakeSoc())
+    ch_list, reads_per_shot = [0, 2], [1, 3]
+    start_readout(streamer, 98, ch_list, reads_per_shot, zero_copy=False)
+    check_data(read_all(streamer), 98, ch_list, reads_per_shot)
+    streamer.close()
+
+
+@needs_fork
+@pytest.mark.parametrize("zero_copy", [False, True])
+def test_process_streamer(process_streamer, zero_copy):
+    ch_list, reads_per_shot = [0, 2], [1, 3]
+    # the worker is forked on the first readout, and reused for later ones
+    assert process_streamer.readout_worker is None
+    start_readout(process_streamer, 98, ch_list, reads_per_shot, zero_copy)
+    check_data(read_all(process_streamer), 98, ch_list, reads_per_shot)
+    worker = process_streamer.readout_worker
+    assert worker.is_alive()
+    start_readout(process_streamer, 63, ch_list, reads_per_shot, zero_copy)
+    check_data(read_all(process_streamer), 63, ch_list, reads_per_shot)
+    assert process_streamer.readout_worker is worker
+
+
+@needs_fork
+def test_process_streamer_ring(process_streamer):
+    process_streamer.start_worker()
+    process_streamer.reset_bufs(zero_copy=True)
+    assert process_streamer.ring.shape == (process_streamer.N_ZEROCOPY_BUFS, 3*2*MAX_LENGTH)
+    # the readout loop packs a buffer index and lengths, and the data is unpacked as views into the ring
+    packed = process_streamer._pack_data(None, [1, 2], [10, 20], 3)
+    assert packed == (3, [1, 2], [10, 20])
+    process_streamer._ring_view(3, 1, 10)[:] = 5
+    d_buf = process_streamer.unpack_data(packed)
+    assert [d.shape for d in d_buf] == [(10, 2), (20, 2)]
+    assert np.all(d_buf[0] == 5)
+    assert np.shares_memory(d_buf[0], process_streamer.ring)
+    # without zero-copy, the data is copied out and the buffer is given back
+    process_streamer.reset_bufs(zero_copy=False)
+    for i in range(process_streamer.N_ZEROCOPY_BUFS):
+        assert process_streamer.free_bufs.acquire(False)
+    d_buf = process_streamer.unpack_data(packed)
+    assert not np.shares_memory(d_buf[0], process_streamer.ring)
+    assert np.all(d_buf[0] == 5)
+    assert process_streamer.free_bufs.acquire(False)
+
+
+@needs_fork
+def test_process_streamer_close(process_streamer):
+    start_readout(process_streamer, 21, [0], [1], zero_copy=False)
+    read_all(process_streamer)
+    name = process_streamer.shm.name
+    worker = process_streamer.readout_worker
+    process_streamer.close()
+    assert not worker.is_alive()
+    assert process_streamer.readout_worker is None
+    assert process_streamer.shm is None
+    # the shared memory was unlinked
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+    # closing again does nothing, and the next readout forks a new worker
+    process_streamer.close()
+    start_readout(process_streamer, 21, [0], [1], zero_copy=False)
+    check_data(read_all(process_streamer), 21, [0], [1])
+    assert process_streamer.readout_worker.is_alive()
@@ -0,0 +1,277 @@
+import copy
+import random
+
+import numpy as np
+import pytest
+
+from qick.tprocv2_assembler import Assembler, IntInstruction, Logger
+
+LABELS = {'L1': '&5', 'L2': '&1500'}
+
+# instructions that the integer encoder handles
+INT_ENCODED = [
+    {'CMD': 'NOP'},
+    {'CMD': 'REG_WR', 'DST': 'r3', 'SRC': 'op', 'OP': 'r4'},
+    {'CMD': 'REG_WR', 'DST': 's14', 'SRC': 'op', 'OP': 'r15 + r2'},
+    {'CMD': 'REG_WR', 'DST': 'w2', 'SRC': 'op', 'OP': 'w1 - #100'},
+    {'CMD': 'REG_WR', 'DST': 'r1', 'SRC': 'op', 'OP': 'r2 SL #3'},
+    {'CMD': 'REG_WR', 'DST': 'r2', 'SRC': 'op', 'OP': 'r2 - #1', 'UF': '1'},
+    {'CMD': 'REG_WR', 'DST': 'r5', 'SRC': 'imm', 'LIT': '#-123456'},
+    {'CMD': 'REG_WR', 'DST': 'r5', 'SRC': 'imm', 'LIT': '#h7FFFFFFF'},
+    {'CMD': 'REG_WR', 'DST': 'r5', 'SRC': 'imm', 'LIT': '#u4000000000'},
+    {'CMD': 'REG_WR', 'DST': 'r5', 'SRC': 'imm', 'LIT': '#b1011', 'IF': 'Z'},
+    {'CMD': 'REG_WR', 'DST': 'r_wave', 'SRC': 'wmem', 'ADDR': '&12'},
+    {'CMD': 'WMEM_WR', 'DST': '&100'},
+    {'CMD': 'WMEM_WR', 'DST': '&100', 'TIME': '@250'},
+    {'CMD': 'WMEM_WR', 'DST': '&100', 'TIME': '@-5'},
+    {'CMD': 'TEST', 'OP': 'r3 - #10', 'UF': '1'},
+    {'CMD': 'TEST', 'OP': 'r3 AND r4', 'UF': '1'},
+    {'CMD': 'TEST', 'OP': 'r3 - #70000', 'UF': '1'},
+    {'CMD': 'JUMP', 'ADDR': '&5'},
+    {'CMD': 'JUMP', 'LABEL': 'L1', 'IF': 'NZ'},
+    {'CMD': 'JUMP', 'ADDR': 's15'},
+    {'CMD': 'CALL', 'LABEL': 'L1'},
+    {'CMD': 'RET'},
+    {'CMD': 'TRIG', 'SRC': 'set', 'DST': '3', 'TIME': '@100'},
+    {'CMD': 'TRIG', 'SRC': 'clr', 'DST': '0'},
+    {'CMD': 'DPORT_WR', 'DST': '1', 'SRC': 'imm', 'DATA': '-5'},
+    {'CMD': 'DPORT_RD', 'DST': '1'},
+    {'CMD': 'WPORT_WR', 'DST': '4', 'SRC': 'wmem', 'ADDR': '&20', 'TIME': '@1000'},
+    {'CMD': 'WPORT_WR', 'DST': '4', 'SRC': 'r_wave'},
+    {'CMD': 'TIME', 'C_OP': 'rst'},
+    {'CMD': 'TIME', 'C_OP': 'updt', 'LIT': '#100'},
+    {'CMD': 'TIME', 'C_OP': 'set_ref', 'R1': 'r2'},
+    {'CMD': 'TIME', 'C_OP': 'inc_ref', 'LIT': '#5000'},
+    {'CMD': 'FLAG', 'C_OP': 'set'},
+    {'CMD': 'FLAG', 'C_OP': 'clr'},
+    {'CMD': 'WAIT', 'C_OP': 'time', 'TIME': '@5000', 'P_ADDR': 10},
+    {'CMD': 'WAIT', 'C_OP': 'time', 'TIME': '@-10', 'P_ADDR': 10},
+    {'CMD': 'WAIT', 'C_OP': 'port_dt', 'TIME': '@5000', 'P_ADDR': 10},
+]
+
+# instructions that are valid, but left to list2bin()
+FALLBACK_VALID = [
+    {'CMD': 'REG_WR', 'DST': 'r1', 'SRC': 'op', 'OP': 'ABS r2'},
+    {'CMD': 'REG_WR', 'DST': 'r1', 'SRC': 'op', 'OP': 'r2 SL #16'},
+    {'CMD': 'REG_WR', 'DST': 'r2', 'SRC': 'dmem', 'ADDR': '&40'},
+    {'CMD': 'REG_WR', 'DST': 'r2', 'SRC': 'dmem', 'ADDR': 'r3'},
+    {'CMD': 'REG_WR', 'DST': 's15', 'SRC': 'label', 'ADDR': '&7'},
+    {'CMD': 'REG_WR', 'DST': 'r1', 'SRC': 'op', 'OP': 'r2', 'WR': 'r1 op'},
+    {'CMD': 'DMEM_WR', 'DST': '&3', 'SRC': 'op', 'OP': 'r1'},
+    {'CMD': 'DMEM_WR', 'DST': 'r2', 'SRC': 'imm', 'LIT': '#55'},
+    {'CMD': 'DPORT_WR', 'DST': '2', 'SRC': 'reg', 'DATA': 'r3'},
+    {'CMD': 'DIV', 'NUM': 'r1', 'DEN': 'r2'},
+    {'CMD': 'DIV', 'NUM': 'r1', 'DEN': '#7'},
+    {'CMD': 'ARITH', 'C_OP': 'T', 'R1': 'r1', 'R2': 'r2'},
+    {'CMD': 'CLEAR', 'C_OP': 'all'},
+]
+
+# invalid instructions (bad registers, out-of-range values, unknown options), which are left to list2bin() to report
+FALLBACK_INVALID = [
+    {'CMD': 'REG_WR', 'DST': 'r32', 'SRC': 'op', 'OP': 'r4'},
+    {'CMD': 'REG_WR', 'DST': 'r3', 'SRC': 'op', 'OP': 's16'},
+    {'CMD': 'REG_WR', 'DST': 'w6', 'SRC': 'op', 'OP': 'r1'},
+    {'CMD': 'REG_WR', 'DST': 'r5', 'SRC': 'imm', 'LIT': '#4294967296'},
+    {'CMD': 'REG_WR', 'DST': 'r5', 'SRC': 'imm', 'LIT': '#-2147483649'},
+    {'CMD': 'REG_WR', 'DST': 'r5', 'SRC': 'imm', 'LIT': '#u4294967296'},
+    {'CMD': 'REG_WR', 'DST': 'r5', 'SRC': 'imm', 'LIT': '#b12'},
+    {'CMD': 'REG_WR', 'DST': 'r1', 'SRC': 'op', 'OP': 'r2 + #8388608'},
+    {'CMD': 'REG_WR', 'DST': 'r1', 'SRC': 'op', 'OP': 'r2 ?? r3'},
+    {'CMD': 'REG_WR', 'DST': 'r1', 'SRC': 'op', 'OP': 'r2', 'IF': 'Q'},
+    {'CMD': 'REG_WR', 'DST': 'r1', 'SRC': 'op', 'OP': 'r2', 'UF': '2'},
+    {'CMD': 'JUMP', 'ADDR': '&70000'},
+    {'CMD': 'JUMP', 'LABEL': 'NOPE'},
+    {'CMD': 'CALL', 'LABEL': 'L2'},
+    {'CMD': 'TRIG', 'SRC': 'set', 'DST': '40'},
+    {'CMD': 'TRIG', 'SRC': 'x', 'DST': '3'},
+    {'CMD': 'DPORT_WR', 'DST': '1', 'SRC': 'imm', 'DATA': '2000'},
+    {'CMD': 'DPORT_WR', 'DST': '70', 'SRC': 'imm', 'DATA': '1'},
+    {'CMD': 'WPORT_WR', 'DST': '70', 'SRC': 'wmem', 'ADDR': '&20'},
+    {'CMD': 'TIME', 'C_OP': 'bad'},
+    {'CMD': 'FLAG', 'C_OP': 'x'},
+    {'CMD': 'WAIT', 'C_OP': 'bad', 'TIME': '@5000', 'P_ADDR': 10},
+    {'CMD': 'WAIT', 'C_OP': 'qpa_dt', 'TIME': '@100', 'P_ADDR': 2000},
+    {'CMD': 'CLEAR', 'C_OP': 'x'},
+]
+
+
+@pytest.fixture(autouse=True)
+def assembler_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(Logger, 'filename', str(tmp_path / 'assembler.log'))
+
+
+def assemble(func, program_list):
+    # the result, or the type of the exception raised
+    try:
+        return func(copy.deepcopy(program_list), LABELS), None
+    except Exception as e:
+        return None, type(e)
+
+
+def check_program(program_list):
+    """Check that list2array() gives the same binary as list2bin(), or fails the same way."""
+    expected, exp_error = assemble(lambda p, l: Assembler.list2bin(p, l)[1], program_list)
+    result, error = assemble(lambda p, l: Assembler.list2array(p, l, check=exp_error is None), program_list)
+    assert error == exp_error
+    if error is None:
+        assert result.dtype == np.uint32
+        assert np.array_equal(result, np.array(expected, dtype=np.uint32).reshape(-1, 8))
+    return result
+
+
+def encode(command):
+    # IntInstruction.encode() expects the fields that list2array() fills in
+    command = dict(command, LINE=1)
+    command.setdefault('UF', '0')
+    if 'LABEL' in command and command['LABEL'] in LABELS:
+        command['ADDR'] = LABELS[command['LABEL']]
+    return IntInstruction.encode(command)
+
+
+@pytest.mark.parametrize("command", INT_ENCODED)
+def test_int_encoded(command):
+    assert encode(command) is not None
+    assert len(check_program([command])) > 0
+
+
+@pytest.mark.parametrize("command", FALLBACK_VALID)
+def test_fallback(command):
+    assert encode(command) is None
+    assert len(check_program([command])) > 0
+
+
+@pytest.mark.parametrize("command", FALLBACK_INVALID)
+def test_fallback_invalid(command):
+    assert encode(command) is None
+    result = check_program([command])
+    assert result is None or len(result) == 0
+
+
+def test_program():
+    program_list = INT_ENCODED + FALLBACK_VALID
+    result = check_program(program_list)
+    # WAIT takes two words
+    n_wait = sum(command['CMD'] == 'WAIT' for command in program_list)
+    assert result.shape == (len(program_list) + n_wait, 8)
+    # the fields that the assembler fills in are the same
+    a, b = copy.deepcopy(program_list), copy.deepcopy(program_list)
+    Assembler.list2bin(a, LABELS)
+    Assembler.list2array(b, LABELS)
+    assert a == b
+
+
+def test_program_with_error():
+    # an error anywhere gives an empty program
+    result = check_program(INT_ENCODED + FALLBACK_INVALID[:1] + FALLBACK_VALID)
+    assert len(result) == 0
+
+
+def test_check_detects_mismatch(monkeypatch):
+    monkeypatch.setattr(IntInstruction, 'encode', staticmethod(lambda command: [0]))
+    with pytest.raises(RuntimeError):
+        Assembler.list2array([{'CMD': 'TIME', 'C_OP': 'rst'}], {}, check=True)
+
+
+def random_command(r):
+    """A random instruction, which may or may not be valid."""
+    def reg():
+        return r.choice(['s', 'r', 'w', 'x', '']) + str(r.choice([0, 1, 5, 11, 14, 15, 16, 31, 32, 6]))
+
+    def lit(bits=32):
+        if r.random() < 0.5:
+            if r.random() < 0.2:
+                return '#%d' % r.randrange(-2**(bits-1) - 3, 2**(bits-1) + 3)
+            return '#%d' % r.randrange(-1000, 1000)
+        return r.choice(['#u%d' % r.randrange(0, 2**bits + 5), '#b101', '#b12', '#h%X' % r.randrange(0, 2**bits + 5),
+                         '#hff', '&%d' % r.randrange(2000), '@%d' % r.randrange(-100, 100000), '5', '#5x'])
+
+    def op():
+        k = r.randrange(4)
+        if k == 0:
+            return reg()
+        if k == 1:
+            return '%s %s %s' % (reg(), r.choice(['+', '-', 'AND', 'ASR', 'SR', 'SL', 'XOR', 'ABS', '??', '<<']),
+                                 r.choice([reg(), lit(24), '#%d' % r.randrange(0, 20)]))
+        if k == 2:
+            return 'ABS ' + reg()
+        return reg() + '-#1'
+
+    def addr():
+        return r.choice(['&%d' % r.randrange(1100), 's%d' % r.randrange(20), 'r%d' % r.randrange(20), 'r1 + &3', 'HERE', 's15'])
+
+    def maybe(key, value, p=0.3):
+        if r.random() < p:
+            d[key] = value()
+
+    cmd = r.choice(['NOP', 'REG_WR', 'REG_WR', 'REG_WR', 'WMEM_WR', 'TEST', 'JUMP', 'CALL', 'RET', 'TRIG', 'DPORT_WR',
+                    'DPORT_RD', 'WPORT_WR', 'TIME', 'FLAG', 'WAIT', 'DIV', 'ARITH', 'CLEAR'])
+    d = {'CMD': cmd}
+    if cmd == 'REG_WR':
+        d['SRC'] = r.choice(['op', 'imm', 'wmem', 'dmem', 'label'])
+        d['DST'] = r.choice([reg(), 'r_wave', 'w0'])
+        maybe('OP', op, 0.6 if d['SRC'] == 'op' else 0.2)
+        maybe('LIT', lambda: lit(r.choice([16, 32])), 0.7 if d['SRC'] == 'imm' else 0.2)
+        maybe('ADDR', addr, 0.8 if d['SRC'] in ('wmem', 'dmem', 'label') else 0.1)
+        maybe('WW', lambda: '', 0.3)
+    elif cmd == 'WMEM_WR':
+        maybe('DST', addr, 0.9)
+        maybe('TIME', lambda: '@%d' % r.randrange(-10, 10**6), 0.5)
+        maybe('OP', op)
+        maybe('LIT', lit)
+    elif cmd == 'TEST':
+        maybe('OP', op, 0.9)
+        maybe('LIT', lambda: lit(16))
+    elif cmd in ('JUMP', 'CALL'):
+        if r.random() < 0.5:
+            d['LABEL'] = r.choice(['L1', 'L2', 'NOPE'])
+        else:
+            maybe('ADDR', addr, 0.9)
+        maybe('OP', op, 0.2)
+    elif cmd == 'TRIG':
+        d['SRC'] = r.choice(['set', 'clr', 'x'])
+        d['DST'] = str(r.randrange(-2, 40))
+        maybe('TIME', lambda: '@%d' % r.randrange(-10, 10**6), 0.8)
+    elif cmd == 'DPORT_WR':
+        d['SRC'] = r.choice(['imm', 'reg'])
+        d['DST'] = str(r.randrange(0, 70))
+        maybe('DATA', lambda: str(r.randrange(-1100, 2100)), 0.9)
+        maybe('TIME', lambda: '@%d' % r.randrange(0, 10**6), 0.5)
+    elif cmd == 'DPORT_RD':
+        d['DST'] = str(r.randrange(0, 70))
+        maybe('TIME', lambda: '@%d' % r.randrange(0, 10**6), 0.3)
+    elif cmd == 'WPORT_WR':
+        d['SRC'] = r.choice(['wmem', 'r_wave'])
+        d['DST'] = str(r.randrange(0, 70))
+        maybe('ADDR', addr, 0.8)
+        maybe('WW', lambda: '', 0.3)
+        maybe('TIME', lambda: '@%d' % r.randrange(0, 10**6), 0.5)
+        maybe('OP', op, 0.1)
+    elif cmd == 'TIME':
+        d['C_OP'] = r.choice(['rst', 'updt', 'set_ref', 'inc_ref', 'bad'])
+        maybe('LIT', lit, 0.5)
+        maybe('R1', reg, 0.4)
+    elif cmd == 'FLAG':
+        d['C_OP'] = r.choice(['set', 'clr', 'x'])
+    elif cmd == 'WAIT':
+        d['C_OP'] = r.choice(['time', 'port_dt', 'div_rdy', 'div_dt', 'qpa_rdy', 'qpa_dt', 'bad'])
+        d['TIME'] = '@%d' % r.randrange(-10, 10**7)
+        d['P_ADDR'] = r.randrange(1, 1100)
+    elif cmd == 'DIV':
+        d['NUM'] = reg()
+        d['DEN'] = r.choice([reg(), lit()])
+    elif cmd == 'ARITH':
+        d['C_OP'] = 'T'
+        d['R1'] = reg()
+        d['R2'] = reg()
+    elif cmd == 'CLEAR':
+        d['C_OP'] = r.choice(['arith', 'all', 'x'])
+    maybe('IF', lambda: r.choice(['Z', 'NZ', 'S', '1', 'Q']), 0.3)
+    maybe('UF', lambda: r.choice(['0', '1']), 0.3)
+    maybe('WR', lambda: 'r1 op', 0.05)
+    return d
+
+
+def test_random_programs():
+    r = random.Random(0)
+    for i in range(2000):
+        check_program([random_command(r) for j in range(r.choice([1, 1, 1, 3]))])